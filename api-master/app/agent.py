@@ -5,34 +5,57 @@ from langchain.retrievers.multi_vector import MultiVectorRetriever
 from langchain.storage import InMemoryStore
 from langchain.schema.document import Document
 import base64
+import hashlib
 from dotenv import load_dotenv
 from app import schemas
 from app.schemas import EstimationRule
 from app.supabase import get_supabase, SupabaseError
+from app.estimation_rules import apply_rules, current_snapshot
+from app.estimator import (
+    distinct_image_count, quote_estimator, quote_features as estimator_features)
+from app.image_index import PHASH_MAX_DISTANCE, image_index
+from app.similar_quotes import format_similar_case, similar_quote_index
+from app.utils.llm_scheduler import PRIORITY_INTERACTIVE, estimate_tokens, llm_scheduler
+from app.utils.phash import BKTree, dhash, hash_to_hex
 from loguru import logger
-from typing import Dict, Any, List
+from typing import Callable, Dict, Any, List, Optional, Sequence
 from decimal import Decimal
-from pydantic import BaseModel
-import json
+from pydantic import BaseModel, Field
+import math
 import os
 
 # Load environment variables
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Log quotes whose total deviates from the local estimator by more than this share
+ESTIMATOR_DEVIATION_WARNING = float(os.getenv("ESTIMATOR_DEVIATION_WARNING", "0.5"))
+VISION_MAX_TOKENS = 4096
+REPAIR_MAX_TOKENS = 2048
+
+
+class ImageAnalysis(BaseModel):
+    """Vision analysis of a single image"""
+    image_index: int = Field(description="1-based position of the attached image")
+    items: List[str]
+    volume: float = Field(description="Volume in cubic yards for this image")
+    hazard_signals: List[str]
 
 
 class AIAnalysisResponse(BaseModel):
     """Structured response from AI analysis"""
-    volume: float
-    material_hazard_risk: float
-    access_difficulty: float
-    base_cost_estimate: float
-    hazard_surcharge: float
-    access_fee: float
-    dismantling_fee: float
+    volume: float = Field(description="Total volume in cubic yards")
+    material_hazard_risk: float = Field(description="Number between 0 and 1")
+    access_difficulty: float = Field(description="Number between 0 and 1")
+    base_cost_estimate: float = Field(description="Base cost in GBP")
+    hazard_surcharge: float = Field(description="Hazard surcharge in GBP")
+    access_fee: float = Field(description="Access fee in GBP")
+    dismantling_fee: float = Field(description="Dismantling fee in GBP")
     special_handling_requirements: List[str]
-    confidence_score: float
+    confidence_score: float = Field(description="Number between 0 and 1")
+    # Strict JSON schema mode requires every property, so no default
+    image_analyses: List[ImageAnalysis] = Field(
+        description="One entry per attached image")
 
 
 class QuoteEstimationAgent:
@@ -41,11 +64,25 @@ class QuoteEstimationAgent:
     def __init__(self):
         """Initialize the quote estimation agent with required models and stores."""
         logger.info("Initializing QuoteEstimationAgent")
+        # Retries are left to the LLM scheduler, which honours retry-after
         self.gpt4_vision = ChatOpenAI(
             model="gpt-4o-mini",
-            max_tokens=4096,
+            max_tokens=VISION_MAX_TOKENS,
+            max_retries=0,
             openai_api_key=OPENAI_API_KEY
         )
+        # Responses are constrained to the AIAnalysisResponse JSON schema.
+        # The raw message is kept so a response that still fails validation
+        # can be repaired by a text-only call instead of a new vision call.
+        self.structured_vision = self.gpt4_vision.with_structured_output(
+            AIAnalysisResponse, method="json_schema", include_raw=True)
+        self.repair_model = ChatOpenAI(
+            model="gpt-4o-mini",
+            max_tokens=REPAIR_MAX_TOKENS,
+            temperature=0,
+            max_retries=0,
+            openai_api_key=OPENAI_API_KEY
+        ).with_structured_output(AIAnalysisResponse, method="json_schema")
         self.vectorstore = Chroma(
             collection_name="estimation_rules",
             embedding_function=OpenAIEmbeddings(
@@ -124,20 +161,20 @@ class QuoteEstimationAgent:
 
         logger.info("Rules ingestion completed")
 
-    def encode_image(self, image_url: str) -> str:
+    def download_image(self, image_url: str) -> bytes:
         """
-        Download image from URL and encode it to base64.
+        Download an image from a URL.
 
         Args:
-            image_url: URL of the image to encode
+            image_url: URL of the image to download
 
         Returns:
-            str: Base64 encoded image string
+            bytes: Raw image content
 
         Raises:
-            Exception: If image download or encoding fails
+            Exception: If image download fails
         """
-        logger.debug(f"Encoding image from {image_url}")
+        logger.debug(f"Downloading image from {image_url}")
         try:
             import requests
             import os
@@ -158,13 +195,107 @@ class QuoteEstimationAgent:
             with open(filename, "wb") as f:
                 f.write(response.content)
 
-            # Encode the downloaded image
-            with open(filename, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
+            return response.content
+        except Exception as e:
+            logger.error(f"Error downloading image: {str(e)}")
+            raise
+
+    def encode_image(self, image_url: str) -> str:
+        """
+        Download image from URL and encode it to base64.
+
+        Args:
+            image_url: URL of the image to encode
+
+        Returns:
+            str: Base64 encoded image string
+
+        Raises:
+            Exception: If image download or encoding fails
+        """
+        logger.debug(f"Encoding image from {image_url}")
+        try:
+            return base64.b64encode(self.download_image(image_url)).decode('utf-8')
         except Exception as e:
             logger.error(f"Error encoding image: {str(e)}")
             raise
 
+    def _load_image_analyses(self, image_hashes: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Load stored per-image analyses by image content hash.
+
+        Args:
+            image_hashes: sha256 hashes of the images
+
+        Returns:
+            Dict mapping image hash to its stored analysis
+        """
+        if not image_hashes:
+            return {}
+
+        supabase = get_supabase(use_admin=True)
+        result = supabase.table('vision_analysis_results').select(
+            'image_hash, result_json').in_('image_hash', image_hashes).execute()
+
+        return {
+            row['image_hash']: row['result_json']
+            for row in result.data or []
+            if row.get('result_json')
+        }
+
+    def _store_image_analyses(
+        self,
+        booking_id: str,
+        rows: List[Dict[str, Any]],
+        new_hashes: Sequence[str] = ()
+    ) -> None:
+        """
+        Store per-image analyses for a booking. Images the booking already
+        has an analysis for are skipped.
+
+        Args:
+            booking_id: ID of the analysed booking
+            rows: Dicts with image_hash, image_url, phash (int or None) and
+                result_json
+            new_hashes: Hashes of images analysed by the model just now. Only
+                these are added to the perceptual hash index, reused
+                analyses are indexed already.
+        """
+        if not rows:
+            return
+
+        try:
+            supabase = get_supabase(use_admin=True)
+            supabase.table('vision_analysis_results').upsert(
+                [
+                    {
+                        **row,
+                        "booking_id": booking_id,
+                        "phash": hash_to_hex(row["phash"]) if row["phash"] is not None else None
+                    }
+                    for row in rows
+                ],
+                on_conflict='booking_id,image_hash',
+                ignore_duplicates=True
+            ).execute()
+        except Exception as e:
+            # The quote is still valid, the images are just analysed again next time
+            logger.warning(
+                f"Failed to store image analyses for booking {booking_id}: {str(e)}")
+            return
+
+        new = set(new_hashes)
+        for row in rows:
+            if row["phash"] is not None and row["image_hash"] in new:
+                image_index.add(row["phash"], row["image_hash"], row["result_json"])
+
+    @staticmethod
+    def _summarize_image_analysis(analysis: Dict[str, Any]) -> str:
+        """Format a stored image analysis for the prompt."""
+        items = ", ".join(analysis.get("items") or []) or "none identified"
+        hazards = ", ".join(analysis.get("hazard_signals") or []) or "none"
+        return f"items: {items}; volume: {analysis.get('volume', 0)} cubic yards; hazards: {hazards}"
+
     def _get_relevant_rules_context(self, booking_details: Dict[str, Any]) -> str:
         """
         Retrieve relevant rules and context from the vector store using the new invoke method.
@@ -199,13 +330,116 @@ class QuoteEstimationAgent:
 
         return context
 
-    def analyze_booking(self, booking_id: str) -> Dict[str, Any]:
+    def load_booking_data(self, booking_id: str) -> Dict[str, Any]:
+        """
+        Load a booking with its media uploads and customer details.
+
+        The related rows are embedded in a single query.
+
+        Args:
+            booking_id: ID of the booking to load
+
+        Returns:
+            Dict containing the booking row with ``media_uploads`` and
+            ``customer_details`` lists
+
+        Raises:
+            ValueError: If booking not found
+        """
+        supabase = get_supabase(use_admin=True)
+        result = supabase.table('bookings').select(
+            '*, media_uploads(*), customer_details(*)').eq('id', booking_id).execute()
+
+        if not result.data:
+            logger.error(f"Booking {booking_id} not found")
+            raise ValueError(f"Booking {booking_id} not found")
+
+        return result.data[0]
+
+    def _repair_analysis(
+        self,
+        raw: Any,
+        error: Optional[Exception],
+        priority: int = PRIORITY_INTERACTIVE
+    ) -> AIAnalysisResponse:
+        """
+        Repair a vision response that failed schema validation with a cheap
+        text-only call, so the vision call does not have to be repeated.
+
+        Args:
+            raw: Raw model message of the vision call
+            error: Validation error of the response
+            priority: LLM scheduler priority of the quote
+
+        Returns:
+            AIAnalysisResponse: The repaired analysis
+
+        Raises:
+            ValueError: If the response is empty or cannot be repaired
+        """
+        content = getattr(raw, "content", None)
+        if not content:
+            raise ValueError("Empty response from AI")
+
+        logger.warning(f"AI response failed validation, repairing: {str(error)}")
+        messages = [
+            AIMessage(content=(
+                "You correct JSON so it matches the required schema. Keep every "
+                "valid value unchanged and do not invent new estimates.")),
+            HumanMessage(content=f"Validation error: {error}\n\nJSON to correct:\n{content}")
+        ]
+        try:
+            return llm_scheduler.run(
+                lambda: self.repair_model.invoke(messages),
+                estimate_tokens(str(content), max_output_tokens=REPAIR_MAX_TOKENS),
+                priority=priority
+            )
+        except Exception as e:
+            logger.error(f"Failed response content: {content}")
+            raise ValueError(f"Invalid response from AI: {str(e)}")
+
+    @staticmethod
+    def _provisional_analysis(price: Dict[str, float], volume: float) -> AIAnalysisResponse:
+        """
+        Build an analysis from a local estimator price, used when the model
+        is unavailable. The zero confidence keeps it from being reused.
+
+        Args:
+            price: Price components from the quote estimator
+            volume: Volume known from previously analysed images
+
+        Returns:
+            AIAnalysisResponse: The provisional analysis
+        """
+        return AIAnalysisResponse(
+            volume=volume,
+            material_hazard_risk=0.0,
+            access_difficulty=0.0,
+            base_cost_estimate=price["base_rate"],
+            hazard_surcharge=price["hazard_surcharge"],
+            access_fee=price["access_fee"],
+            dismantling_fee=price["dismantling_fee"],
+            special_handling_requirements=[],
+            confidence_score=0.0,
+            image_analyses=[]
+        )
+
+    def analyze_booking(
+        self,
+        booking_id: str,
+        booking_data: Optional[Dict[str, Any]] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        progress: Optional[Callable[[str, Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
         """
         Analyze booking details, customer info, and media uploads to generate a quote.
         Uses RAG to provide relevant context to the AI for more accurate estimations.
 
         Args:
             booking_id: ID of the booking to analyze
+            booking_data: Booking graph from load_booking_data, loaded if not given
+            priority: LLM scheduler priority, PRIORITY_BATCH for non-customer re-quotes
+            progress: Called with an event name and details as each stage completes
 
         Returns:
             Dict containing quote breakdown and compliance info
@@ -215,164 +449,269 @@ class QuoteEstimationAgent:
             SupabaseError: If database operations fail
         """
         logger.info(f"Starting analysis for booking {booking_id}")
+        report = progress or (lambda event, data: None)
 
         try:
-            # Get booking with all related data from Supabase
             supabase = get_supabase(use_admin=True)
-            booking_result = supabase.table('bookings').select(
-                '*').eq('id', booking_id).execute()
 
-            if not booking_result.data:
-                logger.error(f"Booking {booking_id} not found")
-                raise ValueError(f"Booking {booking_id} not found")
+            # Get booking with all related data in one query
+            if booking_data is None:
+                booking_data = self.load_booking_data(booking_id)
 
-            booking = schemas.BookingCreate(**booking_result.data[0])
+            booking = schemas.BookingCreate(**booking_data)
 
-            # Get media uploads
-            media_result = supabase.table('media_uploads').select(
-                '*').eq('booking_id', booking_id).execute()
-
-            if not media_result.data:
+            media_rows = booking_data.get('media_uploads') or []
+            if not media_rows:
                 logger.error(
                     f"No media uploads found for booking {booking_id}")
                 raise ValueError("Media uploads required for analysis")
 
             media_uploads = [schemas.MediaUploadRequest(
-                **media) for media in media_result.data]
+                **media) for media in media_rows]
 
-            # Get customer details
-            customer_result = supabase.table('customer_details').select(
-                '*').eq('booking_id', booking_id).execute()
+            customer_rows = booking_data.get('customer_details') or []
             customer = schemas.CustomerDetails(
-                **customer_result.data[0]) if customer_result.data else None
-
-            # Get applicable estimation rules
-            rules_result = supabase.table('estimation_rules').select(
-                '*').eq('active', True).like('postcode_prefix', f"{booking.postcode[:3]}%").execute()
-            postcode_rules = [EstimationRule(**rule)
-                              for rule in rules_result.data]
-
-            # Analyze images with GPT-4V
-            image_prompts = []
+                **customer_rows[0]) if customer_rows else None
+            report("data_loaded", {"media_uploads": len(media_uploads)})
+
+            # Hash every image so images analysed before (in this or any
+            # other booking) are not sent to the model again
+            images: Dict[str, Dict[str, Any]] = {}
+            booking_phashes: BKTree = BKTree()
+            near_duplicates = 0
             for media in media_uploads:
                 # Process each image URL in the array
                 for image_url in media.image_urls:
-                    encoded_image = self.encode_image(image_url)
-                    image_prompts.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{encoded_image}"
-                        }
-                    })
+                    content = self.download_image(image_url)
+                    image_hash = hashlib.sha256(content).hexdigest()
+                    if image_hash in images:
+                        continue
+
+                    # Drop near-duplicates within the booking (bursts, resized copies)
+                    phash = dhash(content)
+                    if phash is not None:
+                        if booking_phashes.search(phash, PHASH_MAX_DISTANCE):
+                            near_duplicates += 1
+                            continue
+                        booking_phashes.add(phash, image_hash)
+
+                    images[image_hash] = {
+                        "url": image_url, "content": content, "phash": phash}
+
+            cached_analyses = self._load_image_analyses(list(images))
+
+            # Reuse analyses of near-identical images from earlier bookings,
+            # if enabled with PHASH_CROSS_BOOKING_MAX_DISTANCE
+            for image_hash, image in images.items():
+                if image_hash not in cached_analyses and image["phash"] is not None:
+                    match = image_index.find(image["phash"])
+                    if match:
+                        cached_analyses[image_hash] = match["result_json"]
+
+            new_hashes = [h for h in images if h not in cached_analyses]
+            logger.info(
+                f"Booking {booking_id}: {len(new_hashes)} new images, {len(cached_analyses)} previously analysed, "
+                f"{near_duplicates} near-duplicates dropped")
+            report("images_fetched", {
+                "images": len(images),
+                "new_images": len(new_hashes),
+                "near_duplicates": near_duplicates
+            })
+
+            # Get applicable estimation rules from the current compiled rule
+            # snapshot. The quote records the snapshot so it can be reproduced.
+            rule_snapshot = current_snapshot()
+            postcode_rules = rule_snapshot.rules_for_postcode(booking.postcode)
+            report("rules_retrieved", {
+                "rules": len(postcode_rules),
+                "snapshot_version": rule_snapshot.version
+            })
+
+            image_prompts = []
+            for image_hash in new_hashes:
+                encoded_image = base64.b64encode(
+                    images[image_hash]["content"]).decode('utf-8')
+                image_prompts.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{encoded_image}"
+                    }
+                })
+
+            cached_context = ""
+            if cached_analyses:
+                cached_context = "Previously analysed images (not attached):\n" + "\n".join(
+                    f"- {self._summarize_image_analysis(analysis)}"
+                    for analysis in cached_analyses.values()
+                )
 
-            # Get relevant context from vector store
-            booking_details = {
+            # Look up similar historical quotes. When every image was
+            # analysed before and the closest match is near enough and was
+            # confidently priced, reuse its pricing instead of calling the model.
+            cached_volume = sum(
+                float(analysis.get("volume") or 0) for analysis in cached_analyses.values())
+            quote_features = {
                 "postcode": booking.postcode,
                 "location": media_uploads[0].waste_location,
                 "access_restricted": media_uploads[0].access_restricted,
-                "dismantling_required": media_uploads[0].dismantling_required
+                "dismantling_required": media_uploads[0].dismantling_required,
+                "volume": cached_volume
             }
-            relevant_context = self._get_relevant_rules_context(
-                booking_details)
-
-            # Build enhanced prompt with explicit JSON structure
-            prompt = [
-                AIMessage(
-                    content="You are an expert waste removal cost estimator. Respond only with valid JSON."),
-                HumanMessage(content=[
-                    {"type": "text", "text": f"""
-                    Analyze these images and details to generate a quote estimation. 
-                    Respond with a JSON object using this exact structure:
-                    {{
-                        "volume": "number in cubic yards",
-                        "material_hazard_risk": "number between 0-1",
-                        "access_difficulty": "number between 0-1",
-                        "base_cost_estimate": "number in GBP",
-                        "hazard_surcharge": "number in GBP",
-                        "access_fee": "number in GBP",
-                        "dismantling_fee": "number in GBP",
-                        "special_handling_requirements": ["requirement1", "requirement2"],
-                        "confidence_score": "number between 0-1"
-                    }}
-
-                    Context and details:
-                    {relevant_context}
-                    
-                    Location: {media_uploads[0].waste_location}
-                    Access restricted: {media_uploads[0].access_restricted}
-                    Dismantling needed: {media_uploads[0].dismantling_required}
-                    Postcode: {booking.postcode}
-                    Address: {booking.address}
-                    
-                    """},
-                    *image_prompts
-                ])
-            ]
-
-            # Get AI analysis with better error handling
-            logger.info("Getting AI analysis")
-            response = self.gpt4_vision.invoke(prompt)
-
-            try:
-                # Log the raw response for debugging
-                logger.debug(f"Raw AI response: {response.content}")
-
-                # Clean the response string
-                cleaned_response = response.content.strip()
-                if cleaned_response.startswith("```json"):
-                    cleaned_response = cleaned_response.replace(
-                        "```json", "").replace("```", "").strip()
-
-                # Parse the cleaned JSON and validate with Pydantic model
-                ai_analysis = AIAnalysisResponse(
-                    **json.loads(cleaned_response))
-
-                # Extract AI-determined values
-                ai_base_rate = Decimal(str(ai_analysis.base_cost_estimate))
-                ai_hazard_surcharge = Decimal(
-                    str(ai_analysis.hazard_surcharge))
-                ai_access_fee = Decimal(str(ai_analysis.access_fee))
-                ai_dismantling_fee = Decimal(str(ai_analysis.dismantling_fee))
-                material_risk = ai_analysis.material_hazard_risk
-                access_difficulty = ai_analysis.access_difficulty
-                volume = ai_analysis.volume
-
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON parsing error: {str(e)}")
-                logger.error(f"Failed response content: {response.content}")
-                raise ValueError(f"Invalid JSON response from AI: {str(e)}")
-            except (KeyError, ValueError) as e:
-                logger.error(f"Error processing AI response: {str(e)}")
-                raise ValueError(f"Error processing AI response: {str(e)}")
-            except Exception as e:
-                logger.error(f"Unexpected error: {str(e)}")
-                raise ValueError(
-                    f"Unexpected error processing AI response: {str(e)}")
+
+            booking_features = estimator_features(
+                image_count=distinct_image_count(media.image_urls for media in media_uploads),
+                analysed_volume=cached_volume if cached_analyses else None,
+                location=media_uploads[0].waste_location,
+                access_restricted=media_uploads[0].access_restricted,
+                dismantling_required=media_uploads[0].dismantling_required
+            )
+
+            ai_analysis = None
+            provisional_price = None
+            if images and not new_hashes:
+                ai_analysis = similar_quote_index.historical_analysis(
+                    quote_features, booking_id=booking_id)
+
+            if ai_analysis is None:
+                # Get relevant context from vector store
+                booking_details = {
+                    "postcode": booking.postcode,
+                    "location": media_uploads[0].waste_location,
+                    "access_restricted": media_uploads[0].access_restricted,
+                    "dismantling_required": media_uploads[0].dismantling_required
+                }
+                relevant_context = self._get_relevant_rules_context(
+                    booking_details)
+
+                # Build prompt. The response format is enforced by the schema.
+                prompt = [
+                    AIMessage(
+                        content="You are an expert waste removal cost estimator."),
+                    HumanMessage(content=[
+                        {"type": "text", "text": f"""
+                        Analyze these images and details to generate a quote estimation.
+                        The volume and costs must cover both the attached images and
+                        any previously analysed images listed below.
+                        Include one image_analyses entry per attached image.
+
+                        Context and details:
+                        {relevant_context}
+
+                        {cached_context}
+
+                        Location: {media_uploads[0].waste_location}
+                        Access restricted: {media_uploads[0].access_restricted}
+                        Dismantling needed: {media_uploads[0].dismantling_required}
+                        Postcode: {booking.postcode}
+                        Address: {booking.address}
+
+                        """},
+                        *image_prompts
+                    ])
+                ]
+
+                # Get AI analysis, falling back to the local estimator
+                logger.info("Getting AI analysis")
+                report("model_running", {"images": len(image_prompts)})
+                try:
+                    result = llm_scheduler.run(
+                        lambda: self.structured_vision.invoke(prompt),
+                        estimate_tokens(
+                            prompt[1].content[0]["text"],
+                            images=len(image_prompts),
+                            max_output_tokens=VISION_MAX_TOKENS),
+                        priority=priority,
+                        usage=lambda result: (
+                            getattr(result["raw"], "usage_metadata", None) or {}).get("total_tokens")
+                    )
+                except Exception as e:
+                    # The estimator learned from the volume of every image, so
+                    # it can only stand in when every image has an analysis
+                    if new_hashes:
+                        raise
+                    provisional_price = quote_estimator.estimate(booking_features)
+                    if provisional_price is None:
+                        raise
+                    logger.warning(
+                        f"AI analysis failed, using provisional estimate for booking {booking_id}: {str(e)}")
+                    ai_analysis = self._provisional_analysis(
+                        provisional_price, cached_volume)
+                    # The estimator learned from rule-adjusted prices
+                    postcode_rules = ()
+                else:
+                    ai_analysis = result["parsed"]
+                    if ai_analysis is None:
+                        ai_analysis = self._repair_analysis(
+                            result["raw"], result["parsing_error"], priority)
+
+            # Extract AI-determined values
+            ai_base_rate = Decimal(str(ai_analysis.base_cost_estimate))
+            ai_hazard_surcharge = Decimal(
+                str(ai_analysis.hazard_surcharge))
+            ai_access_fee = Decimal(str(ai_analysis.access_fee))
+            ai_dismantling_fee = Decimal(str(ai_analysis.dismantling_fee))
+            material_risk = ai_analysis.material_hazard_risk
+            access_difficulty = ai_analysis.access_difficulty
+            volume = ai_analysis.volume
+
+            # Similar past quotes for the explanation, matched on the final volume
+            quote_features["volume"] = volume
+            similar_cases = similar_quote_index.find_similar(
+                quote_features, booking_id=booking_id)
+
+            # Persist the new per-image analyses, and link reused ones to
+            # this booking so they survive deletion of the original booking
+            analysis_rows = []
+            for image_analysis in ai_analysis.image_analyses:
+                position = image_analysis.image_index - 1
+                if 0 <= position < len(new_hashes):
+                    image_hash = new_hashes[position]
+                    analysis_rows.append({
+                        "image_hash": image_hash,
+                        "image_url": images[image_hash]["url"],
+                        "phash": images[image_hash]["phash"],
+                        "result_json": image_analysis.model_dump(exclude={"image_index"})
+                    })
+            for image_hash, analysis in cached_analyses.items():
+                analysis_rows.append({
+                    "image_hash": image_hash,
+                    "image_url": images[image_hash]["url"],
+                    "phash": images[image_hash]["phash"],
+                    "result_json": analysis
+                })
+            self._store_image_analyses(booking_id, analysis_rows, new_hashes)
 
             # Apply rules as minor adjustments (10% influence)
-            # Rules influence 10% of final price
-            adjustment_factor = Decimal('0.1')
-
-            for rule in postcode_rules:
-                if rule.rule_type == "base_rate_adjustment":
-                    ai_base_rate += (Decimal(str(rule.base_rate))
-                                     * adjustment_factor)
-                elif rule.rule_type == "hazard_multiplier" and material_risk > 0.3:
-                    ai_hazard_surcharge += (
-                        Decimal(str(rule.hazard_surcharge or '0.00')) * adjustment_factor)
-
-                # Apply minimal rule-based adjustments to fees
-                if media_uploads[0].access_restricted and rule.access_fee:
-                    ai_access_fee += (Decimal(str(rule.access_fee))
-                                      * adjustment_factor)
-                if media_uploads[0].dismantling_required and rule.dismantling_fee:
-                    ai_dismantling_fee += (Decimal(str(rule.dismantling_fee))
-                                           * adjustment_factor)
+            ai_base_rate, ai_hazard_surcharge, ai_access_fee, ai_dismantling_fee = apply_rules(
+                postcode_rules,
+                ai_base_rate,
+                ai_hazard_surcharge,
+                ai_access_fee,
+                ai_dismantling_fee,
+                material_risk=material_risk,
+                access_restricted=media_uploads[0].access_restricted,
+                dismantling_required=media_uploads[0].dismantling_required
+            )
 
             # Calculate total price
             total_price = float(
                 ai_base_rate + ai_hazard_surcharge + ai_access_fee + ai_dismantling_fee)
 
+            # Compare the model's price with the local estimator
+            estimator_check = {"provisional": provisional_price is not None}
+            if provisional_price is None:
+                booking_features["log_analysed_volume"] = math.log1p(max(volume, 0.0))
+                booking_features["has_analysed_volume"] = 1.0
+                estimate = quote_estimator.estimate(booking_features)
+                if estimate and estimate["total"] > 0:
+                    deviation = (total_price - estimate["total"]) / estimate["total"]
+                    estimator_check.update(
+                        estimated_total=estimate["total"], deviation=round(deviation, 3))
+                    if abs(deviation) > ESTIMATOR_DEVIATION_WARNING:
+                        logger.warning(
+                            f"Quote for booking {booking_id} of {total_price:.2f} deviates "
+                            f"{deviation:+.0%} from the local estimate of {estimate['total']:.2f}")
+
             # Build response dictionary matching the TypeScript interface and Pydantic models
             response_dict = {
                 "breakdown": {
@@ -388,9 +727,15 @@ class QuoteEstimationAgent:
                     }
                 },
                 "compliance": ai_analysis.special_handling_requirements,
+                # Model output before rule adjustments, used to reprice from history
+                "ai_analysis": ai_analysis.model_dump(exclude={"image_analyses"}),
+                "rule_snapshot": rule_snapshot.reference(),
                 "explanation": {
                     "heatmapUrl": None,
-                    "similarCases": [],
+                    "estimator": estimator_check,
+                    "similarCases": [
+                        format_similar_case(distance, case) for distance, case in similar_cases
+                    ],
                     "applied_rules": [
                         {
                             "rule_id": rule.id,
@@ -0,0 +1,156 @@
+"""
+Command line maintenance tasks.
+
+Usage:
+    python -m app.cli replay-stripe-events [--parallelism 8] [--include-pending]
+    python -m app.cli reconcile-stripe [--since 2024-02-20] [--until 2024-02-21] [--dry-run]
+    python -m app.cli train-estimator [--alpha 1.0]
+    python -m app.cli estimate --images 4 [--volume 6.5] [--location garden] [--access-restricted]
+"""
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime
+
+from loguru import logger
+
+from app.supabase import init_supabase
+
+
+async def replay_stripe_events(args: argparse.Namespace) -> int:
+    """Replay unprocessed Stripe webhook events and print the outcome."""
+    from app.routes.payments import process_stripe_event
+    from app.utils.stripe_events import replay_unprocessed_events
+
+    await init_supabase()
+    stats = await replay_unprocessed_events(
+        process_stripe_event,
+        parallelism=args.parallelism,
+        page_size=args.page_size,
+        failed_only=not args.include_pending,
+        event_type=args.event_type,
+        limit=args.limit
+    )
+    print(json.dumps(stats, indent=2))
+    return 1 if stats["failed"] else 0
+
+
+async def reconcile_stripe(args: argparse.Namespace) -> int:
+    """Reconcile stripe_payments with Stripe and print the outcome."""
+    from app.reconciliation import reconcile_stripe_payments
+
+    await init_supabase()
+    result = await asyncio.to_thread(
+        reconcile_stripe_payments, args.since, args.until, args.dry_run)
+    print(json.dumps(result, indent=2, default=str))
+    return 0
+
+
+async def train_estimator(args: argparse.Namespace) -> int:
+    """Train the local quote estimator on stored quotes and print its error."""
+    from app.estimator import QUOTE_ESTIMATOR_PATH, train_estimator as train
+
+    await init_supabase()
+    metadata = await asyncio.to_thread(
+        train, args.output or QUOTE_ESTIMATOR_PATH, args.alpha)
+    print(json.dumps(metadata, indent=2))
+    return 0
+
+
+async def estimate(args: argparse.Namespace) -> int:
+    """Print the local estimator's price for the given booking features."""
+    from app.estimator import QUOTE_ESTIMATOR_PATH, EstimatorHandle, quote_features
+
+    model_path = args.model or QUOTE_ESTIMATOR_PATH
+    price = EstimatorHandle(model_path).estimate(quote_features(
+        image_count=args.images,
+        analysed_volume=args.volume,
+        location=args.location,
+        access_restricted=args.access_restricted,
+        dismantling_required=args.dismantling_required
+    ))
+    if price is None:
+        logger.error(f"No trained estimator at {model_path}")
+        return 1
+    print(json.dumps(price, indent=2))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the argument parser with one subcommand per task."""
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    replay = subparsers.add_parser(
+        "replay-stripe-events",
+        help="Re-dispatch unprocessed Stripe webhook events"
+    )
+    replay.add_argument("--parallelism", type=int, default=4,
+                        help="Events processed concurrently (default: 4)")
+    replay.add_argument("--page-size", type=int, default=200,
+                        help="Rows fetched per database round trip (default: 200)")
+    replay.add_argument("--include-pending", action="store_true",
+                        help="Also replay unprocessed events without a recorded error. "
+                             "Only use this while the API's event worker is not running.")
+    replay.add_argument("--event-type",
+                        help="Only replay events of this type")
+    replay.add_argument("--limit", type=int,
+                        help="Stop after this many events")
+    replay.set_defaults(handler=replay_stripe_events)
+
+    reconcile = subparsers.add_parser(
+        "reconcile-stripe",
+        help="Correct stripe_payments from Stripe's list APIs for a creation window"
+    )
+    reconcile.add_argument("--since", type=datetime.fromisoformat,
+                           help="Start of the window, ISO 8601, UTC if no offset "
+                                "(default: 24 hours before --until)")
+    reconcile.add_argument("--until", type=datetime.fromisoformat,
+                           help="End of the window, ISO 8601 (default: now)")
+    reconcile.add_argument("--dry-run", action="store_true",
+                           help="Only report corrections, do not write them")
+    reconcile.set_defaults(handler=reconcile_stripe)
+
+    train = subparsers.add_parser(
+        "train-estimator",
+        help="Train the local quote estimator on stored quotes"
+    )
+    train.add_argument("--output",
+                       help="Where to save the model (default: $QUOTE_ESTIMATOR_PATH "
+                            "or db/quote_estimator.json)")
+    train.add_argument("--alpha", type=float, default=1.0,
+                       help="L2 regularization strength (default: 1.0)")
+    train.set_defaults(handler=train_estimator)
+
+    predict = subparsers.add_parser(
+        "estimate",
+        help="Price a booking with the local quote estimator"
+    )
+    predict.add_argument("--images", type=int, required=True,
+                         help="Number of images")
+    predict.add_argument("--volume", type=float,
+                         help="Volume in cubic yards from analysed images, if known")
+    predict.add_argument("--location",
+                         help="Waste location")
+    predict.add_argument("--access-restricted", action="store_true")
+    predict.add_argument("--dismantling-required", action="store_true")
+    predict.add_argument("--model",
+                         help="Trained model (default: as for train-estimator)")
+    predict.set_defaults(handler=estimate)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    """Run the requested command and return its exit code."""
+    args = build_parser().parse_args(argv)
+    try:
+        return asyncio.run(args.handler(args))
+    except Exception as e:
+        logger.error(f"{args.command} failed: {str(e)}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
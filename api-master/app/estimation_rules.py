@@ -0,0 +1,283 @@
+"""
+Versioned, compiled snapshots of the active estimation rules.
+
+The active rule set is loaded once and compiled into an immutable
+:class:`RuleSnapshot`: a flat plan of precomputed adjustment amounts indexed
+by postcode prefix, so applying rules to a quote needs no database read and
+no per-rule type checks. Every distinct rule set is identified by a content
+hash and registered in estimation_rule_snapshots, which assigns it the next
+version. Quotes record the version they were priced with, and
+:func:`load_rule_snapshot` rebuilds that exact rule set later.
+
+Admin edits compile the new rule set and swap it in as a whole. Quotes that
+already hold the previous snapshot finish with it. Other workers pick up
+edits after ``ACTIVE_RULES_TTL_SECONDS``.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from decimal import Decimal
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from app.schemas import EstimationRule
+from app.supabase import get_supabase
+
+ACTIVE_RULES_TTL_SECONDS = float(os.getenv("ACTIVE_RULES_TTL_SECONDS", "300"))
+
+# Rules adjust the AI price by a tenth of their configured amounts
+RULE_ADJUSTMENT_FACTOR = Decimal("0.1")
+# Hazard multiplier rules only apply above this material hazard risk
+HAZARD_RISK_THRESHOLD = 0.3
+
+# Quotes are matched to rules by the first characters of the postcode
+POSTCODE_PREFIX_LENGTH = 3
+
+ZERO = Decimal("0")
+
+# Version of a snapshot that could not be registered yet
+UNREGISTERED_VERSION = 0
+
+
+class CompiledRule(NamedTuple):
+    """A rule reduced to the adjustments it adds to a quote."""
+    id: str
+    rule_name: str
+    rule_type: str
+    multiplier: float
+    base_rate: Decimal
+    hazard_surcharge: Decimal
+    access_fee: Decimal
+    dismantling_fee: Decimal
+
+
+def _amount(value: Optional[float]) -> Decimal:
+    """Adjustment a rule amount adds to a quote."""
+    return Decimal(str(value)) * RULE_ADJUSTMENT_FACTOR if value else ZERO
+
+
+def compile_rule(rule: EstimationRule) -> CompiledRule:
+    """
+    Precompute the adjustments of a rule.
+
+    Args:
+        rule: Estimation rule
+
+    Returns:
+        CompiledRule: The rule's adjustment amounts
+    """
+    return CompiledRule(
+        id=rule.id,
+        rule_name=rule.rule_name,
+        rule_type=rule.rule_type,
+        multiplier=float(rule.multiplier),
+        base_rate=_amount(rule.base_rate) if rule.rule_type == "base_rate_adjustment" else ZERO,
+        hazard_surcharge=(
+            _amount(rule.hazard_surcharge) if rule.rule_type == "hazard_multiplier" else ZERO),
+        access_fee=_amount(rule.access_fee),
+        dismantling_fee=_amount(rule.dismantling_fee)
+    )
+
+
+def content_hash(rules: Sequence[EstimationRule]) -> str:
+    """
+    Hash a rule set independently of row order and timestamps.
+
+    Args:
+        rules: Estimation rules
+
+    Returns:
+        str: Hex sha256 of the canonical rule set
+    """
+    canonical = sorted(
+        (rule.model_dump(mode="json", exclude={"created_at", "updated_at"}) for rule in rules),
+        key=lambda rule: rule["id"])
+    return hashlib.sha256(
+        json.dumps(canonical, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+class RuleSnapshot:
+    """Immutable, compiled version of the active rule set."""
+
+    def __init__(self, version: int, content_hash: str, rules: Sequence[EstimationRule]):
+        self.version = version
+        self.content_hash = content_hash
+        self.rules: Tuple[EstimationRule, ...] = tuple(rules)
+        self.plan: Tuple[CompiledRule, ...] = tuple(compile_rule(rule) for rule in self.rules)
+
+        # A rule applies to a postcode when the rule's prefix starts with the
+        # postcode's first characters, so index the plan by those characters
+        by_prefix: Dict[str, List[CompiledRule]] = {}
+        for rule, compiled in zip(self.rules, self.plan):
+            prefix = rule.postcode_prefix or ""
+            if len(prefix) >= POSTCODE_PREFIX_LENGTH:
+                by_prefix.setdefault(prefix[:POSTCODE_PREFIX_LENGTH], []).append(compiled)
+        self._by_prefix = {prefix: tuple(plan) for prefix, plan in by_prefix.items()}
+
+    def rules_for_postcode(self, postcode: str) -> Tuple[CompiledRule, ...]:
+        """
+        Return the compiled rules whose postcode prefix starts with the
+        postcode's first three characters.
+
+        Args:
+            postcode: Booking postcode
+
+        Returns:
+            Tuple[CompiledRule, ...]: Matching rules
+        """
+        prefix = postcode[:POSTCODE_PREFIX_LENGTH]
+        if len(prefix) == POSTCODE_PREFIX_LENGTH:
+            return self._by_prefix.get(prefix, ())
+        return tuple(
+            compiled for rule, compiled in zip(self.rules, self.plan)
+            if rule.postcode_prefix and rule.postcode_prefix.startswith(prefix)
+        )
+
+    def reference(self) -> Dict[str, object]:
+        """Identify the snapshot in a stored quote."""
+        return {"version": self.version, "content_hash": self.content_hash}
+
+
+def apply_rules(
+    rules: Sequence[CompiledRule],
+    base_rate: Decimal,
+    hazard_surcharge: Decimal,
+    access_fee: Decimal,
+    dismantling_fee: Decimal,
+    material_risk: float,
+    access_restricted: bool,
+    dismantling_required: bool
+) -> Tuple[Decimal, Decimal, Decimal, Decimal]:
+    """
+    Apply compiled rules as minor adjustments to the AI price components.
+
+    Args:
+        rules: Compiled rules matching the booking
+        base_rate: AI base cost estimate
+        hazard_surcharge: AI hazard surcharge
+        access_fee: AI access fee
+        dismantling_fee: AI dismantling fee
+        material_risk: AI material hazard risk
+        access_restricted: Whether access is restricted
+        dismantling_required: Whether dismantling is required
+
+    Returns:
+        Adjusted base rate, hazard surcharge, access fee and dismantling fee
+    """
+    hazardous = material_risk > HAZARD_RISK_THRESHOLD
+    for rule in rules:
+        base_rate += rule.base_rate
+        if hazardous:
+            hazard_surcharge += rule.hazard_surcharge
+        if access_restricted:
+            access_fee += rule.access_fee
+        if dismantling_required:
+            dismantling_fee += rule.dismantling_fee
+    return base_rate, hazard_surcharge, access_fee, dismantling_fee
+
+
+def _register_snapshot(rules: Sequence[EstimationRule]) -> RuleSnapshot:
+    """Return the snapshot of a rule set, registering a new version if unseen."""
+    rules_hash = content_hash(rules)
+    supabase = get_supabase(use_admin=True)
+    try:
+        supabase.table("estimation_rule_snapshots").upsert(
+            {
+                "content_hash": rules_hash,
+                "rules": [rule.model_dump(mode="json") for rule in rules]
+            },
+            on_conflict="content_hash",
+            ignore_duplicates=True
+        ).execute()
+        result = supabase.table("estimation_rule_snapshots").select(
+            "version").eq("content_hash", rules_hash).execute()
+        version = result.data[0]["version"]
+    except Exception as e:
+        # Pricing must not fail on bookkeeping. The hash still identifies the
+        # rules, and registration is retried on the next refresh.
+        logger.warning(f"Failed to register estimation rule snapshot: {str(e)}")
+        version = UNREGISTERED_VERSION
+    return RuleSnapshot(version, rules_hash, rules)
+
+
+# The current snapshot is replaced as a whole, never modified in place
+_current: Optional[RuleSnapshot] = None
+_checked_at = 0.0
+# Serializes reloads so a stale snapshot is only rebuilt once
+_load_lock = threading.Lock()
+
+
+def refresh_rule_snapshot() -> RuleSnapshot:
+    """
+    Reload the active rules and swap in their snapshot, e.g. after an admin
+    changed a rule. An unchanged rule set keeps its snapshot, unless it
+    still has to be registered.
+
+    Returns:
+        RuleSnapshot: The current snapshot
+    """
+    global _current, _checked_at
+
+    with _load_lock:
+        supabase = get_supabase(use_admin=True)
+        result = supabase.table("estimation_rules").select(
+            "*").eq("active", True).execute()
+        rules = [EstimationRule(**rule) for rule in result.data or []]
+
+        if (
+            _current is None
+            or _current.version == UNREGISTERED_VERSION
+            or content_hash(rules) != _current.content_hash
+        ):
+            _current = _register_snapshot(rules)
+            logger.info(
+                f"Using estimation rule snapshot v{_current.version} with {len(rules)} active rules")
+        _checked_at = time.monotonic()
+        return _current
+
+
+def current_snapshot() -> RuleSnapshot:
+    """
+    Return the current rule snapshot, refreshing it if stale.
+
+    Returns:
+        RuleSnapshot: Snapshot to price a quote with
+    """
+    snapshot = _current
+    if snapshot is None or time.monotonic() - _checked_at > ACTIVE_RULES_TTL_SECONDS:
+        snapshot = refresh_rule_snapshot()
+    return snapshot
+
+
+def get_active_rules() -> List[EstimationRule]:
+    """
+    Return all active estimation rules of the current snapshot.
+
+    Returns:
+        List[EstimationRule]: Active rules
+    """
+    return list(current_snapshot().rules)
+
+
+def load_rule_snapshot(version: int) -> Optional[RuleSnapshot]:
+    """
+    Rebuild a registered snapshot, e.g. to reproduce a stored quote.
+
+    Args:
+        version: Snapshot version recorded with the quote
+
+    Returns:
+        Optional[RuleSnapshot]: The snapshot, or None if unknown
+    """
+    supabase = get_supabase(use_admin=True)
+    result = supabase.table("estimation_rule_snapshots").select(
+        "*").eq("version", version).execute()
+    if not result.data:
+        return None
+    row = result.data[0]
+    return RuleSnapshot(
+        row["version"], row["content_hash"],
+        [EstimationRule(**rule) for rule in row["rules"]])
@@ -0,0 +1,366 @@
+"""
+Local quote estimator trained on stored quotes.
+
+A ridge regression over booking features (image count, volume from stored
+per-image analyses, waste location, access and dismantling flags) predicts
+the four price components of a quote. It runs on CPU in well under a
+millisecond, so the agent uses it as a provisional price when the vision
+model is unavailable and as a sanity check on the model's prices.
+
+The model is trained offline with ``python -m app.cli train-estimator`` and
+saved as JSON. Without a trained model the estimator is simply unavailable.
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from app.supabase import get_supabase
+from app.utils.pagination import iter_keyset_rows
+
+QUOTE_ESTIMATOR_PATH = os.getenv("QUOTE_ESTIMATOR_PATH", "db/quote_estimator.json")
+DEFAULT_ALPHA = 1.0
+# Share of bookings held out to measure the error of a trained model
+HOLDOUT_FRACTION = 0.2
+
+PRICE_COMPONENTS = ["base_rate", "hazard_surcharge", "access_fee", "dismantling_fee"]
+NUMERIC_FEATURES = [
+    "image_count", "log_analysed_volume", "has_analysed_volume",
+    "access_restricted", "dismantling_required"
+]
+
+
+def distinct_image_count(url_lists: Iterable[Optional[Iterable[str]]]) -> int:
+    """
+    Count the distinct images of a booking's media uploads.
+
+    Training and serving must count images the same way, so both use this.
+
+    Args:
+        url_lists: Image URLs of each media upload
+
+    Returns:
+        int: Number of distinct image URLs
+    """
+    return len({url for urls in url_lists for url in urls or []})
+
+
+def quote_features(
+    image_count: int,
+    analysed_volume: Optional[float],
+    location: Optional[str],
+    access_restricted: bool,
+    dismantling_required: bool
+) -> Dict[str, Any]:
+    """
+    Build the estimator features of a booking.
+
+    Args:
+        image_count: Number of distinct images
+        analysed_volume: Total volume from stored per-image analyses, None if
+            no image has been analysed
+        location: Waste location
+        access_restricted: Whether access is restricted
+        dismantling_required: Whether dismantling is required
+
+    Returns:
+        dict: Numeric features and the location
+    """
+    return {
+        "image_count": float(image_count),
+        "log_analysed_volume": math.log1p(max(analysed_volume or 0.0, 0.0)),
+        "has_analysed_volume": float(analysed_volume is not None),
+        "access_restricted": float(bool(access_restricted)),
+        "dismantling_required": float(bool(dismantling_required)),
+        "location": (location or "").lower()
+    }
+
+
+def _sample_from_booking(booking: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any], List[float]]]:
+    """Turn a quoted booking into (features, price components)."""
+    media = booking.get("media_uploads") or []
+    quote = booking.get("quote") or {}
+    components = (quote.get("breakdown") or {}).get("price_components")
+    if not media or not components:
+        return None
+    # Never learn from the estimator's own provisional prices
+    if ((quote.get("explanation") or {}).get("estimator") or {}).get("provisional"):
+        return None
+
+    analyses = booking.get("vision_analysis_results") or []
+    volumes = [
+        float(row["result_json"]["volume"]) for row in analyses
+        if (row.get("result_json") or {}).get("volume") is not None
+    ]
+    features = quote_features(
+        image_count=distinct_image_count(row.get("image_urls") for row in media),
+        analysed_volume=sum(volumes) if volumes else None,
+        location=media[0].get("waste_location"),
+        access_restricted=media[0].get("access_restricted"),
+        dismantling_required=media[0].get("dismantling_required")
+    )
+    try:
+        targets = [float(components.get(name) or 0) for name in PRICE_COMPONENTS]
+    except (TypeError, ValueError):
+        return None
+    return features, targets
+
+
+def load_training_samples() -> List[Tuple[str, Dict[str, Any], List[float]]]:
+    """
+    Load (booking ID, features, price components) for every quoted booking.
+
+    Returns:
+        List of training samples
+    """
+    supabase = get_supabase(use_admin=True)
+    rows = iter_keyset_rows(
+        lambda: supabase.table("bookings").select(
+            "id, quote, "
+            "media_uploads(image_urls, waste_location, access_restricted, dismantling_required), "
+            "vision_analysis_results(result_json)"
+        ).not_.is_("quote", "null"))
+
+    samples = []
+    for booking in rows:
+        sample = _sample_from_booking(booking)
+        if sample:
+            samples.append((booking["id"], *sample))
+    return samples
+
+
+class QuoteEstimator:
+    """Multi-output ridge regression from booking features to price components."""
+
+    def __init__(
+        self,
+        locations: List[str],
+        mean: List[float],
+        scale: List[float],
+        weights: List[List[float]],
+        metadata: Optional[Dict[str, Any]] = None
+    ):
+        self.locations = locations
+        self.mean = np.asarray(mean, dtype=float)
+        self.scale = np.asarray(scale, dtype=float)
+        self.weights = np.asarray(weights, dtype=float)
+        self.metadata = metadata or {}
+
+    def _design_matrix(self, features: List[Dict[str, Any]]) -> np.ndarray:
+        """Standardized numeric features, location one-hot and an intercept."""
+        numeric = np.array(
+            [[f[name] for name in NUMERIC_FEATURES] for f in features], dtype=float
+        ).reshape(len(features), len(NUMERIC_FEATURES))
+        locations = np.array(
+            [[f["location"] == location for location in self.locations] for f in features],
+            dtype=float
+        ).reshape(len(features), len(self.locations))
+        return np.hstack([
+            np.ones((len(features), 1)),
+            (numeric - self.mean) / self.scale,
+            locations
+        ])
+
+    @classmethod
+    def fit(
+        cls,
+        features: List[Dict[str, Any]],
+        targets: List[List[float]],
+        alpha: float = DEFAULT_ALPHA
+    ) -> "QuoteEstimator":
+        """
+        Fit the model with the closed-form ridge solution.
+
+        Args:
+            features: Features from quote_features
+            targets: Price components per sample, in PRICE_COMPONENTS order
+            alpha: L2 regularization strength
+
+        Returns:
+            QuoteEstimator: The fitted model
+        """
+        numeric = np.array(
+            [[f[name] for name in NUMERIC_FEATURES] for f in features], dtype=float)
+        scale = numeric.std(axis=0)
+        scale[scale == 0] = 1.0
+        estimator = cls(
+            locations=sorted({f["location"] for f in features}),
+            mean=numeric.mean(axis=0).tolist(),
+            scale=scale.tolist(),
+            weights=[]
+        )
+
+        x = estimator._design_matrix(features)
+        penalty = alpha * np.eye(x.shape[1])
+        penalty[0, 0] = 0.0  # Do not shrink the intercept
+        estimator.weights = np.linalg.solve(
+            x.T @ x + penalty, x.T @ np.asarray(targets, dtype=float))
+        return estimator
+
+    def predict_many(self, features: List[Dict[str, Any]]) -> np.ndarray:
+        """Predict price components (one row per sample), clipped at zero."""
+        return np.clip(self._design_matrix(features) @ self.weights, 0.0, None)
+
+    def predict(self, features: Dict[str, Any]) -> Dict[str, float]:
+        """
+        Predict the price components of one booking.
+
+        Args:
+            features: Features from quote_features
+
+        Returns:
+            dict: Price components and their total, in GBP
+        """
+        prediction = self.predict_many([features])[0]
+        components = {
+            name: round(float(value), 2) for name, value in zip(PRICE_COMPONENTS, prediction)
+        }
+        components["total"] = round(sum(components.values()), 2)
+        return components
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the model for storage as JSON."""
+        return {
+            "locations": self.locations,
+            "mean": self.mean.tolist(),
+            "scale": self.scale.tolist(),
+            "weights": self.weights.tolist(),
+            "metadata": self.metadata
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "QuoteEstimator":
+        """Load a model serialized with to_dict."""
+        return cls(**data)
+
+
+def _is_holdout(booking_id: str) -> bool:
+    """Deterministically assign a booking to the holdout set."""
+    digest = hashlib.sha256(booking_id.encode()).digest()
+    return digest[0] < 256 * HOLDOUT_FRACTION
+
+
+def _mean_absolute_error(estimator: QuoteEstimator, features, targets) -> Optional[float]:
+    """Mean absolute error of the predicted total."""
+    if not features:
+        return None
+    predicted = estimator.predict_many(features).sum(axis=1)
+    actual = np.asarray(targets, dtype=float).sum(axis=1)
+    return round(float(np.abs(predicted - actual).mean()), 2)
+
+
+def train_estimator(path: str = QUOTE_ESTIMATOR_PATH, alpha: float = DEFAULT_ALPHA) -> Dict[str, Any]:
+    """
+    Train the estimator on all stored quotes and save it.
+
+    The error is measured on a holdout share of bookings first, then the
+    saved model is fitted on all bookings.
+
+    Args:
+        path: Where to save the model
+        alpha: L2 regularization strength
+
+    Returns:
+        dict: Sample counts and mean absolute errors of the total
+
+    Raises:
+        ValueError: If there are no quoted bookings to train on
+    """
+    samples = load_training_samples()
+    if not samples:
+        raise ValueError("No quoted bookings to train on")
+
+    train = [(f, t) for booking_id, f, t in samples if not _is_holdout(booking_id)]
+    holdout = [(f, t) for booking_id, f, t in samples if _is_holdout(booking_id)]
+
+    holdout_mae = None
+    if train and holdout:
+        validation_model = QuoteEstimator.fit(*zip(*train), alpha=alpha)
+        holdout_mae = _mean_absolute_error(validation_model, *zip(*holdout))
+
+    features, targets = zip(*[(f, t) for _, f, t in samples])
+    estimator = QuoteEstimator.fit(list(features), list(targets), alpha=alpha)
+    estimator.metadata = {
+        "trained_at": datetime.now(timezone.utc).isoformat(),
+        "samples": len(samples),
+        "holdout_samples": len(holdout),
+        "alpha": alpha,
+        "training_mae": _mean_absolute_error(estimator, features, targets),
+        "holdout_mae": holdout_mae
+    }
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(estimator.to_dict(), f)
+    quote_estimator.reload()
+    logger.info(f"Trained quote estimator on {len(samples)} quotes, saved to {path}")
+    return estimator.metadata
+
+
+class EstimatorHandle:
+    """Lazily loaded, process-wide estimator."""
+
+    def __init__(self, path: str = QUOTE_ESTIMATOR_PATH):
+        self.path = path
+        self._estimator: Optional[QuoteEstimator] = None
+        self._loaded = False
+        # Modification time of the loaded file, None if it was missing
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def reload(self) -> None:
+        """Load the model from disk again on next use."""
+        with self._lock:
+            self._loaded = False
+
+    def _current_mtime(self) -> Optional[float]:
+        """Modification time of the model file, None if it does not exist."""
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def get(self) -> Optional[QuoteEstimator]:
+        """
+        Return the trained estimator, or None if no model has been trained.
+
+        The file is loaded again whenever its modification time changes, so
+        a model trained by another process is picked up without a restart.
+        """
+        mtime = self._current_mtime()
+        with self._lock:
+            if not self._loaded or mtime != self._mtime:
+                self._loaded = True
+                self._mtime = mtime
+                self._estimator = None
+                try:
+                    with open(self.path) as f:
+                        self._estimator = QuoteEstimator.from_dict(json.load(f))
+                except FileNotFoundError:
+                    logger.info(f"No quote estimator model at {self.path}")
+                except Exception as e:
+                    logger.warning(f"Failed to load quote estimator: {str(e)}")
+            return self._estimator
+
+    def estimate(self, features: Dict[str, Any]) -> Optional[Dict[str, float]]:
+        """
+        Predict price components, or None if no model is available.
+
+        Args:
+            features: Features from quote_features
+
+        Returns:
+            Optional[dict]: Price components and their total
+        """
+        estimator = self.get()
+        return estimator.predict(features) if estimator else None
+
+
+# Global quote estimator
+quote_estimator = EstimatorHandle()
@@ -0,0 +1,139 @@
+"""
+Perceptual-hash index over every analysed image.
+
+Maps the dHash of each image in vision_analysis_results to its stored
+analysis, so a near-duplicate of an image seen in an earlier booking can
+reuse that analysis instead of being sent to the vision model again. Reuse
+across bookings carries one customer's pricing data over to another, so it
+only accepts (near-)identical hashes and is off by default. Exact copies
+are matched by content hash elsewhere.
+
+The index is built on a background thread, extended as new analyses are
+stored and rebuilt periodically to pick up analyses stored by other
+workers. Lookups never wait for a build; until the first build finishes
+they find nothing.
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from app.supabase import get_supabase
+from app.utils.pagination import iter_keyset_rows
+from app.utils.phash import BKTree, hash_from_hex
+
+# Hashes within this many differing bits (of 64) are treated as the same
+# image within one booking
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))
+# Maximum differing bits for reusing another booking's analysis, negative to
+# only reuse exact copies
+PHASH_CROSS_BOOKING_MAX_DISTANCE = int(
+    os.getenv("PHASH_CROSS_BOOKING_MAX_DISTANCE", "-1"))
+PHASH_INDEX_REFRESH_SECONDS = float(
+    os.getenv("PHASH_INDEX_REFRESH_SECONDS", "600"))
+
+
+class ImageAnalysisIndex:
+    """Process-wide BK-tree of analysed images keyed by perceptual hash."""
+
+    def __init__(self, refresh_interval: float = PHASH_INDEX_REFRESH_SECONDS):
+        self.refresh_interval = refresh_interval
+        self._tree: Optional[BKTree] = None
+        # Content hashes of the images in the tree, each is indexed once
+        self._hashes: Set[str] = set()
+        self._loaded_at: Optional[float] = None
+        self._building = False
+        # Analyses added while a build runs, applied to the new tree
+        self._added: List[Tuple[int, Dict[str, Any]]] = []
+        self._lock = threading.Lock()
+
+    def _load(self) -> Tuple[BKTree, Set[str]]:
+        """Build a tree from all stored analyses with a perceptual hash."""
+        supabase = get_supabase(use_admin=True)
+        tree: BKTree = BKTree()
+        hashes: Set[str] = set()
+        rows = iter_keyset_rows(
+            lambda: supabase.table("vision_analysis_results").select(
+                "id, image_hash, phash, result_json").not_.is_("phash", "null"))
+        for row in rows:
+            # An image reused by several bookings has one row per booking
+            if row.get("result_json") and row["image_hash"] not in hashes:
+                hashes.add(row["image_hash"])
+                tree.add(hash_from_hex(row["phash"]), {
+                    "image_hash": row["image_hash"],
+                    "result_json": row["result_json"]
+                })
+        logger.info(f"Loaded perceptual hash index with {len(tree)} images")
+        return tree, hashes
+
+    def _build(self) -> None:
+        """Build a new tree and swap it in. Runs on a background thread."""
+        try:
+            tree, hashes = self._load()
+        except Exception as e:
+            tree, hashes = None, set()
+            logger.warning(f"Failed to load perceptual hash index: {str(e)}")
+
+        with self._lock:
+            if tree is not None:
+                for phash, entry in self._added:
+                    if entry["image_hash"] not in hashes:
+                        hashes.add(entry["image_hash"])
+                        tree.add(phash, entry)
+                self._tree, self._hashes = tree, hashes
+            # A failed build is retried after the refresh interval as well
+            self._loaded_at = time.monotonic()
+            self._building = False
+            self._added = []
+
+    def _refresh_if_stale(self) -> None:
+        """Start a background build if the tree is missing or stale. Caller holds the lock."""
+        if self._building:
+            return
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at <= self.refresh_interval:
+            return
+        self._building = True
+        self._added = []
+        threading.Thread(target=self._build, name="image-index", daemon=True).start()
+
+    def find(
+        self,
+        phash: int,
+        max_distance: int = PHASH_CROSS_BOOKING_MAX_DISTANCE
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Find the closest analysed image within the distance threshold.
+
+        Args:
+            phash: Perceptual hash of the image
+            max_distance: Maximum number of differing bits, negative to
+                disable the lookup
+
+        Returns:
+            Optional[dict]: image_hash and result_json of the closest match
+        """
+        if max_distance < 0:
+            return None
+
+        with self._lock:
+            self._refresh_if_stale()
+            if self._tree is None:
+                return None
+            matches = self._tree.search(phash, max_distance)
+        return matches[0][1] if matches else None
+
+    def add(self, phash: int, image_hash: str, result_json: Dict[str, Any]) -> None:
+        """Add a newly stored analysis to the index, unless the image is indexed already."""
+        entry = {"image_hash": image_hash, "result_json": result_json}
+        with self._lock:
+            if self._tree is not None and image_hash not in self._hashes:
+                self._hashes.add(image_hash)
+                self._tree.add(phash, entry)
+            if self._building:
+                self._added.append((phash, entry))
+
+
+# Global image analysis index
+image_index = ImageAnalysisIndex()
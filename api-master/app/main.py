@@ -8,6 +8,7 @@ import os
 from loguru import logger
 from app.routes import auth, profile, booking, admin, payments, review
 from app.supabase import init_supabase, SupabaseError
+from app.utils.audit import audit_sink
 
 # Load environment variables
 load_dotenv()
@@ -59,6 +60,18 @@ async def startup_event():
         # Continue startup for other errors
         return
 
+
+@app.on_event("startup")
+async def start_audit_sink():
+    """Replay spooled audit logs and start the background audit writer."""
+    await audit_sink.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush buffered audit logs before the process exits."""
+    await audit_sink.stop()
+
 # Include API routers
 app.include_router(auth.router)
 app.include_router(profile.router)
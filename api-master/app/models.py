@@ -27,6 +27,9 @@ class VisionAnalysisResultBase(BaseModel):
     id: str = Field(default_factory=generate_uuid)
     booking_id: str
     result_json: Dict[str, Any]
+    image_hash: Optional[str] = None  # sha256 of the image bytes
+    phash: Optional[str] = None  # 64-bit perceptual hash as hex
+    image_url: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.now)
 
 
@@ -0,0 +1,191 @@
+"""
+Single-flight quote generation with progress events.
+
+Double clicks and client retries can request a quote for the same booking
+several times at once. Only the first request starts a quote job.
+Concurrent requests for the same booking await that job and all receive
+its result or its error, so the vision call and the database write happen
+once. The pipeline is blocking and runs on a dedicated, bounded thread
+pool with a single, lazily created agent shared by all requests. A quote can
+hold its thread for minutes while it waits for LLM capacity, so a burst of
+quotes must not exhaust the default executor other background work uses.
+
+Each job records numbered progress events, ending with a result or error
+event. A successfully finished job is kept for a few minutes, so stream
+clients that reconnect can replay the events they missed, including the
+result. A job that failed is never replayed; the next request starts over.
+
+Coalescing is per process. Requests for the same booking that reach
+different workers still compute separately.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.agent import QuoteEstimationAgent
+from app.utils.llm_scheduler import PRIORITY_INTERACTIVE
+
+QUOTE_JOB_RETENTION_SECONDS = float(os.getenv("QUOTE_JOB_RETENTION_SECONDS", "300"))
+QUOTE_THREAD_POOL_SIZE = int(os.getenv("QUOTE_THREAD_POOL_SIZE", "8"))
+
+_executor = ThreadPoolExecutor(
+    max_workers=QUOTE_THREAD_POOL_SIZE, thread_name_prefix="quote")
+
+_agent: Optional[QuoteEstimationAgent] = None
+_agent_lock = threading.Lock()
+
+# Running and recently finished quote jobs, by booking ID
+_jobs: Dict[str, "QuoteJob"] = {}
+
+
+def get_agent() -> QuoteEstimationAgent:
+    """
+    Return the shared quote estimation agent, creating it on first use.
+
+    Returns:
+        QuoteEstimationAgent: The agent
+    """
+    global _agent
+
+    if _agent is None:
+        with _agent_lock:
+            if _agent is None:
+                _agent = QuoteEstimationAgent()
+    return _agent
+
+
+class QuoteJob:
+    """One background quote computation and its progress events."""
+
+    def __init__(self, booking_id: str, priority: int):
+        self.booking_id = booking_id
+        self.priority = priority
+        self.events: List[Tuple[int, str, Dict[str, Any]]] = []
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self.task: "asyncio.Task[Dict[str, Any]]" = asyncio.ensure_future(self._run())
+        self.task.add_done_callback(self._finished)
+
+    @property
+    def done(self) -> bool:
+        """Whether the quote computation has finished."""
+        return self.task.done()
+
+    @property
+    def failed(self) -> bool:
+        """Whether the quote computation finished with an error."""
+        return self.task.done() and (self.task.cancelled() or self.task.exception() is not None)
+
+    def _append(self, event: str, data: Dict[str, Any]) -> None:
+        """Record an event and wake up streams. Runs on the event loop."""
+        self.events.append((len(self.events) + 1, event, data))
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, event: str, data: Dict[str, Any]) -> None:
+        """Record a progress event. Safe to call from the worker thread."""
+        self._loop.call_soon_threadsafe(self._append, event, data)
+
+    async def _run(self) -> Dict[str, Any]:
+        """Run the blocking quote pipeline on the quote thread pool."""
+        try:
+            agent = await self._loop.run_in_executor(_executor, get_agent)
+            result = await self._loop.run_in_executor(
+                _executor, agent.analyze_booking,
+                self.booking_id, None, self.priority, self.publish)
+        except Exception as e:
+            self._append("error", {"detail": str(e)})
+            raise
+        self._append("result", result)
+        return result
+
+    def _finished(self, task: "asyncio.Task[Dict[str, Any]]") -> None:
+        """Keep the finished job for replay for a while, then drop it."""
+        # Mark the error as retrieved even if every caller has gone
+        if not task.cancelled():
+            task.exception()
+        self._loop.call_later(QUOTE_JOB_RETENTION_SECONDS, self._forget)
+
+    def _forget(self) -> None:
+        if _jobs.get(self.booking_id) is self:
+            del _jobs[self.booking_id]
+
+    async def stream(
+        self,
+        after: int = 0,
+        keepalive: float = 15.0
+    ) -> AsyncIterator[Optional[Tuple[int, str, Dict[str, Any]]]]:
+        """
+        Yield events with an ID above ``after`` until the job has finished.
+
+        Args:
+            after: ID of the last event the client received
+            keepalive: Seconds without events after which None is yielded
+
+        Yields:
+            (event ID, event name, data) tuples, or None as a keepalive
+        """
+        while True:
+            while after < len(self.events):
+                after += 1
+                yield self.events[after - 1]
+            if self.events and self.events[-1][1] in ("result", "error"):
+                return
+
+            changed = self._changed
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield None
+
+
+def get_quote_job(
+    booking_id: str,
+    priority: int = PRIORITY_INTERACTIVE
+) -> Tuple[QuoteJob, bool]:
+    """
+    Return the running or recently succeeded job of a booking, or start one.
+
+    A job that failed is replaced by a new one, so a client can retry.
+
+    Args:
+        booking_id: ID of the booking to quote
+        priority: LLM scheduler priority of the job if one is started
+
+    Returns:
+        The booking's quote job, and whether it was just started
+    """
+    job = _jobs.get(booking_id)
+    if job is not None and not job.failed:
+        return job, False
+    job = _jobs[booking_id] = QuoteJob(booking_id, priority)
+    return job, True
+
+
+async def generate_quote(booking_id: str, priority: int = PRIORITY_INTERACTIVE) -> Dict[str, Any]:
+    """
+    Generate a quote for a booking, joining a computation already in progress.
+
+    Args:
+        booking_id: ID of the booking to quote
+        priority: LLM scheduler priority of the computation if one is started
+
+    Returns:
+        Dict containing quote breakdown and compliance info
+
+    Raises:
+        ValueError: If booking not found or required data missing
+        SupabaseError: If database operations fail
+    """
+    job = _jobs.get(booking_id)
+    if job is None or job.done:
+        job = _jobs[booking_id] = QuoteJob(booking_id, priority)
+    else:
+        logger.info(f"Joining quote generation in progress for booking {booking_id}")
+
+    # A caller that disconnects must not cancel the computation for the others
+    return await asyncio.shield(job.task)
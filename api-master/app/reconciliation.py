@@ -0,0 +1,224 @@
+"""
+Bulk reconciliation of stripe_payments against Stripe.
+
+Instead of retrieving payments one by one, the reconciler pages through
+Stripe's list endpoints (PaymentIntents, Charges, Refunds and Disputes) for a
+``created`` window, indexes the results by ID in memory and diffs them against
+the matching stripe_payments rows. Corrected rows are updated with only the
+fields that changed, so concurrent webhook updates to other fields are not
+overwritten with stale values. Rows getting the same changes are updated
+together with one ``in`` filter per chunk.
+
+Point ``STRIPE_API_BASE`` at a stripe-mock instance to run it locally.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+import stripe
+from loguru import logger
+
+from app.supabase import get_supabase
+from app.utils.stripe_client import stripe_object_cache
+
+STRIPE_LIST_PAGE_SIZE = 100
+LOOKUP_CHUNK_SIZE = 200
+
+# Fields the reconciler is allowed to correct
+RECONCILED_FIELDS = ("status", "stripe_charge_id", "refund_amount", "dispute_reason")
+
+
+def _chunks(items: List[Any], size: int) -> Iterable[List[Any]]:
+    """Split a list into consecutive chunks of at most ``size`` items."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _list_all(resource: Any, created: Dict[str, int], **params) -> List[Any]:
+    """List every object of a resource created in the window."""
+    return list(resource.list(
+        created=created, limit=STRIPE_LIST_PAGE_SIZE, **params).auto_paging_iter())
+
+
+def _as_utc(value: datetime) -> datetime:
+    """Treat naive datetimes as UTC."""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def _object_id(value: Any) -> Optional[str]:
+    """Return the ID of an expandable field, whether expanded or not."""
+    if isinstance(value, dict):
+        return value.get("id")
+    return value
+
+
+def _fetch_rows(supabase, column: str, values: List[str]) -> List[Dict[str, Any]]:
+    """Fetch stripe_payments rows whose column matches any of the values."""
+    rows = []
+    for chunk in _chunks(values, LOOKUP_CHUNK_SIZE):
+        result = supabase.table("stripe_payments").select(
+            "*").in_(column, chunk).execute()
+        rows.extend(result.data or [])
+    return rows
+
+
+def expected_fields(
+    row: Dict[str, Any],
+    intents: Dict[str, Any],
+    charges: Dict[str, Any],
+    disputes: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Work out what a stripe_payments row should contain according to Stripe.
+
+    Mirrors the webhook handlers: the intent sets status and charge, a
+    refund on the charge sets the refunded amount and marks the payment
+    refunded once the full amount is refunded, and a dispute marks it
+    disputed. Fields without Stripe data in the window are left alone.
+
+    Args:
+        row: stripe_payments row
+        intents: PaymentIntents by ID
+        charges: Charges by ID
+        disputes: Disputes by charge ID
+
+    Returns:
+        dict: Expected values for the fields that can be determined
+    """
+    expected: Dict[str, Any] = {}
+
+    intent = intents.get(row.get("stripe_payment_intent_id"))
+    charge_id = row.get("stripe_charge_id")
+    if intent is not None:
+        expected["status"] = intent.status
+        latest_charge = _object_id(intent.get("latest_charge"))
+        if latest_charge:
+            expected["stripe_charge_id"] = latest_charge
+            charge_id = latest_charge
+
+    charge = charges.get(charge_id)
+    if charge is not None and charge.amount_refunded:
+        # A partial refund leaves the payment's status alone
+        amount = intent.amount if intent is not None else charge.amount
+        if charge.amount_refunded >= amount:
+            expected["status"] = "refunded"
+        expected["refund_amount"] = charge.amount_refunded / 100
+
+    dispute = disputes.get(charge_id)
+    if dispute is not None:
+        expected["status"] = "disputed"
+        expected["dispute_reason"] = dispute.reason
+
+    return expected
+
+
+def _differs(field: str, current: Any, expected: Any) -> bool:
+    """Compare a stored value with the expected one, numerically for amounts."""
+    if field == "refund_amount":
+        return current is None or float(current) != float(expected)
+    return current != expected
+
+
+def reconcile_stripe_payments(
+    created_gte: Optional[datetime] = None,
+    created_lt: Optional[datetime] = None,
+    dry_run: bool = False
+) -> Dict[str, Any]:
+    """
+    Reconcile stripe_payments with Stripe for objects created in a window.
+
+    This is blocking; call it from a worker thread inside the API.
+
+    Args:
+        created_gte: Start of the window (inclusive), defaults to 24 hours
+            before the end. Naive datetimes are taken as UTC.
+        created_lt: End of the window (exclusive), defaults to now
+        dry_run: Only report the corrections, do not write them
+
+    Returns:
+        dict: Window, Stripe object counts, rows checked, corrections made
+            and PaymentIntents that have no stripe_payments row
+    """
+    created_lt = _as_utc(created_lt or datetime.now(timezone.utc))
+    created_gte = _as_utc(created_gte or created_lt - timedelta(days=1))
+    created = {"gte": int(created_gte.timestamp()), "lt": int(created_lt.timestamp())}
+
+    # Page through Stripe, indexing everything by ID. Refunds and disputes
+    # embed their charge so charges created before the window are covered.
+    intents = {pi.id: pi for pi in _list_all(stripe.PaymentIntent, created)}
+    charges = {ch.id: ch for ch in _list_all(stripe.Charge, created)}
+    refunds = _list_all(stripe.Refund, created, expand=["data.charge"])
+    disputes_list = _list_all(stripe.Dispute, created, expand=["data.charge"])
+
+    for obj in refunds + disputes_list:
+        if isinstance(obj.charge, dict):
+            charges.setdefault(obj.charge.id, obj.charge)
+    disputes = {_object_id(dispute.charge): dispute for dispute in disputes_list}
+
+    intent_ids = set(intents)
+    intent_ids.update(
+        _object_id(charge.get("payment_intent")) for charge in charges.values())
+    intent_ids.discard(None)
+
+    # Load the matching rows, deduplicated by row ID
+    supabase = get_supabase()
+    rows: Dict[str, Dict[str, Any]] = {}
+    for row in _fetch_rows(supabase, "stripe_payment_intent_id", sorted(intent_ids)):
+        rows[row["id"]] = row
+    for row in _fetch_rows(supabase, "stripe_charge_id", sorted(charges)):
+        rows[row["id"]] = row
+
+    known_intents = {row.get("stripe_payment_intent_id") for row in rows.values()}
+    missing_locally = sorted(intent_id for intent_id in intents if intent_id not in known_intents)
+
+    corrections = []
+    # Rows by the set of changes they get
+    updates: Dict[tuple, List[Dict[str, Any]]] = {}
+    now = datetime.utcnow().isoformat()
+    for row in rows.values():
+        expected = expected_fields(row, intents, charges, disputes)
+        changes = {
+            field: {"from": row.get(field), "to": value}
+            for field, value in expected.items()
+            if field in RECONCILED_FIELDS and _differs(field, row.get(field), value)
+        }
+        if not changes:
+            continue
+
+        corrections.append({"payment_id": row["id"], "changes": changes})
+        change_set = tuple(sorted((field, change["to"]) for field, change in changes.items()))
+        updates.setdefault(change_set, []).append(row)
+
+    if updates and not dry_run:
+        for change_set, corrected in updates.items():
+            update = {**dict(change_set), "updated_at": now}
+            for chunk in _chunks([row["id"] for row in corrected], LOOKUP_CHUNK_SIZE):
+                supabase.table("stripe_payments").update(update).in_("id", chunk).execute()
+        stripe_object_cache.invalidate(*[
+            key for change_set, corrected in updates.items() for row in corrected
+            for key in (
+                row.get("stripe_payment_intent_id"),
+                row.get("stripe_charge_id"),
+                dict(change_set).get("stripe_charge_id")
+            )
+            if key
+        ])
+
+    logger.info(
+        f"Stripe reconciliation {created_gte.isoformat()} - {created_lt.isoformat()}: "
+        f"{len(rows)} payments checked, {len(corrections)} corrections"
+        f"{' (dry run)' if dry_run else ''}, {len(missing_locally)} intents without a payment record")
+
+    return {
+        "created_gte": created_gte,
+        "created_lt": created_lt,
+        "dry_run": dry_run,
+        "stripe_objects": {
+            "payment_intents": len(intents),
+            "charges": len(charges),
+            "refunds": len(refunds),
+            "disputes": len(disputes_list),
+        },
+        "payments_checked": len(rows),
+        "corrections": corrections,
+        "missing_locally": missing_locally,
+    }
@@ -1,9 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from loguru import logger
+import stripe
 from app import schemas
 from app.supabase import get_supabase
-from app.routes.auth import get_current_admin
-from typing import List, Optional, Dict, Any
+from app.routes.auth import get_current_admin, known_users
+from app.routes.payments import event_worker, process_stripe_event
+from app.utils.audit import audit_sink
+from app.utils.pagination import iter_keyset_pages
+from app.utils.stripe_events import replay_unprocessed_events
+from app.reconciliation import reconcile_stripe_payments
+from app.estimation_rules import get_active_rules, load_rule_snapshot, refresh_rule_snapshot
+from app.rule_simulation import invalidate_stored_quotes, simulate_rules
+from app.quote_jobs import generate_quote
+from app.utils.llm_scheduler import PRIORITY_BATCH
+from typing import List, Optional, Dict, Any, Iterator, Sequence
 from datetime import datetime, timedelta
+import asyncio
+import csv
+import io
 import json
 from decimal import Decimal
 import uuid
@@ -149,7 +164,7 @@ async def update_booking(
         "reason": "Admin update to booking details",
         "created_at": datetime.utcnow().isoformat()
     }
-    supabase.table("admin_audit_logs").insert(audit_data).execute()
+    await audit_sink.record(audit_data)
 
     updated_booking = format_booking_response(response.data[0])
     return schemas.Booking(**updated_booking)
@@ -163,6 +178,10 @@ async def delete_booking(
     """
     Delete a booking and all its associated records, including Cal.com booking.
 
+    The cascade and the audit log entry are handled by the
+    delete_bookings_cascade database function, so the delete is a single
+    round trip and either fully succeeds or leaves nothing half deleted.
+
     Args:
         booking_id: ID of booking to delete
         current_admin: Current admin user
@@ -175,51 +194,179 @@ async def delete_booking(
     """
     supabase = get_supabase()
 
-    response = supabase.table("bookings").select(
-        "*").eq("id", booking_id).execute()
+    response = supabase.rpc("delete_bookings_cascade", {
+        "p_booking_ids": [booking_id],
+        "p_admin_user_id": current_admin.id,
+        "p_action": "BOOKING_DELETE",
+        "p_reason": "Admin deleted booking"
+    }).execute()
 
     if not response.data:
         raise HTTPException(status_code=404, detail="Booking not found")
 
-    booking = response.data[0]
+    return {"message": "Booking deleted successfully"}
 
-    booking_data = {
-        "id": booking["id"],
-        "user_id": booking["user_id"],
-        "postcode": booking["postcode"],
-        "address": booking["address"],
-        "status": booking["status"],
-        "collection_time": booking["collection_time"].isoformat() if booking["collection_time"] else None,
-        "quote": str(booking["quote"]) if booking["quote"] else None,
-        "created_at": booking["created_at"].isoformat() if booking["created_at"] else None,
-        "updated_at": booking["updated_at"].isoformat() if booking["updated_at"] else None
-    }
 
-    supabase.table("vision_analysis_results").delete().eq(
-        "booking_id", booking_id).execute()
-    supabase.table("quote_history").delete().eq(
-        "booking_id", booking_id).execute()
-    supabase.table("stripe_payments").delete().eq(
-        "booking_id", booking_id).execute()
-    supabase.table("media_uploads").delete().eq(
-        "booking_id", booking_id).execute()
-    supabase.table("customer_details").delete().eq(
-        "booking_id", booking_id).execute()
+@router.post("/bookings/{booking_id}/quote", response_model=schemas.AnalyzeResponse)
+async def requote_booking(
+    booking_id: str,
+    current_admin: schemas.UserProfile = Depends(get_current_admin)
+) -> schemas.AnalyzeResponse:
+    """
+    Regenerate the AI quote of a booking.
 
-    supabase.table("bookings").delete().eq("id", booking_id).execute()
+    The model calls run at batch priority, so customer-facing quotes waiting
+    on the LLM scheduler are served first. A quote already being generated
+    for the booking is joined instead of started again.
 
-    audit_data = {
+    Args:
+        booking_id: ID of booking to re-quote
+        current_admin: Current admin user
+
+    Returns:
+        The regenerated quote
+
+    Raises:
+        HTTPException: If booking not found or quote generation fails
+    """
+    try:
+        quote_analysis = await generate_quote(booking_id, PRIORITY_BATCH)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error re-quoting booking {booking_id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to generate quote: {str(e)}"
+        )
+
+    await audit_sink.record({
         "id": str(uuid.uuid4()),
         "admin_user_id": current_admin.id,
-        "action": "BOOKING_DELETE",
-        "previous_value": booking_data,
-        "new_value": None,
-        "reason": "Admin deleted booking",
+        "action": "BOOKING_REQUOTE",
+        "previous_value": None,
+        "new_value": json.dumps(
+            {"booking_id": booking_id, "breakdown": quote_analysis["breakdown"]}, cls=DateTimeEncoder),
+        "reason": "Admin regenerated booking quote",
         "created_at": datetime.utcnow().isoformat()
+    })
+
+    return schemas.AnalyzeResponse.model_validate(quote_analysis)
+
+
+def _bulk_selector_params(selector: schemas.BookingBulkSelector) -> Dict[str, Any]:
+    """
+    Turn a bulk selector into the parameters of the bulk booking functions.
+
+    The functions select the bookings in the same statement that changes
+    them, so bookings that start matching in between are not left out.
+
+    Args:
+        selector: Booking IDs and/or filters
+
+    Returns:
+        p_booking_ids, p_status_filter, p_created_after and p_created_before
+
+    Raises:
+        HTTPException: If the selector would match every booking
+    """
+    if not (selector.booking_ids or selector.status_filter
+            or selector.created_after or selector.created_before):
+        raise HTTPException(
+            status_code=400,
+            detail="Provide booking_ids or at least one filter"
+        )
+
+    return {
+        "p_booking_ids": list(dict.fromkeys(selector.booking_ids)) if selector.booking_ids else None,
+        "p_status_filter": selector.status_filter,
+        "p_created_after": selector.created_after.isoformat() if selector.created_after else None,
+        "p_created_before": selector.created_before.isoformat() if selector.created_before else None
     }
-    supabase.table("admin_audit_logs").insert(audit_data).execute()
 
-    return {"message": "Booking deleted successfully"}
+
+@router.patch("/bookings", response_model=schemas.BookingBulkResult)
+async def bulk_update_booking_status(
+    update_data: schemas.BookingBulkStatusUpdate,
+    current_admin: schemas.UserProfile = Depends(get_current_admin)
+) -> schemas.BookingBulkResult:
+    """
+    Update the status of many bookings selected by ID list and/or filter.
+
+    The bookings are selected and updated by one update_bookings_status
+    database call, which returns the status each booking had before the
+    update. The audit entries are written in one batch.
+
+    Args:
+        update_data: Booking selector and the new status
+        current_admin: Current admin user
+
+    Returns:
+        Number and IDs of updated bookings
+
+    Raises:
+        HTTPException: If no selector is given
+    """
+    supabase = get_supabase()
+
+    response = supabase.rpc("update_bookings_status", {
+        "p_status": update_data.status,
+        **_bulk_selector_params(update_data)
+    }).execute()
+    updated = response.data or []
+
+    now = datetime.utcnow().isoformat()
+    audit_rows = [
+        {
+            "id": str(uuid.uuid4()),
+            "admin_user_id": current_admin.id,
+            "action": "BOOKING_BULK_UPDATE",
+            "previous_value": {"id": row["id"], "status": row["previous_status"]},
+            "new_value": {"id": row["id"], "status": update_data.status},
+            "reason": "Admin bulk update to booking status",
+            "created_at": now
+        }
+        for row in updated
+    ]
+    await audit_sink.record_many(audit_rows)
+
+    updated_ids = [row["id"] for row in updated]
+    return schemas.BookingBulkResult(affected=len(updated_ids), booking_ids=updated_ids)
+
+
+@router.delete("/bookings", response_model=schemas.BookingBulkResult)
+async def bulk_delete_bookings(
+    selector: schemas.BookingBulkSelector,
+    current_admin: schemas.UserProfile = Depends(get_current_admin)
+) -> schemas.BookingBulkResult:
+    """
+    Delete many bookings, selected by ID list and/or filter, with all their
+    associated records.
+
+    The bookings are selected and deleted, together with their dependent
+    records and audit entries, by one delete_matching_bookings database call.
+
+    Args:
+        selector: Booking IDs and/or filters
+        current_admin: Current admin user
+
+    Returns:
+        Number and IDs of deleted bookings
+
+    Raises:
+        HTTPException: If no selector is given
+    """
+    supabase = get_supabase()
+
+    response = supabase.rpc("delete_matching_bookings", {
+        "p_admin_user_id": current_admin.id,
+        **_bulk_selector_params(selector),
+        "p_action": "BOOKING_BULK_DELETE",
+        "p_reason": "Admin bulk deleted bookings"
+    }).execute()
+    deleted_ids = response.data or []
+
+    return schemas.BookingBulkResult(affected=len(deleted_ids), booking_ids=deleted_ids)
 
 # -----------------------------
 # Platform Management Endpoints
@@ -315,7 +462,7 @@ async def update_compliance_regulation(
         "reason": "Admin updated compliance regulation",
         "created_at": datetime.utcnow().isoformat()
     }
-    supabase.table("admin_audit_logs").insert(audit_data).execute()
+    await audit_sink.record(audit_data)
 
     return schemas.ComplianceRegulation(**response.data[0])
 
@@ -361,7 +508,7 @@ async def delete_compliance_regulation(
         "reason": "Admin deleted compliance regulation",
         "created_at": datetime.utcnow().isoformat()
     }
-    supabase.table("admin_audit_logs").insert(audit_data).execute()
+    await audit_sink.record(audit_data)
 
 
 @router.get("/audit-logs", response_model=List[schemas.AdminAuditLog])
@@ -407,6 +554,7 @@ async def create_estimation_rule(
 
     # Insert rule
     response = supabase.table("estimation_rules").insert(rule_dict).execute()
+    refresh_rule_snapshot()
 
     # Create audit log
     audit_data = {
@@ -418,19 +566,24 @@ async def create_estimation_rule(
         "reason": "Admin created estimation rule",
         "created_at": datetime.utcnow().isoformat()
     }
-    supabase.table("admin_audit_logs").insert(audit_data).execute()
+    await audit_sink.record(audit_data)
 
     return schemas.EstimationRule(**response.data[0])
 
 
 @router.post("/estimation-rules/bulk", response_model=List[schemas.EstimationRule])
 async def create_estimation_rules_bulk(
-    rules: List[schemas.EstimationRule],
+    rules: List[schemas.EstimationRuleCreate],
     current_admin: schemas.UserProfile = Depends(get_current_admin)
 ) -> List[schemas.EstimationRule]:
     """
     Create multiple estimation rules in bulk.
 
+    The request body is validated as a whole, so an invalid row rejects the
+    request with a 422 whose error locations carry the row index and
+    nothing is written. Otherwise all rules and their audit entries are
+    inserted with a single RPC call that runs in one database transaction.
+
     Args:
         rules: List of estimation rule data
         current_admin: Current admin user
@@ -439,32 +592,100 @@ async def create_estimation_rules_bulk(
         List of created estimation rules
     """
     supabase = get_supabase()
-    created_rules = []
+    now = datetime.utcnow().isoformat()
 
-    for rule in rules:
-        # Prepare rule data
-        rule_dict = rule.dict(exclude={"id", "created_at", "updated_at"})
-        rule_dict["id"] = str(uuid.uuid4())
-        rule_dict["created_at"] = datetime.utcnow().isoformat()
+    rule_rows = []
+    audit_rows = []
 
-        # Insert rule
-        response = supabase.table(
-            "estimation_rules").insert(rule_dict).execute()
-        created_rules.append(schemas.EstimationRule(**response.data[0]))
+    for rule in rules:
+        # Server-side fields are always generated here
+        rule_dict = {
+            **rule.model_dump(mode="json"),
+            "id": str(uuid.uuid4()),
+            "created_at": now,
+            "updated_at": now
+        }
+        rule_rows.append(rule_dict)
 
-        # Create audit log
-        audit_data = {
+        audit_rows.append({
             "id": str(uuid.uuid4()),
             "admin_user_id": current_admin.id,
             "action": "ESTIMATION_RULE_BULK_CREATE",
             "previous_value": None,
-            "new_value": json.dumps(rule_dict, cls=DateTimeEncoder),
+            "new_value": json.dumps(
+                {k: v for k, v in rule_dict.items() if k != "updated_at"}, cls=DateTimeEncoder),
             "reason": "Admin created estimation rule via bulk operation",
-            "created_at": datetime.utcnow().isoformat()
-        }
-        supabase.table("admin_audit_logs").insert(audit_data).execute()
+            "created_at": now
+        })
+
+    if not rule_rows:
+        return []
+
+    # Insert rules and audit logs in one round trip and one transaction
+    response = supabase.rpc("bulk_insert_estimation_rules", {
+        "rules": rule_rows,
+        "audit_logs": audit_rows
+    }).execute()
+    refresh_rule_snapshot()
 
-    return created_rules
+    return [schemas.EstimationRule(**rule) for rule in response.data]
+
+
+@router.post("/estimation-rules/simulate", response_model=schemas.EstimationRuleSimulationResult)
+async def simulate_estimation_rules(
+    request: schemas.EstimationRuleSimulationRequest,
+    current_admin: schemas.UserProfile = Depends(get_current_admin)
+) -> schemas.EstimationRuleSimulationResult:
+    """
+    Reprice stored quotes under a candidate rule set without calling the AI.
+
+    The model's price components stored with each quote are re-adjusted
+    with the candidate rules exactly as a new quote would be. Nothing is
+    written.
+
+    Args:
+        request: Candidate rules (the current active rules if omitted),
+            optional booking IDs and the number of differences to return
+        current_admin: Current admin user
+
+    Returns:
+        Revenue totals and delta, and the largest per-booking differences
+    """
+    if request.reload:
+        invalidate_stored_quotes()
+
+    rules = request.rules if request.rules is not None else get_active_rules()
+    result = await asyncio.to_thread(
+        simulate_rules, rules, request.booking_ids, request.max_diffs)
+    return schemas.EstimationRuleSimulationResult(**result)
+
+
+@router.get("/estimation-rules/snapshots/{version}", response_model=schemas.EstimationRuleSnapshot)
+async def get_estimation_rule_snapshot(
+    version: int,
+    current_admin: schemas.UserProfile = Depends(get_current_admin)
+) -> schemas.EstimationRuleSnapshot:
+    """
+    Get the rule set a quote was priced with.
+
+    Args:
+        version: Snapshot version recorded in the quote's rule_snapshot
+        current_admin: Current admin user
+
+    Returns:
+        The snapshot's version, content hash and rules
+
+    Raises:
+        HTTPException: If the snapshot is not found
+    """
+    snapshot = load_rule_snapshot(version)
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="Rule snapshot not found")
+    return schemas.EstimationRuleSnapshot(
+        version=snapshot.version,
+        content_hash=snapshot.content_hash,
+        rules=list(snapshot.rules)
+    )
 
 
 @router.get("/estimation-rules", response_model=List[schemas.EstimationRule])
@@ -553,6 +774,7 @@ async def update_estimation_rule(
 
     response = supabase.table("estimation_rules").update(
         update_data).eq("id", rule_id).execute()
+    refresh_rule_snapshot()
 
     # Create audit log
     audit_data = {
@@ -564,7 +786,7 @@ async def update_estimation_rule(
         "reason": "Admin updated estimation rule",
         "created_at": datetime.utcnow().isoformat()
     }
-    supabase.table("admin_audit_logs").insert(audit_data).execute()
+    await audit_sink.record(audit_data)
 
     return schemas.EstimationRule(**response.data[0])
 
@@ -601,6 +823,7 @@ async def delete_estimation_rule(
 
     # Delete rule
     supabase.table("estimation_rules").delete().eq("id", rule_id).execute()
+    refresh_rule_snapshot()
 
     # Create audit log
     audit_data = {
@@ -612,7 +835,7 @@ async def delete_estimation_rule(
         "reason": "Admin deleted estimation rule",
         "created_at": datetime.utcnow().isoformat()
     }
-    supabase.table("admin_audit_logs").insert(audit_data).execute()
+    await audit_sink.record(audit_data)
 
     return {"message": "Estimation rule deleted successfully"}
 
@@ -718,11 +941,103 @@ async def update_payment_status(
         "reason": f"Admin updated payment status to {status}",
         "created_at": datetime.utcnow().isoformat()
     }
-    supabase.table("admin_audit_logs").insert(audit_data).execute()
+    await audit_sink.record(audit_data)
 
     return schemas.PaymentResponse(**response.data[0])
 
 
+@router.post("/stripe-events/replay", response_model=schemas.StripeEventReplayResult)
+async def replay_stripe_events(
+    replay: schemas.StripeEventReplayRequest,
+    current_admin: schemas.UserProfile = Depends(get_current_admin)
+) -> schemas.StripeEventReplayResult:
+    """
+    Replay unprocessed Stripe webhook events.
+
+    Events currently being handled by the background event worker are
+    skipped. The same replay is available from the command line with
+    ``python -m app.cli replay-stripe-events``.
+
+    Args:
+        replay: Replay options (parallelism, page size, filters, limit)
+        current_admin: Current admin user
+
+    Returns:
+        Counts, throughput and errors of the replay
+    """
+    stats = await replay_unprocessed_events(
+        process_stripe_event,
+        parallelism=replay.parallelism,
+        page_size=replay.page_size,
+        failed_only=replay.failed_only,
+        event_type=replay.event_type,
+        limit=replay.limit,
+        skip_ids=event_worker.in_flight_ids()
+    )
+
+    audit_data = {
+        "id": str(uuid.uuid4()),
+        "admin_user_id": current_admin.id,
+        "action": "STRIPE_EVENTS_REPLAY",
+        "previous_value": None,
+        "new_value": json.dumps({k: v for k, v in stats.items() if k != "errors"}, cls=DateTimeEncoder),
+        "reason": "Admin replayed unprocessed Stripe events",
+        "created_at": datetime.utcnow().isoformat()
+    }
+    await audit_sink.record(audit_data)
+
+    return schemas.StripeEventReplayResult(**stats)
+
+
+@router.post("/payments/reconcile", response_model=schemas.StripeReconciliationResult)
+async def reconcile_payments(
+    created_gte: Optional[datetime] = None,
+    created_lt: Optional[datetime] = None,
+    dry_run: bool = False,
+    current_admin: schemas.UserProfile = Depends(get_current_admin)
+) -> schemas.StripeReconciliationResult:
+    """
+    Reconcile payment records with Stripe for a creation window.
+
+    Also available as ``python -m app.cli reconcile-stripe``.
+
+    Args:
+        created_gte: Start of the window, defaults to 24 hours before the end
+        created_lt: End of the window, defaults to now
+        dry_run: Only report the corrections, do not write them
+        current_admin: Current admin user
+
+    Returns:
+        Stripe object counts, corrections and intents without a payment record
+
+    Raises:
+        HTTPException: If the window is empty or Stripe fails
+    """
+    if created_gte and created_lt and created_gte >= created_lt:
+        raise HTTPException(
+            status_code=400, detail="created_gte must be before created_lt")
+
+    try:
+        result = await asyncio.to_thread(
+            reconcile_stripe_payments, created_gte, created_lt, dry_run)
+    except stripe.error.StripeError as e:
+        raise HTTPException(status_code=502, detail=f"Stripe error: {str(e)}")
+
+    if result["corrections"] and not dry_run:
+        audit_data = {
+            "id": str(uuid.uuid4()),
+            "admin_user_id": current_admin.id,
+            "action": "PAYMENT_RECONCILE",
+            "previous_value": None,
+            "new_value": json.dumps(result["corrections"], cls=DateTimeEncoder),
+            "reason": "Admin reconciled payments with Stripe",
+            "created_at": datetime.utcnow().isoformat()
+        }
+        await audit_sink.record(audit_data)
+
+    return schemas.StripeReconciliationResult(**result)
+
+
 @router.get("/reviews", response_model=List[schemas.ReviewResponse])
 async def get_all_reviews(
     skip: int = 0,
@@ -816,7 +1131,7 @@ async def delete_review(
         "reason": "Admin deleted review",
         "created_at": datetime.utcnow().isoformat()
     }
-    supabase.table("admin_audit_logs").insert(audit_data).execute()
+    await audit_sink.record(audit_data)
 
     return {"message": "Review deleted successfully"}
 
@@ -1108,7 +1423,7 @@ async def create_user(
             "reason": "Admin created new user",
             "created_at": datetime.utcnow().isoformat()
         }
-        supabase.table("admin_audit_logs").insert(audit_data).execute()
+        await audit_sink.record(audit_data)
 
         return schemas.UserProfile(**response.data[0])
 
@@ -1171,6 +1486,7 @@ async def update_user(
     # Update in our database
     response = supabase.table("users").update(
         update_dict).eq("id", user_id).execute()
+    known_users.invalidate(user_id)
 
     # Create audit log
     audit_data = {
@@ -1182,7 +1498,7 @@ async def update_user(
         "reason": "Admin update to user details",
         "created_at": datetime.utcnow().isoformat()
     }
-    supabase.table("admin_audit_logs").insert(audit_data).execute()
+    await audit_sink.record(audit_data)
 
     return schemas.UserProfile(**response.data[0])
 
@@ -1226,6 +1542,7 @@ async def delete_user(
 
     # Delete from our database
     supabase.table("users").delete().eq("id", user_id).execute()
+    known_users.invalidate(user_id)
 
     # Create audit log
     audit_data = {
@@ -1237,6 +1554,132 @@ async def delete_user(
         "reason": "Admin deleted user",
         "created_at": datetime.utcnow().isoformat()
     }
-    supabase.table("admin_audit_logs").insert(audit_data).execute()
+    await audit_sink.record(audit_data)
 
     return {"message": "User deleted successfully"}
+
+
+# -----------------------------
+# Data Export Endpoints
+# -----------------------------
+
+# Exportable resources mapped to their backing tables and exported columns
+EXPORT_RESOURCES = {
+    "bookings": ("bookings", (
+        "id", "user_id", "postcode", "address", "geolocation", "status",
+        "collection_time", "quote", "created_at", "updated_at")),
+    "payments": ("stripe_payments", (
+        "id", "booking_id", "payment_intent_id", "stripe_payment_intent_id",
+        "stripe_checkout_session_id", "stripe_charge_id", "amount", "currency",
+        "status", "refund_amount", "dispute_reason", "error_message",
+        "created_at", "updated_at")),
+    "audit-logs": ("admin_audit_logs", (
+        "id", "admin_user_id", "action", "previous_value", "new_value",
+        "reason", "created_at")),
+}
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+}
+
+# PostgREST returns at most max-rows rows per request, 1000 on Supabase
+MAX_EXPORT_PAGE_SIZE = 1000
+
+
+def _export_ndjson(pages: Iterator[List[Dict[str, Any]]]) -> Iterator[str]:
+    """Serialize pages of rows as newline-delimited JSON, one chunk per page."""
+    for rows in pages:
+        yield "".join(
+            json.dumps(row, cls=DateTimeEncoder) + "\n" for row in rows)
+
+
+def _export_csv(pages: Iterator[List[Dict[str, Any]]], columns: Sequence[str]) -> Iterator[str]:
+    """
+    Serialize pages of rows as CSV, a header chunk and then one chunk per page.
+
+    The header is written even when there are no rows. Nested values (JSON
+    columns) are written as JSON strings.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(
+        buffer, fieldnames=list(columns), extrasaction="ignore", restval="")
+    writer.writeheader()
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate(0)
+
+    for rows in pages:
+        for row in rows:
+            writer.writerow({
+                key: json.dumps(value, cls=DateTimeEncoder) if isinstance(
+                    value, (dict, list)) else value
+                for key, value in row.items()
+            })
+
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+
+@router.get("/export/{resource}")
+async def export_resource(
+    resource: str,
+    export_format: str = Query("ndjson", alias="format"),
+    page_size: int = 1000,
+    current_admin: schemas.UserProfile = Depends(get_current_admin)
+) -> StreamingResponse:
+    """
+    Stream a full table export as NDJSON or CSV.
+
+    Rows are read in keyset-paginated pages inside a generator, so memory use
+    stays constant regardless of table size and the first page is sent as
+    soon as it is fetched.
+
+    Args:
+        resource: One of "bookings", "payments" or "audit-logs"
+        export_format: Output format, "ndjson" or "csv" (query parameter "format")
+        page_size: Number of rows fetched per database round trip
+        current_admin: Current admin user
+
+    Returns:
+        Streaming response with the exported rows
+
+    Raises:
+        HTTPException: If resource, format or page size is invalid
+    """
+    if resource not in EXPORT_RESOURCES:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown export resource. Must be one of: {', '.join(EXPORT_RESOURCES)}"
+        )
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid format. Must be one of: {', '.join(EXPORT_FORMATS)}"
+        )
+    if not 1 <= page_size <= MAX_EXPORT_PAGE_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"page_size must be between 1 and {MAX_EXPORT_PAGE_SIZE}"
+        )
+
+    supabase = get_supabase()
+    table, columns = EXPORT_RESOURCES[resource]
+    pages = iter_keyset_pages(
+        lambda: supabase.table(table).select(",".join(columns)), page_size=page_size)
+
+    media_type, extension = EXPORT_FORMATS[export_format]
+    if export_format == "csv":
+        body = _export_csv(pages, columns)
+    else:
+        body = _export_ndjson(pages)
+    filename = f"{resource}-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.{extension}"
+
+    # Sync generators are iterated in the threadpool by Starlette, so the
+    # blocking Supabase calls never run on the event loop.
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -1,16 +1,19 @@
 """
 Authentication utilities for Supabase JWT tokens and password handling.
 """
-from typing import Optional, Union, Dict, Any
+from typing import Optional, Union, Dict, Any, List
+from datetime import datetime, timedelta, timezone
 from fastapi import APIRouter, Depends, HTTPException, status, Security
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm, SecurityScopes
 from pydantic_settings import BaseSettings
+from jose import jwt, JWTError, ExpiredSignatureError
 from loguru import logger
 import time
 from functools import wraps
 
 
 from app.supabase import get_supabase
+from app.utils.cache import TTLCache
 from app import models, schemas
 
 # Define standard error codes for auth-related errors
@@ -79,6 +82,7 @@ logger.bind(module="auth")
 
 # Add anonymous token settings
 ANONYMOUS_TOKEN_EXPIRE_MINUTES: int = 60  # 1 hour for anonymous tokens
+ANONYMOUS_TOKEN_TYPE = "anonymous"
 
 router = APIRouter(
     prefix="/auth",
@@ -288,53 +292,98 @@ async def get_current_user_or_none(
         return None
 
 
-async def create_anonymous_token(email: str) -> tuple[str, int]:
+async def create_anonymous_token(
+    email: Optional[str],
+    booking_ids: List[str]
+) -> tuple[str, int]:
     """
-    Create a JWT token for anonymous access using Supabase.
+    Create a signed JWT for anonymous access to specific bookings.
+
+    The token is minted locally with the API's SECRET_KEY, no auth service
+    round trip or email is involved. Callers must have established that the
+    requester owns the bookings: tokens are issued to the session that
+    created a booking, and renewed with the email once a caller holding that
+    token records the booking's customer details.
 
     Args:
-        email: Email address for the anonymous user
+        email: Email address for the anonymous user, None before the
+            customer details are known
+        booking_ids: Bookings to scope the token to, at least one
 
     Returns:
         tuple[str, int]: The token and expiration time in seconds
 
     Raises:
-        HTTPException: If token creation fails
+        ValueError: If no booking IDs are given
+        HTTPException: If an email is given that does not match the customer
+            details of all requested bookings
     """
-    try:
-        supabase = get_supabase()
-
-        # Use Supabase to create a magic link session
-        response = supabase.auth.sign_in_with_otp({
-            "email": email,
-            "options": {
-                "data": {
-                    "is_anonymous": True
-                }
-            }
-        })
+    booking_ids = sorted(set(booking_ids or []))
+    if not booking_ids:
+        raise ValueError("Anonymous tokens must be scoped to at least one booking")
 
-        if not response or not response.user:
+    if email is not None:
+        # Verify the email against every booking in a single query
+        supabase = get_supabase()
+        owned = supabase.table("customer_details").select("booking_id").eq(
+            "email", email).in_("booking_id", booking_ids).execute()
+        not_owned = set(booking_ids) - {row["booking_id"] for row in owned.data or []}
+        if not_owned:
             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
+                status_code=status.HTTP_403_FORBIDDEN,
                 detail={
-                    "message": "Failed to create anonymous token",
-                    "code": AuthErrorCode.INVALID_TOKEN
+                    "message": "Email does not match the customer details of all requested bookings",
+                    "code": AuthErrorCode.FORBIDDEN,
+                    "booking_ids": sorted(not_owned)
                 }
             )
 
-        # Return token with expiration time
-        expires_in = ANONYMOUS_TOKEN_EXPIRE_MINUTES * 60
-        return response.session.access_token, expires_in
+    expires_in = ANONYMOUS_TOKEN_EXPIRE_MINUTES * 60
+    now = datetime.now(timezone.utc)
+    claims = {
+        "sub": f"anonymous:{email or booking_ids[0]}",
+        "type": ANONYMOUS_TOKEN_TYPE,
+        "email": email,
+        "booking_ids": booking_ids,
+        "iat": now,
+        "exp": now + timedelta(seconds=expires_in)
+    }
+    token = jwt.encode(claims, auth_settings.SECRET_KEY,
+                       algorithm=auth_settings.ALGORITHM)
+    return token, expires_in
 
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail={
-                "message": str(e) if str(e) else "Failed to create anonymous token",
-                "code": AuthErrorCode.INVALID_TOKEN
-            }
-        )
+
+def decode_anonymous_token(token: str) -> Optional[Dict[str, Any]]:
+    """
+    Verify a locally signed anonymous token.
+
+    Args:
+        token: The JWT token
+
+    Returns:
+        Optional[dict]: Anonymous token data, or None if the token is not a
+            valid anonymous token (e.g. a Supabase session token)
+
+    Raises:
+        JWTError: ExpiredSignatureError if it is an expired anonymous token
+    """
+    try:
+        claims = jwt.decode(token, auth_settings.SECRET_KEY,
+                            algorithms=[auth_settings.ALGORITHM])
+    except ExpiredSignatureError:
+        raise
+    except JWTError:
+        return None
+
+    # Unscoped anonymous tokens are never valid
+    if claims.get("type") != ANONYMOUS_TOKEN_TYPE or not claims.get("booking_ids"):
+        return None
+
+    return {
+        "email": claims.get("email"),
+        "booking_ids": claims.get("booking_ids") or [],
+        "is_anonymous": True
+    }
 
 
 async def get_current_user_or_anonymous(
@@ -343,6 +392,8 @@ async def get_current_user_or_anonymous(
     """
     Get the current user if authenticated, or anonymous token data.
     Used for endpoints that support both authenticated and anonymous access.
+    Anonymous tokens are verified locally; only user session tokens are
+    checked with Supabase.
 
     Args:
         token: The JWT token (optional)
@@ -357,6 +408,14 @@ async def get_current_user_or_anonymous(
             "is_anonymous": True
         }
 
+    # Anonymous tokens are verified locally, without calling Supabase
+    try:
+        anonymous = decode_anonymous_token(token)
+    except ExpiredSignatureError:
+        return None
+    if anonymous:
+        return anonymous
+
     try:
         supabase = get_supabase()
         user_response = supabase.auth.get_user(token)
@@ -374,224 +433,282 @@ async def get_current_user_or_anonymous(
         return None
 
 
-async def create_or_update_profile(user_data: models.User) -> None:
+def _profile_db_error(e: Exception) -> HTTPException:
     """
-    Create or update user profile in Supabase.
+    Map a profiles write error to a user-friendly HTTP error.
 
     Args:
-        user_data: User data to create/update profile
+        e: Error raised by the profiles write
 
-    Raises:
-        HTTPException: If profile creation/update fails
+    Returns:
+        HTTPException: Error to raise
     """
-    try:
-        supabase = get_supabase()
+    error_str = str(e)
 
-        profile_data = {
-            "id": user_data.id,
-            "name": user_data.name,
-            "email": user_data.email,
-            "phone": user_data.phone,
-            "role": user_data.role,
-            "updated_at": "now()"
-        }
+    # Duplicate email constraint violation
+    if "'code': '23505'" in error_str and "profiles_email_key" in error_str:
+        return HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "message": "This email address is already associated with another account.",
+                "code": AuthErrorCode.EMAIL_EXISTS,
+                "field": "email",
+                "help": "Please use a different email address or login to your existing account."
+            }
+        )
+    # Duplicate phone constraint violation
+    elif "'code': '23505'" in error_str and "profiles_phone_key" in error_str:
+        return HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "message": "This phone number is already associated with another account.",
+                "code": AuthErrorCode.INVALID_INPUT,
+                "field": "phone",
+                "help": "Please use a different phone number or login to your existing account."
+            }
+        )
+    # Handle any other constraint violations
+    elif "'code': '23" in error_str:  # Other PostgreSQL constraint errors start with 23
+        constraint_message = "A validation error occurred with your account details."
+        # Try to extract the field name from the error
+        field_match = None
+        if "key" in error_str.lower():
+            field_parts = error_str.split("(")
+            if len(field_parts) > 1:
+                field_candidate = field_parts[1].split(")")[0]
+                field_match = field_candidate if field_candidate else "unknown"
+        
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                "message": constraint_message,
+                "code": AuthErrorCode.INVALID_INPUT,
+                "field": field_match if field_match else "unknown",
+                "help": "Please check your information and try again."
+            }
+        )
+    # Generic database error
+    else:
+        return HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail={
+                "message": "Unable to create or update your profile due to a system error.",
+                "code": AuthErrorCode.DATABASE_ERROR,
+                "request_id": f"profile-{int(time.time())}"
+            }
+        )
 
-        # Upsert profile (create if not exists, update if exists)
-        result = supabase.table("profiles").upsert(profile_data).execute()
 
-        if not result.data:
-            logger.error(
-                f"Failed to create/update profile for user: {user_data.email}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail={
-                    "message": "Failed to create/update profile",
-                    "code": AuthErrorCode.DATABASE_ERROR
-                }
-            )
+def _user_record_db_error(e: Exception, user_data: models.User) -> HTTPException:
+    """
+    Map a users write error to a user-friendly HTTP error.
 
-        logger.info(
-            f"Successfully created/updated profile for user: {user_data.email}")
+    Args:
+        e: Error raised by the users write
+        user_data: User whose record was written
 
-    except Exception as e:
-        logger.error(f"Error creating/updating profile: {str(e)}")
-        
-        # Check for common database constraint errors and provide user-friendly messages
-        error_str = str(e)
+    Returns:
+        HTTPException: Error to raise
+    """
+    error_str = str(e)
+
+    # Email uniqueness constraint
+    if "'code': '23505'" in error_str and "users_email_key" in error_str:
+        logger.warning(f"Duplicate email attempt: {user_data.email}")
+        return HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "message": "An account with this email address already exists.",
+                "code": AuthErrorCode.EMAIL_EXISTS,
+                "field": "email",
+                "help": "Please log in to your existing account or use a different email address."
+            }
+        )
+    # Phone uniqueness constraint
+    elif "'code': '23505'" in error_str and "users_phone_key" in error_str:
+        return HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "message": "An account with this phone number already exists.",
+                "code": AuthErrorCode.INVALID_INPUT,
+                "field": "phone",
+                "help": "Please use a different phone number or log in to your existing account."
+            }
+        )
+    # Foreign key constraint
+    elif "'code': '23503'" in error_str:  # Foreign key violation
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                "message": "Unable to create user record due to a reference error.",
+                "code": AuthErrorCode.DATABASE_ERROR,
+                "help": "Please ensure all required information is provided correctly."
+            }
+        )
+    # Other constraint violations
+    elif "'code': '23" in error_str:  # Other PostgreSQL constraint errors start with 23
+        # Try to extract the field name from the error
+        field_match = None
+        if "key" in error_str.lower():
+            field_parts = error_str.split("(")
+            if len(field_parts) > 1:
+                field_candidate = field_parts[1].split(")")[0]
+                field_match = field_candidate if field_candidate else "unknown"
         
-        # Duplicate email constraint violation
-        if "'code': '23505'" in error_str and "profiles_email_key" in error_str:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail={
-                    "message": "This email address is already associated with another account.",
-                    "code": AuthErrorCode.EMAIL_EXISTS,
-                    "field": "email",
-                    "help": "Please use a different email address or login to your existing account."
-                }
-            )
-        # Duplicate phone constraint violation
-        elif "'code': '23505'" in error_str and "profiles_phone_key" in error_str:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail={
-                    "message": "This phone number is already associated with another account.",
-                    "code": AuthErrorCode.INVALID_INPUT,
-                    "field": "phone",
-                    "help": "Please use a different phone number or login to your existing account."
-                }
-            )
-        # Handle any other constraint violations
-        elif "'code': '23" in error_str:  # Other PostgreSQL constraint errors start with 23
-            constraint_message = "A validation error occurred with your account details."
-            # Try to extract the field name from the error
-            field_match = None
-            if "key" in error_str.lower():
-                field_parts = error_str.split("(")
-                if len(field_parts) > 1:
-                    field_candidate = field_parts[1].split(")")[0]
-                    field_match = field_candidate if field_candidate else "unknown"
-            
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail={
-                    "message": constraint_message,
-                    "code": AuthErrorCode.INVALID_INPUT,
-                    "field": field_match if field_match else "unknown",
-                    "help": "Please check your information and try again."
-                }
-            )
-        # Generic database error
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail={
-                    "message": "Unable to create or update your profile due to a system error.",
-                    "code": AuthErrorCode.DATABASE_ERROR,
-                    "request_id": f"profile-{int(time.time())}"
-                }
-            )
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                "message": "A validation error occurred with your account information.",
+                "code": AuthErrorCode.INVALID_INPUT,
+                "field": field_match if field_match else "unknown",
+                "help": "Please check your information and try again."
+            }
+        )
+    # Service role authentication error
+    elif "auth/insufficient_permissions" in error_str.lower() or "permission denied" in error_str.lower():
+        return HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail={
+                "message": "You don't have permission to perform this operation.",
+                "code": AuthErrorCode.FORBIDDEN,
+                "help": "Please contact support if you believe this is an error."
+            }
+        )
+    # Generic database error
+    else:
+        return HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail={
+                "message": "Unable to create your account due to a system error.",
+                "code": AuthErrorCode.DATABASE_ERROR,
+                "request_id": f"user-{int(time.time())}",
+                "help": "Please try again later or contact support if the problem persists."
+            }
+        )
+
+
+# Users whose users and profiles rows are known to match their auth data,
+# mapped to the fingerprint of the data that was last synced
+KNOWN_USER_TTL_SECONDS = 600
+known_users = TTLCache(ttl=KNOWN_USER_TTL_SECONDS, max_size=10000)
+
 
+def _user_fingerprint(user_data: models.User) -> tuple:
+    """Return the fields synced to the users and profiles tables."""
+    return (user_data.email, user_data.name, user_data.phone, user_data.role)
 
-async def create_user_record(user_data: models.User) -> None:
+
+async def sync_user_records(user_data: models.User) -> None:
     """
-    Create user record in the users table.
+    Make sure the users and profiles rows match the user's auth data.
+
+    Both rows are upserted by the ``sync_user_records`` database function in
+    one round trip, and only written when a field actually changed. Users
+    synced recently with the same data are skipped without a database call.
 
     Args:
-        user_data: User data to create record
+        user_data: User data from Supabase auth
 
     Raises:
         HTTPException: With appropriate status code and error details
     """
+    fingerprint = _user_fingerprint(user_data)
+    if known_users.get(user_data.id) == fingerprint:
+        return
+
     try:
-        # Use service role client for admin operations
+        # Use service role client, the users table is not writable otherwise
         supabase = get_supabase(use_admin=True)
+        supabase.rpc("sync_user_records", {
+            "p_id": user_data.id,
+            "p_email": user_data.email,
+            "p_name": user_data.name,
+            "p_phone": user_data.phone,
+            "p_role": user_data.role
+        }).execute()
+    except Exception as e:
+        logger.error(f"Error syncing user records for {user_data.email}: {str(e)}")
+        if "profiles_" in str(e):
+            raise _profile_db_error(e)
+        raise _user_record_db_error(e, user_data)
 
-        user_record = {
-            "id": user_data.id,
-            "email": user_data.email,
-            "name": user_data.name,
-            "phone": user_data.phone,
-            "role": user_data.role,
-            "created_at": "now()",
-            "updated_at": "now()"
-        }
+    known_users.set(user_data.id, fingerprint)
 
-        # Upsert user record using service role
-        result = supabase.table("users").upsert(user_record).execute()
 
-        if not result.data:
-            logger.error(
-                f"Failed to create user record for: {user_data.email}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail={
-                    "message": "Failed to create user record",
-                    "code": AuthErrorCode.DATABASE_ERROR
-                },
-                headers={"X-Error-Code": AuthErrorCode.DATABASE_ERROR}
-            )
+def merge_anonymous_bookings(
+    user_data: models.User,
+    booking_ids: List[str]
+) -> schemas.BookingMergeResponse:
+    """
+    Assign anonymous bookings to a user account.
 
-        logger.info(f"Successfully created user record for: {user_data.email}")
+    Ownership of all bookings is checked against customer_details.email in
+    one query, and all eligible bookings are reassigned in one update, so
+    the cost does not grow with the number of bookings.
 
-    except Exception as e:
-        logger.error(f"Error creating user record: {str(e)}")
-        error_str = str(e)
-        
-        # Check for common database constraint errors and provide user-friendly messages
-        # Email uniqueness constraint
-        if "'code': '23505'" in error_str and "users_email_key" in error_str:
-            logger.warning(f"Duplicate email attempt: {user_data.email}")
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail={
-                    "message": "An account with this email address already exists.",
-                    "code": AuthErrorCode.EMAIL_EXISTS,
-                    "field": "email",
-                    "help": "Please log in to your existing account or use a different email address."
-                }
-            )
-        # Phone uniqueness constraint
-        elif "'code': '23505'" in error_str and "users_phone_key" in error_str:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail={
-                    "message": "An account with this phone number already exists.",
-                    "code": AuthErrorCode.INVALID_INPUT,
-                    "field": "phone",
-                    "help": "Please use a different phone number or log in to your existing account."
-                }
-            )
-        # Foreign key constraint
-        elif "'code': '23503'" in error_str:  # Foreign key violation
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail={
-                    "message": "Unable to create user record due to a reference error.",
-                    "code": AuthErrorCode.DATABASE_ERROR,
-                    "help": "Please ensure all required information is provided correctly."
-                }
-            )
-        # Other constraint violations
-        elif "'code': '23" in error_str:  # Other PostgreSQL constraint errors start with 23
-            # Try to extract the field name from the error
-            field_match = None
-            if "key" in error_str.lower():
-                field_parts = error_str.split("(")
-                if len(field_parts) > 1:
-                    field_candidate = field_parts[1].split(")")[0]
-                    field_match = field_candidate if field_candidate else "unknown"
-            
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail={
-                    "message": "A validation error occurred with your account information.",
-                    "code": AuthErrorCode.INVALID_INPUT,
-                    "field": field_match if field_match else "unknown",
-                    "help": "Please check your information and try again."
-                }
-            )
-        # Service role authentication error
-        elif "auth/insufficient_permissions" in error_str.lower() or "permission denied" in error_str.lower():
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail={
-                    "message": "You don't have permission to perform this operation.",
-                    "code": AuthErrorCode.FORBIDDEN,
-                    "help": "Please contact support if you believe this is an error."
-                }
-            )
-        # Generic database error
+    Args:
+        user_data: The account to move the bookings to
+        booking_ids: IDs of the bookings to merge
+
+    Returns:
+        schemas.BookingMergeResponse: Converted bookings and per-booking failures
+    """
+    booking_ids = list(dict.fromkeys(booking_ids))
+    if not booking_ids:
+        return schemas.BookingMergeResponse(converted_bookings=[], failed_bookings=[])
+
+    supabase = get_supabase(use_admin=True)
+    email = (user_data.email or "").lower()
+
+    # Customer details and current owner of every booking in one query
+    details = supabase.table("customer_details").select(
+        "booking_id, email, bookings(user_id)").in_("booking_id", booking_ids).execute()
+
+    owners: Dict[str, Optional[str]] = {}
+    email_matches = set()
+    for row in details.data or []:
+        booking = row.get("bookings") or {}
+        owners[row["booking_id"]] = booking.get("user_id")
+        if (row.get("email") or "").lower() == email:
+            email_matches.add(row["booking_id"])
+
+    converted: List[str] = []
+    failed: List[Dict[str, str]] = []
+    eligible: List[str] = []
+    for booking_id in booking_ids:
+        if booking_id not in owners:
+            failed.append({"booking_id": booking_id,
+                           "reason": "Booking not found or has no customer details"})
+        elif booking_id not in email_matches:
+            failed.append({"booking_id": booking_id,
+                           "reason": "Email does not match booking's customer details"})
+        elif owners[booking_id] == user_data.id:
+            converted.append(booking_id)
+        elif owners[booking_id] is not None:
+            failed.append({"booking_id": booking_id,
+                           "reason": "Booking already belongs to another account"})
         else:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail={
-                    "message": "Unable to create your account due to a system error.",
-                    "code": AuthErrorCode.DATABASE_ERROR,
-                    "request_id": f"user-{int(time.time())}",
-                    "help": "Please try again later or contact support if the problem persists."
-                }
-            )
+            eligible.append(booking_id)
+
+    if eligible:
+        # Only claim bookings that are still anonymous
+        result = supabase.table("bookings").update({
+            "user_id": user_data.id,
+            "updated_at": datetime.utcnow().isoformat()
+        }).in_("id", eligible).is_("user_id", "null").execute()
+
+        claimed = {row["id"] for row in result.data or []}
+        for booking_id in eligible:
+            if booking_id in claimed:
+                converted.append(booking_id)
+            else:
+                failed.append({"booking_id": booking_id,
+                               "reason": "Booking was claimed by another account"})
+
+    logger.info(
+        f"Merged {len(converted)} bookings into account {user_data.email}, {len(failed)} failed")
+    return schemas.BookingMergeResponse(
+        converted_bookings=converted, failed_bookings=failed)
 
 
 @router.post("/signup",
@@ -682,30 +799,6 @@ async def signup(
     try:
         supabase = get_supabase()
 
-        # First check if email exists in users table to avoid unnecessary auth attempts
-        try:
-            existing_user = supabase.table("users").select("email").eq(
-                "email", user_data.email).single().execute()
-            if existing_user.data:
-                raise HTTPException(
-                    status_code=status.HTTP_409_CONFLICT,
-                    detail={
-                        "message": "This email address is already registered. Please use a different email or reset your password.",
-                        "code": AuthErrorCode.EMAIL_EXISTS,
-                        "email": user_data.email
-                    }
-                )
-        except Exception as db_error:
-            if "23505" in str(db_error):  # Postgres unique constraint violation
-                raise HTTPException(
-                    status_code=status.HTTP_409_CONFLICT,
-                    detail={
-                        "message": "This email address is already registered. Please use a different email or reset your password.",
-                        "code": AuthErrorCode.EMAIL_EXISTS,
-                        "email": user_data.email
-                    }
-                )
-
         # Validate password requirements
         if len(user_data.password) < 8:
             raise HTTPException(
@@ -760,10 +853,10 @@ async def signup(
                 role="customer"
             )
 
-            # Create profile and user record
+            # Create user record and profile. An email that is already
+            # registered fails here on the users email constraint (409).
             try:
-                await create_or_update_profile(user)
-                await create_user_record(user)
+                await sync_user_records(user)
             except Exception as db_error:
                 # If profile/record creation fails, attempt to delete the auth user
                 try:
@@ -780,11 +873,25 @@ async def signup(
                     requires_confirmation=True
                 )
 
-            return schemas.Token(
+            token = schemas.Token(
                 access_token=auth_response.session.access_token,
                 token_type="bearer"
             )
 
+            # Move the visitor's anonymous bookings into the new account.
+            # A failed merge does not fail the signup, it can be retried
+            # through /booking/merge.
+            if user_data.booking_ids:
+                try:
+                    merge = merge_anonymous_bookings(user, user_data.booking_ids)
+                    token.converted_bookings = merge.converted_bookings
+                    token.failed_bookings = merge.failed_bookings
+                except Exception as merge_error:
+                    logger.error(
+                        f"Failed to merge bookings for {user_data.email}: {str(merge_error)}")
+
+            return token
+
         except HTTPException:
             raise
         except Exception as auth_error:
@@ -913,11 +1020,8 @@ async def login(
             role=auth_response.user.user_metadata.get('role', 'customer')
         )
 
-        # Ensure user record exists
-        await create_user_record(user)
-
-        # Update profile
-        await create_or_update_profile(user)
+        # Ensure user record and profile exist and are up to date
+        await sync_user_records(user)
 
         return schemas.Token(
             access_token=auth_response.session.access_token,
@@ -995,21 +1099,23 @@ async def create_anonymous_access_token(
     token_request: schemas.AnonymousTokenRequest
 ) -> schemas.AnonymousToken:
     """
-    Create an anonymous access token for temporary access.
+    Retired. Anonymous tokens are no longer issued for an email alone.
+
+    Creating a booking returns a token scoped to it, and recording the
+    booking's customer details with that token renews it with the email.
 
     Args:
-        token_request: The token request data containing email
+        token_request: The token request data
 
-    Returns:
-        schemas.AnonymousToken: The anonymous access token
+    Raises:
+        HTTPException: Always, 410 Gone
     """
-    access_token, expires_in = await create_anonymous_token(token_request.email)
-
-    return schemas.AnonymousToken(
-        access_token=access_token,
-        token_type="bearer",
-        email=token_request.email,
-        expires_in=expires_in
+    raise HTTPException(
+        status_code=status.HTTP_410_GONE,
+        detail={
+            "message": "Anonymous tokens are issued when a booking is created",
+            "code": AuthErrorCode.FORBIDDEN
+        }
     )
 
 
@@ -1218,6 +1324,7 @@ async def set_admin_role(
 
         result = supabase.table("profiles").update(profile_data).eq(
             "id", role_update.user_id).execute()
+        known_users.invalidate(role_update.user_id)
 
         if not result.data:
             raise HTTPException(
@@ -1327,6 +1434,7 @@ async def initialize_admin(
             )
 
         result = supabase.table("users").upsert(profile_data).execute()
+        known_users.invalidate(target_user_id)
         if not result.data:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
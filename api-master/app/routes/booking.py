@@ -2,12 +2,14 @@
 Booking management routes for van conversions with Supabase.
 """
 from typing import List, Optional, Union, Dict, Any
-from fastapi import APIRouter, Depends, HTTPException, status, Request
-from app.agent import QuoteEstimationAgent
+from fastapi import APIRouter, Depends, Header, HTTPException, status, Request
+from fastapi.responses import StreamingResponse
+from app.quote_jobs import generate_quote, get_quote_job
 from . import auth
 from ..utils.rate_limit import rate_limit_anonymous
 from datetime import datetime
 from loguru import logger
+import json
 from app.supabase import get_supabase, SupabaseError
 
 from .. import models, schemas
@@ -16,14 +18,16 @@ from .. import models, schemas
 router = APIRouter(prefix="/booking", tags=["booking"])
 
 
-@router.post("", response_model=schemas.Booking)
+@router.post("", response_model=schemas.BookingCreated)
 async def create_booking(
     booking: schemas.BookingCreate,
     request: Request
-) -> schemas.Booking:
+) -> schemas.BookingCreated:
     """
     Create a new booking with postcode. Works for both authenticated and anonymous users.
-    Anonymous users can create bookings without authentication.
+    Anonymous users can create bookings without authentication. The response
+    carries an anonymous access token scoped to the new booking, which is the
+    creator's proof of ownership.
     """
  
 
@@ -62,7 +66,10 @@ async def create_booking(
 
         logger.info(
             f"Successfully created anonymous booking with ID {db_booking['id']}")
-        return schemas.Booking(**db_booking)
+        access_token, expires_in = await auth.create_anonymous_token(
+            None, [db_booking["id"]])
+        return schemas.BookingCreated(
+            **db_booking, access_token=access_token, expires_in=expires_in)
 
     except SupabaseError as se:
         logger.error(f"Supabase error creating booking: {str(se)}")
@@ -78,6 +85,35 @@ async def create_booking(
         )
 
 
+@router.post("/merge", response_model=schemas.BookingMergeResponse)
+async def merge_bookings(
+    merge_request: schemas.BookingMergeRequest,
+    current_user: models.User = Depends(auth.get_current_active_user)
+) -> schemas.BookingMergeResponse:
+    """
+    Move anonymous bookings into the current user's account.
+
+    Only bookings whose customer details carry the user's email and that
+    do not belong to another account are moved.
+    """
+    logger.info(
+        f"Merging {len(merge_request.booking_ids)} bookings into account {current_user.id}")
+    try:
+        return auth.merge_anonymous_bookings(current_user, merge_request.booking_ids)
+    except SupabaseError as se:
+        logger.error(f"Supabase error merging bookings: {str(se)}")
+        raise HTTPException(
+            status_code=se.status_code,
+            detail=f"Database error: {se.message}"
+        )
+    except Exception as e:
+        logger.error(f"Error merging bookings: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to merge bookings: {str(e)}"
+        )
+
+
 @router.get("/my-bookings", response_model=List[schemas.Booking])
 async def list_my_bookings(
     current_user: Union[models.User, Dict[str, Any], None] = Depends(
@@ -178,24 +214,14 @@ async def get_booking(
             )
 
         if isinstance(current_user, dict) and current_user.get("is_anonymous"):
-            # For anonymous users, they can only access bookings with matching email
-            try:
-                customer_details = supabase.table("customer_details").select(
-                    "*").eq("booking_id", booking_id).eq("email", current_user.get("email")).single().execute()
-
-                if not customer_details.data:
-                    logger.warning(
-                        f"Anonymous user {current_user.get('email')} unauthorized to access booking {booking_id}")
-                    raise HTTPException(
-                        status_code=status.HTTP_403_FORBIDDEN,
-                        detail="Not authorized to access this booking"
-                    )
-            except SupabaseError as se:
-                logger.error(
-                    f"Supabase error checking customer details: {str(se)}")
+            # Anonymous tokens are scoped to the bookings they were issued
+            # for. Requests without a scoped token get no anonymous access.
+            if booking_id not in (current_user.get("booking_ids") or []):
+                logger.warning(
+                    f"Anonymous token for {current_user.get('email')} not scoped to booking {booking_id}")
                 raise HTTPException(
-                    status_code=se.status_code,
-                    detail=f"Database error: {se.message}"
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="Not authorized to access this booking"
                 )
         else:
             # For authenticated users
@@ -289,16 +315,37 @@ async def cancel_booking(
         )
 
 
+def _owns_booking(
+    current_user: Union[models.User, Dict[str, Any], None],
+    booking_id: str,
+    supabase
+) -> bool:
+    """Whether the caller holds a token for the booking or is its user."""
+    if isinstance(current_user, dict):
+        return booking_id in (current_user.get("booking_ids") or [])
+    if current_user is None:
+        return False
+    result = supabase.table("bookings").select("user_id").eq("id", booking_id).execute()
+    return bool(result.data) and result.data[0]["user_id"] == current_user.id
+
+
 @router.post("/customer-details", status_code=status.HTTP_201_CREATED, response_model=schemas.CustomerDetailsResponse)
 async def update_customer_details(
     details: schemas.CustomerDetails,
+    current_user: Union[models.User, Dict[str, Any], None] = Depends(
+        auth.get_current_user_or_anonymous),
     supabase=Depends(get_supabase)
 ) -> schemas.CustomerDetailsResponse:
     """
     Update booking with customer details.
 
+    When the details are first recorded by the booking's owner (the holder
+    of the token issued at booking creation, or the user it belongs to), a
+    token scoped to the booking and the email is returned.
+
     Args:
         details: The customer details
+        current_user: Current user, anonymous token data or None
         supabase: Supabase client
 
     Returns:
@@ -313,6 +360,8 @@ async def update_customer_details(
         result = supabase.table("customer_details").select(
             "*").eq("booking_id", details.booking_id).execute()
 
+        access_token = None
+        expires_in = None
         if not result.data:
             # Create new customer details if none exist
             supabase_data = {
@@ -326,6 +375,11 @@ async def update_customer_details(
             }
             result = supabase.table("customer_details").insert(
                 supabase_data).execute()
+
+            # Give the booking's owner access to this booking only
+            if result.data and _owns_booking(current_user, details.booking_id, supabase):
+                access_token, expires_in = await auth.create_anonymous_token(
+                    details.email, [details.booking_id])
         else:
             # Update existing customer details
             supabase_data = {
@@ -353,7 +407,9 @@ async def update_customer_details(
             collection_date=updated_details["collection_date"],
             address=updated_details.get("address", ""),
             created_at=updated_details.get("created_at"),
-            updated_at=updated_details.get("updated_at")
+            updated_at=updated_details.get("updated_at"),
+            access_token=access_token,
+            expires_in=expires_in
         )
 
     except SupabaseError as se:
@@ -503,6 +559,30 @@ async def upload_booking_media(
         )
 
 
+def _analyze_response(quote_analysis: Dict[str, Any]) -> schemas.AnalyzeResponse:
+    """Build the API response from a quote generated by the agent."""
+    return schemas.AnalyzeResponse(
+        breakdown=schemas.BreakdownResponse(
+            volume=quote_analysis["breakdown"]["volume"],
+            material_risk=quote_analysis["breakdown"]["material_risk"],
+            postcode=quote_analysis["breakdown"]["postcode"],
+            price_components=schemas.PriceComponentsResponse(
+                base_rate=quote_analysis["breakdown"]["price_components"]["base_rate"],
+                hazard_surcharge=quote_analysis["breakdown"]["price_components"]["hazard_surcharge"],
+                access_fee=quote_analysis["breakdown"]["price_components"]["access_fee"],
+                dismantling_fee=quote_analysis["breakdown"]["price_components"]["dismantling_fee"],
+                total=quote_analysis["breakdown"]["price_components"]["total"]
+            )
+        ),
+        compliance=quote_analysis["compliance"],
+        explanation=schemas.ExplanationResponse(
+            heatmapUrl=quote_analysis["explanation"]["heatmapUrl"],
+            similarCases=quote_analysis["explanation"]["similarCases"],
+            applied_rules=quote_analysis["explanation"]["applied_rules"]
+        )
+    )
+
+
 @router.post("/quote", response_model=schemas.AnalyzeResponse)
 async def generate_booking_quote(
     booking_id: str,
@@ -525,33 +605,10 @@ async def generate_booking_quote(
     """
     logger.info(f"Generating quote for booking {booking_id}")
     try:
-        # Initialize quote estimation agent
-        agent = QuoteEstimationAgent()
-
-        # Get analysis from agent
-        quote_analysis = agent.analyze_booking(booking_id)
-
-        # Create AnalyzeResponse using the Pydantic model
-        response = schemas.AnalyzeResponse(
-            breakdown=schemas.BreakdownResponse(
-                volume=quote_analysis["breakdown"]["volume"],
-                material_risk=quote_analysis["breakdown"]["material_risk"],
-                postcode=quote_analysis["breakdown"]["postcode"],
-                price_components=schemas.PriceComponentsResponse(
-                    base_rate=quote_analysis["breakdown"]["price_components"]["base_rate"],
-                    hazard_surcharge=quote_analysis["breakdown"]["price_components"]["hazard_surcharge"],
-                    access_fee=quote_analysis["breakdown"]["price_components"]["access_fee"],
-                    dismantling_fee=quote_analysis["breakdown"]["price_components"]["dismantling_fee"],
-                    total=quote_analysis["breakdown"]["price_components"]["total"]
-                )
-            ),
-            compliance=quote_analysis["compliance"],
-            explanation=schemas.ExplanationResponse(
-                heatmapUrl=quote_analysis["explanation"]["heatmapUrl"],
-                similarCases=quote_analysis["explanation"]["similarCases"],
-                applied_rules=quote_analysis["explanation"]["applied_rules"]
-            )
-        )
+        # Get analysis from the shared agent, joining a computation already
+        # in progress for this booking
+        quote_analysis = await generate_quote(booking_id)
+        response = _analyze_response(quote_analysis)
 
         logger.info(
             f"Successfully generated and stored quote for booking {booking_id}")
@@ -564,3 +621,53 @@ async def generate_booking_quote(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to generate quote: {str(e)}"
         )
+
+
+@router.get("/quote/{booking_id}/stream")
+async def stream_booking_quote(
+    booking_id: str,
+    request: Request,
+    last_event_id: Optional[str] = Header(None)
+) -> StreamingResponse:
+    """
+    Stream the progress of a booking's quote generation as Server-Sent Events.
+
+    Starts the quote job unless one is running or recently succeeded. Events
+    are data_loaded, images_fetched, rules_retrieved, model_running and
+    finally result (the quote) or error. A client that reconnects with the
+    Last-Event-ID header receives only the events it missed. Reconnecting
+    after an error starts a new job.
+
+    Args:
+        booking_id: The booking ID
+        request: FastAPI request object
+        last_event_id: ID of the last event the client received
+
+    Returns:
+        StreamingResponse: text/event-stream of progress events
+    """
+    after = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+    job, started = get_quote_job(booking_id)
+    if started:
+        # Event IDs of an earlier, failed job do not apply to the new one
+        after = 0
+
+    async def event_stream():
+        yield "retry: 3000\n\n"
+        async for item in job.stream(after):
+            if await request.is_disconnected():
+                break
+            if item is None:
+                yield ": keepalive\n\n"
+                continue
+
+            event_id, event, data = item
+            if event == "result":
+                data = _analyze_response(data).model_dump(mode="json")
+            yield f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
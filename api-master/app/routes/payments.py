@@ -3,6 +3,10 @@ from typing import List, Union, Dict, Any, Optional
 import stripe
 from app.schemas import PaymentCreate, PaymentResponse, User
 from app.supabase import get_supabase
+from app.utils.stripe_client import (
+    call_stripe, idempotency_key, invalidate_stripe_objects, retrieve_stripe_object)
+from app.utils.stripe_events import StripeEventWorker
+import asyncio
 import os
 from datetime import datetime
 from loguru import logger
@@ -15,9 +19,11 @@ router = APIRouter(
 # Initialize Stripe with your secret key
 STRIPE_ENABLED = os.getenv("STRIPE_ENABLED", "true").lower() == "true"
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+# Optional API base override, e.g. a local stripe-mock instance
+if os.getenv("STRIPE_API_BASE"):
+    stripe.api_base = os.getenv("STRIPE_API_BASE")
 webhook_secret = os.getenv("STRIPE_WEBHOOK_SECRET")
 
-
 @router.post("/create", response_model=PaymentResponse)
 async def create_payment(
     payment: PaymentCreate,
@@ -50,17 +56,28 @@ async def create_payment(
             mock_payment_id = f"mock_pi_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
             logger.warning(f"Stripe is disabled. Using mock payment ID: {mock_payment_id}")
         else:
-            # Create payment intent with Stripe
-            intent = stripe.PaymentIntent.create(
+            # Create payment intent with Stripe. Retries of the same request
+            # reuse the idempotency key and get the same intent back.
+            intent = await call_stripe(
+                stripe.PaymentIntent.create,
                 amount=int(payment.amount * 100),  # Convert to cents
                 currency=payment.currency,
                 payment_method_types=["card"],
-            metadata={"booking_id": payment.booking_id},
-            payment_method=payment.payment_method_id if payment.payment_method_id else None,
-            setup_future_usage=payment.setup_future_usage if payment.setup_future_usage else None
-        )
+                metadata={"booking_id": payment.booking_id},
+                payment_method=payment.payment_method_id if payment.payment_method_id else None,
+                setup_future_usage=payment.setup_future_usage if payment.setup_future_usage else None,
+                idempotency_key=idempotency_key(
+                    "payment_intent",
+                    payment.booking_id,
+                    payment.amount,
+                    payment.currency,
+                    payment.payment_method_id,
+                    payment.setup_future_usage
+                )
+            )
 
-        # Create payment record in Supabase
+        # Create payment record in Supabase, or return the existing record
+        # when a retried request hands back the same payment intent
         payment_data = {
             "booking_id": payment.booking_id,
             "payment_intent_id": mock_payment_id if not STRIPE_ENABLED else intent.id,
@@ -71,8 +88,16 @@ async def create_payment(
             "stripe_charge_id": None  # Initialize with None to prevent validation error
         }
 
-        result = supabase.table("stripe_payments").insert(
-            payment_data).execute()
+        result = supabase.table("stripe_payments").upsert(
+            payment_data,
+            on_conflict="stripe_payment_intent_id",
+            ignore_duplicates=True
+        ).execute()
+        if not result.data:
+            # The record exists already and may have been updated by webhooks
+            result = supabase.table("stripe_payments").select("*").eq(
+                "stripe_payment_intent_id", payment_data["stripe_payment_intent_id"]
+            ).execute()
         db_payment = result.data[0]
 
         return PaymentResponse(
@@ -122,7 +147,8 @@ async def create_checkout_session(
         raise HTTPException(status_code=404, detail="Booking not found")
 
     try:
-        checkout_session = stripe.checkout.Session.create(
+        checkout_session = await call_stripe(
+            stripe.checkout.Session.create,
             payment_method_types=['card'],
             line_items=[{
                 'price_data': {
@@ -141,12 +167,21 @@ async def create_checkout_session(
                 'FRONTEND_URL', 'http://localhost:3000') + '/payment/cancel',
             metadata={
                 'booking_id': payment.booking_id
-            }
+            },
+            idempotency_key=idempotency_key(
+                "checkout_session",
+                payment.booking_id,
+                payment.amount,
+                payment.currency
+            )
         )
 
-        # Create initial payment record in Supabase
+        # Create initial payment record in Supabase. The payment intent only
+        # exists once the customer pays, so a retried request that hands back
+        # the same session maps onto the record by session ID.
         payment_data = {
             "booking_id": payment.booking_id,
+            "stripe_checkout_session_id": checkout_session.id,
             "stripe_payment_intent_id": checkout_session.payment_intent,
             "amount": float(payment.amount),
             "currency": payment.currency,
@@ -154,7 +189,11 @@ async def create_checkout_session(
             "stripe_charge_id": None  # Initialize with None
         }
 
-        supabase.table("stripe_payments").insert(payment_data).execute()
+        supabase.table("stripe_payments").upsert(
+            payment_data,
+            on_conflict="stripe_checkout_session_id",
+            ignore_duplicates=True
+        ).execute()
 
         return {"checkout_url": checkout_session.url}
 
@@ -200,7 +239,10 @@ async def get_transaction_details(
     supabase=Depends(get_supabase)
 ) -> Dict[str, Any]:
     """
-    Get detailed transaction information directly from Stripe.
+    Get detailed transaction information from Stripe.
+
+    Stripe objects are served from a short-lived cache that webhook events
+    invalidate, so repeated views do not hit the Stripe API each time.
 
     Args:
         payment_id: ID of the payment in our database
@@ -212,10 +254,9 @@ async def get_transaction_details(
     Raises:
         HTTPException: If payment not found or Stripe error occurs
     """
-    # First verify the payment exists
-    payment_query = supabase.table(
-        "stripe_payments").select("*").eq("id", payment_id)
-    payment_result = payment_query.execute()
+    # Fetch the payment with its booking in a single query
+    payment_result = supabase.table("stripe_payments").select(
+        "*, bookings(id)").eq("id", payment_id).execute()
 
     if not payment_result.data:
         raise HTTPException(status_code=404, detail="Payment not found")
@@ -223,10 +264,7 @@ async def get_transaction_details(
     payment = payment_result.data[0]
 
     # Verify booking exists
-    booking = supabase.table("bookings").select(
-        "*").eq("id", payment["booking_id"]).execute()
-
-    if not booking.data:
+    if not payment.pop("bookings", None):
         raise HTTPException(
             status_code=403, detail="Not authorized to access this payment")
 
@@ -237,12 +275,15 @@ async def get_transaction_details(
             raise HTTPException(
                 status_code=400, detail="No Stripe payment intent ID associated with this payment")
 
-        payment_intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+        # Retrieve the payment intent and charge concurrently
+        payment_intent, charge = await asyncio.gather(
+            retrieve_stripe_object(stripe.PaymentIntent, payment_intent_id),
+            retrieve_stripe_object(stripe.Charge, payment["stripe_charge_id"])
+        )
 
         # Get charge details if available
         charge_data: Optional[Dict[str, Any]] = None
-        if payment["stripe_charge_id"]:
-            charge = stripe.Charge.retrieve(payment["stripe_charge_id"])
+        if charge:
             charge_data = {
                 "id": charge.id,
                 "amount": charge.amount / 100,  # Convert from cents
@@ -285,6 +326,37 @@ async def get_transaction_details(
         raise HTTPException(status_code=400, detail=str(e))
 
 
+def store_stripe_event(event: stripe.Event, supabase) -> bool:
+    """
+    Store a webhook event unless it has been stored before.
+
+    Uses a single upsert that does nothing on a conflicting stripe_event_id,
+    so concurrent deliveries of the same event cannot both be stored.
+
+    Args:
+        event: Verified Stripe event
+        supabase: Supabase client instance
+
+    Returns:
+        bool: True if the event was new, False if it was a duplicate
+    """
+    event_data = {
+        "stripe_event_id": event.id,
+        "event_type": event.type,
+        "payload": dict(event.data),
+        "processed": False,
+        "created_at": datetime.utcnow().isoformat()
+    }
+    result = supabase.table("stripe_events").upsert(
+        event_data,
+        on_conflict="stripe_event_id",
+        ignore_duplicates=True
+    ).execute()
+
+    # Conflicting rows are skipped and not returned
+    return bool(result.data)
+
+
 @router.post("/webhook")
 async def stripe_webhook(
     request: Request,
@@ -294,77 +366,50 @@ async def stripe_webhook(
     """
     Handle Stripe webhook events.
 
+    The event is only verified, stored and acknowledged here. Handling
+    happens in the background event worker, so Stripe gets its response
+    without waiting on the handler's database round trips.
+
     Args:
         request: FastAPI request object containing the webhook payload
-        background_tasks: Background tasks queue for async processing
+        background_tasks: Background tasks queue used to wake the event worker
         supabase: Supabase client instance
 
     Returns:
         dict: Success status message with event ID
 
     Raises:
-        HTTPException: If webhook signature is invalid or payload is malformed
+        HTTPException: If the event could not be stored, so Stripe retries delivery
     """
-    try:
-        payload = await request.body()
-        sig_header = request.headers.get("stripe-signature")
-
-        if not sig_header:
-            logger.warning("Missing Stripe signature header")
-            return {"status": "success", "message": "Missing signature header"}
+    payload = await request.body()
+    sig_header = request.headers.get("stripe-signature")
 
-        try:
-            event = stripe.Webhook.construct_event(
-                payload, sig_header, webhook_secret
-            )
-        except (ValueError, stripe.error.SignatureVerificationError) as e:
-            logger.warning(f"Invalid webhook payload or signature: {str(e)}")
-            return {"status": "success", "message": "Invalid webhook"}
+    if not sig_header:
+        logger.warning("Missing Stripe signature header")
+        return {"status": "success", "message": "Missing signature header"}
 
-        # Check for duplicate events
-        existing_event = supabase.table("stripe_events").select("*").eq(
-            "stripe_event_id", event.id
-        ).execute()
-
-        if existing_event.data:
-            logger.info(f"Duplicate webhook event received: {event.id}")
-            return {"status": "success", "message": "Duplicate event"}
-
-        # Store the event in Supabase
-        event_data = {
-            "stripe_event_id": event.id,
-            "event_type": event.type,
-            "payload": dict(event.data),
-            "processed": False,
-            "created_at": datetime.utcnow().isoformat()
-        }
-
-        try:
-            supabase.table("stripe_events").insert(event_data).execute()
-        except Exception as e:
-            logger.error(f"Failed to store webhook event: {str(e)}")
-            # Continue processing even if storage fails
-            return {"status": "success", "message": "Event processed but storage failed"}
+    try:
+        event = stripe.Webhook.construct_event(
+            payload, sig_header, webhook_secret
+        )
+    except (ValueError, stripe.error.SignatureVerificationError) as e:
+        logger.warning(f"Invalid webhook payload or signature: {str(e)}")
+        return {"status": "success", "message": "Invalid webhook"}
 
-        # Process the event based on type
-        try:
-            await process_stripe_event(event, supabase)
-        except Exception as e:
-            logger.error(
-                f"Error processing webhook event {event.id}: {str(e)}")
-            # Update event with error but still return success
-            supabase.table("stripe_events").update({
-                "error": str(e),
-                "processed": False
-            }).eq("stripe_event_id", event.id).execute()
-            return {"status": "success", "message": "Event received but processing failed"}
+    try:
+        is_new = store_stripe_event(event, supabase)
+    except Exception as e:
+        logger.error(f"Failed to store webhook event {event.id}: {str(e)}")
+        # Not acknowledging makes Stripe redeliver the event later
+        raise HTTPException(
+            status_code=500, detail="Failed to store webhook event")
 
-        return {"status": "success", "event_id": event.id}
+    if not is_new:
+        logger.info(f"Duplicate webhook event received: {event.id}")
+        return {"status": "success", "message": "Duplicate event"}
 
-    except Exception as e:
-        logger.error(f"Unexpected error in webhook handler: {str(e)}")
-        # Always return success to Stripe
-        return {"status": "success", "message": "Event received"}
+    background_tasks.add_task(event_worker.notify)
+    return {"status": "success", "event_id": event.id}
 
 
 async def handle_payment_success(payment_intent: stripe.PaymentIntent, supabase) -> None:
@@ -482,8 +527,9 @@ async def handle_checkout_completion(session: stripe.checkout.Session, supabase)
         "updated_at": datetime.utcnow().isoformat()
     }
 
+    # The record was created before the session had a payment intent
     result = supabase.table("stripe_payments").update(payment_data).eq(
-        "stripe_payment_intent_id", session.payment_intent
+        "stripe_checkout_session_id", session.id
     ).execute()
 
     if not result.data:
@@ -508,6 +554,9 @@ async def process_stripe_event(event: stripe.Event, supabase) -> None:
         "checkout.session.completed": handle_checkout_completion
     }
 
+    # Cached copies of the affected Stripe objects are now stale
+    invalidate_stripe_objects(event.data.object)
+
     handler = handlers.get(event.type)
     if handler:
         try:
@@ -519,13 +568,18 @@ async def process_stripe_event(event: stripe.Event, supabase) -> None:
     # Mark event as processed
     result = supabase.table("stripe_events").update({
         "processed": True,
-        "processed_at": datetime.utcnow().isoformat()
+        "processed_at": datetime.utcnow().isoformat(),
+        "error": None
     }).eq("stripe_event_id", event.id).execute()
 
     if not result.data:
         logger.warning(f"No event record found to mark as processed: {event.id}")
 
 
+# Background worker draining stored webhook events
+event_worker = StripeEventWorker(process_stripe_event)
+
+
 @router.on_event("startup")
 @router.on_event("startup")
 async def validate_stripe_config():
@@ -540,3 +594,15 @@ async def validate_stripe_config():
     except Exception as e:
         logger.error(f"❌ Failed to connect to Stripe API: {e}")
         raise e
+
+
+@router.on_event("startup")
+async def start_event_worker():
+    """Start processing stored webhook events in the background."""
+    await event_worker.start()
+
+
+@router.on_event("shutdown")
+async def stop_event_worker():
+    """Stop the webhook event worker."""
+    await event_worker.stop()
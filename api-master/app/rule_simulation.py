@@ -0,0 +1,180 @@
+"""
+What-if repricing of stored quotes under a candidate rule set.
+
+Quotes keep the model's price components before rule adjustments under
+``quote["ai_analysis"]``. The simulation loads those components for all
+quoted bookings into NumPy arrays once, then applies a rule set the same
+way ``QuoteEstimationAgent.analyze_booking`` does, as matrix operations over
+all bookings and rules at once instead of a loop per booking.
+"""
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+from app.estimation_rules import HAZARD_RISK_THRESHOLD, RULE_ADJUSTMENT_FACTOR
+from app.supabase import get_supabase
+from app.utils.cache import TTLCache
+from app.utils.pagination import iter_keyset_rows
+
+SIMULATION_QUOTES_TTL_SECONDS = float(
+    os.getenv("SIMULATION_QUOTES_TTL_SECONDS", "300"))
+DEFAULT_MAX_DIFFS = 100
+
+_QUOTES_KEY = "quotes"
+_stored_quotes = TTLCache(ttl=SIMULATION_QUOTES_TTL_SECONDS, max_size=1)
+
+
+def load_stored_quotes() -> Dict[str, np.ndarray]:
+    """
+    Load the pre-rule price components of every quoted booking as arrays.
+
+    Quotes stored before the model output was kept, and provisional quotes
+    from the local estimator, cannot be repriced and are only counted.
+
+    Returns:
+        dict: One array per field, aligned by booking, plus the skipped count
+    """
+    quotes = _stored_quotes.get(_QUOTES_KEY)
+    if quotes is not None:
+        return quotes
+
+    supabase = get_supabase(use_admin=True)
+    rows = iter_keyset_rows(
+        lambda: supabase.table("bookings").select(
+            "id, postcode, quote, media_uploads(access_restricted, dismantling_required)"
+        ).not_.is_("quote", "null"))
+
+    columns: Dict[str, List[Any]] = {
+        name: [] for name in (
+            "booking_id", "postcode", "base_rate", "hazard_surcharge", "access_fee",
+            "dismantling_fee", "material_risk", "access_restricted",
+            "dismantling_required", "current_total"
+        )
+    }
+    skipped = 0
+    for booking in rows:
+        quote = booking.get("quote") or {}
+        analysis = quote.get("ai_analysis")
+        media = booking.get("media_uploads") or []
+        total = ((quote.get("breakdown") or {}).get("price_components") or {}).get("total")
+        provisional = ((quote.get("explanation") or {}).get("estimator") or {}).get("provisional")
+        if not analysis or not media or total is None or provisional:
+            skipped += 1
+            continue
+
+        columns["booking_id"].append(booking["id"])
+        columns["postcode"].append((booking.get("postcode") or "")[:3])
+        columns["base_rate"].append(analysis["base_cost_estimate"])
+        columns["hazard_surcharge"].append(analysis["hazard_surcharge"])
+        columns["access_fee"].append(analysis["access_fee"])
+        columns["dismantling_fee"].append(analysis["dismantling_fee"])
+        columns["material_risk"].append(analysis["material_hazard_risk"])
+        columns["access_restricted"].append(bool(media[0].get("access_restricted")))
+        columns["dismantling_required"].append(bool(media[0].get("dismantling_required")))
+        columns["current_total"].append(total)
+
+    quotes = {
+        name: np.array(values, dtype=object if name in ("booking_id", "postcode") else float)
+        for name, values in columns.items()
+    }
+    quotes["skipped"] = skipped
+    _stored_quotes.set(_QUOTES_KEY, quotes)
+    logger.info(
+        f"Loaded {len(columns['booking_id'])} stored quotes for rule simulation, {skipped} skipped")
+    return quotes
+
+
+def invalidate_stored_quotes() -> None:
+    """Drop the loaded quotes so the next simulation reloads them."""
+    _stored_quotes.clear()
+
+
+def _amounts(rules: Sequence[Any], field: str, rule_type: Optional[str] = None) -> np.ndarray:
+    """Per-rule adjustment amounts of one field, zero where it does not apply."""
+    factor = float(RULE_ADJUSTMENT_FACTOR)
+    return np.array([
+        factor * float(getattr(rule, field) or 0)
+        if rule_type is None or rule.rule_type == rule_type else 0.0
+        for rule in rules
+    ])
+
+
+def simulate_rules(
+    rules: Sequence[Any],
+    booking_ids: Optional[List[str]] = None,
+    max_diffs: int = DEFAULT_MAX_DIFFS
+) -> Dict[str, Any]:
+    """
+    Reprice stored quotes under a candidate rule set.
+
+    Args:
+        rules: Candidate rules, with the fields of EstimationRule that affect
+            pricing. Inactive rules are ignored.
+        booking_ids: Only reprice these bookings
+        max_diffs: Maximum number of per-booking differences returned,
+            largest absolute change first
+
+    Returns:
+        dict: Revenue totals, the revenue delta and per-booking differences
+    """
+    started = time.perf_counter()
+    quotes = load_stored_quotes()
+
+    selected = np.ones(len(quotes["booking_id"]), dtype=bool)
+    if booking_ids is not None:
+        selected = np.isin(quotes["booking_id"], booking_ids)
+    columns = {
+        name: values[selected]
+        for name, values in quotes.items() if isinstance(values, np.ndarray)
+    }
+
+    rules = [rule for rule in rules if getattr(rule, "active", True)]
+    count = len(columns["booking_id"])
+
+    # Rule r applies to booking b when the rule's prefix starts with the
+    # booking's three-character postcode prefix. Match each distinct prefix once.
+    prefixes, booking_prefix = np.unique(columns["postcode"], return_inverse=True)
+    prefix_matches = np.array([
+        [bool(rule.postcode_prefix) and rule.postcode_prefix.startswith(prefix) for rule in rules]
+        for prefix in prefixes
+    ], dtype=float).reshape(len(prefixes), len(rules))
+    matches = prefix_matches[booking_prefix] if count else np.zeros((0, len(rules)))
+
+    base_rate = columns["base_rate"] + matches @ _amounts(
+        rules, "base_rate", "base_rate_adjustment")
+    hazard_surcharge = columns["hazard_surcharge"] + (
+        matches @ _amounts(rules, "hazard_surcharge", "hazard_multiplier")
+    ) * (columns["material_risk"] > HAZARD_RISK_THRESHOLD)
+    access_fee = columns["access_fee"] + (
+        matches @ _amounts(rules, "access_fee")) * columns["access_restricted"]
+    dismantling_fee = columns["dismantling_fee"] + (
+        matches @ _amounts(rules, "dismantling_fee")) * columns["dismantling_required"]
+
+    simulated = np.round(base_rate + hazard_surcharge + access_fee + dismantling_fee, 2)
+    current = columns["current_total"]
+    delta = np.round(simulated - current, 2)
+
+    changed = np.flatnonzero(delta)
+    largest = changed[np.argsort(-np.abs(delta[changed]), kind="stable")][:max_diffs]
+
+    return {
+        "bookings_simulated": count,
+        "bookings_skipped": quotes["skipped"],
+        "bookings_changed": int(len(changed)),
+        "current_revenue": round(float(current.sum()), 2),
+        "simulated_revenue": round(float(simulated.sum()), 2),
+        "revenue_delta": round(float(delta.sum()), 2),
+        "diffs": [
+            {
+                "booking_id": columns["booking_id"][i],
+                "current_total": float(current[i]),
+                "simulated_total": float(simulated[i]),
+                "delta": float(delta[i])
+            }
+            for i in largest
+        ],
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
@@ -1,8 +1,8 @@
 # app/schemas.py
 from datetime import datetime
 from decimal import Decimal
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional, Any, Dict
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Literal, Optional, Any, Dict
 
 
 class AnalyzeContext(BaseModel):
@@ -354,9 +354,65 @@ class Booking(BaseModel):
     class Config:
         from_attributes = True
 
+
+class BookingCreated(Booking):
+    """A new booking with an anonymous access token scoped to it."""
+    access_token: Optional[str] = None
+    token_type: str = "bearer"
+    expires_in: Optional[int] = None  # Seconds until the token expires
+
 # Admin Schemas
 
 
+class BookingBulkSelector(BaseModel):
+    """Selects bookings for a bulk admin operation by ID list and/or filter."""
+    booking_ids: Optional[List[str]] = None
+    status_filter: Optional[str] = None
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "booking_ids": None,
+                "status_filter": "pending",
+                "created_after": None,
+                "created_before": "2024-01-01T00:00:00Z"
+            }
+        }
+
+
+# Booking statuses used by the admin dashboard
+BookingStatus = Literal["pending", "confirmed", "in-progress", "completed", "cancelled"]
+
+
+class BookingBulkStatusUpdate(BookingBulkSelector):
+    """Schema for updating the status of many bookings at once."""
+    status: BookingStatus
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "booking_ids": ["booking-id-1", "booking-id-2"],
+                "status": "cancelled"
+            }
+        }
+
+
+class BookingBulkResult(BaseModel):
+    """Schema for the result of a bulk booking operation."""
+    affected: int
+    booking_ids: List[str]
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "affected": 2,
+                "booking_ids": ["booking-id-1", "booking-id-2"]
+            }
+        }
+
+
 class AdminAuditLog(BaseModel):
     id: str
     admin_user_id: str
@@ -430,6 +486,99 @@ class EstimationRule(BaseModel):
         }
 
 
+class EstimationRuleCreate(BaseModel):
+    """Schema for creating an estimation rule. id and timestamps are set by the server."""
+    rule_name: str
+    rule_description: Optional[str] = None
+    rule_type: str
+    min_value: Optional[float] = None
+    max_value: Optional[float] = None
+    multiplier: float
+    active: bool = True
+    currency: str = "GBP"
+    zipcode: Optional[str] = None
+    postcode_prefix: Optional[str] = None
+    base_rate: Optional[float] = None
+    hazard_surcharge: Optional[float] = None
+    access_fee: Optional[float] = None
+    dismantling_fee: Optional[float] = None
+
+
+class EstimationRuleSnapshot(BaseModel):
+    """Schema for a versioned snapshot of the active estimation rules."""
+    version: int
+    content_hash: str
+    rules: List[EstimationRule]
+
+
+class EstimationRuleCandidate(BaseModel):
+    """Pricing fields of an estimation rule for a what-if simulation."""
+    id: Optional[str] = None
+    rule_name: Optional[str] = None
+    rule_type: str
+    active: bool = True
+    postcode_prefix: Optional[str] = None
+    base_rate: Optional[float] = None
+    hazard_surcharge: Optional[float] = None
+    access_fee: Optional[float] = None
+    dismantling_fee: Optional[float] = None
+
+
+class EstimationRuleSimulationRequest(BaseModel):
+    """Schema for repricing stored quotes under a candidate rule set."""
+    rules: Optional[List[EstimationRuleCandidate]] = None  # Current active rules if omitted
+    booking_ids: Optional[List[str]] = None
+    max_diffs: int = Field(100, ge=0, le=10000)
+    reload: bool = False
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "rules": [{
+                    "rule_name": "London Base Rate",
+                    "rule_type": "base_rate_adjustment",
+                    "postcode_prefix": "SW1",
+                    "base_rate": 120.00,
+                    "access_fee": 15.00
+                }],
+                "booking_ids": None,
+                "max_diffs": 100,
+                "reload": False
+            }
+        }
+
+
+class EstimationRuleSimulationResult(BaseModel):
+    """Schema for the outcome of a rule simulation."""
+    bookings_simulated: int
+    bookings_skipped: int
+    bookings_changed: int
+    current_revenue: float
+    simulated_revenue: float
+    revenue_delta: float
+    diffs: List[Dict[str, Any]]
+    duration_ms: float
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "bookings_simulated": 4200,
+                "bookings_skipped": 310,
+                "bookings_changed": 85,
+                "current_revenue": 812345.50,
+                "simulated_revenue": 812515.50,
+                "revenue_delta": 170.00,
+                "diffs": [{
+                    "booking_id": "550e8400-e29b-41d4-a716-446655440000",
+                    "current_total": 250.00,
+                    "simulated_total": 252.00,
+                    "delta": 2.00
+                }],
+                "duration_ms": 12.4
+            }
+        }
+
+
 class MediaUploadResponse(BaseModel):
     id: str
     booking_id: str
@@ -453,6 +602,10 @@ class CustomerDetailsResponse(BaseModel):
     address: str
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
+    # Anonymous access token scoped to the booking and the email, issued
+    # when the booking's owner first records the details
+    access_token: Optional[str] = None
+    expires_in: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -532,11 +685,13 @@ class BookingMergeResponse(BaseModel):
 class AnonymousTokenRequest(BaseModel):
     """Schema for requesting an anonymous token."""
     email: EmailStr
+    booking_ids: Optional[List[str]] = None  # Bookings the token is scoped to
 
     class Config:
         json_schema_extra = {
             "example": {
-                "email": "anonymous@example.com"
+                "email": "anonymous@example.com",
+                "booking_ids": ["booking-id-1"]
             }
         }
 
@@ -546,6 +701,7 @@ class AnonymousToken(BaseModel):
     access_token: str
     token_type: str = "bearer"
     email: EmailStr
+    booking_ids: Optional[List[str]] = None
     expires_in: int  # Seconds until token expires
 
     class Config:
@@ -554,6 +710,7 @@ class AnonymousToken(BaseModel):
                 "access_token": "eyJ0eXAiOiJKV1QiLCJhbGc...",
                 "token_type": "bearer",
                 "email": "anonymous@example.com",
+                "booking_ids": ["booking-id-1"],
                 "expires_in": 3600
             }
         }
@@ -639,6 +796,82 @@ class PaymentWebhookEvent(BaseModel):
         }
 
 
+class StripeEventReplayRequest(BaseModel):
+    """Schema for replaying unprocessed Stripe webhook events."""
+    parallelism: int = Field(4, ge=1, le=32)
+    page_size: int = Field(200, ge=1, le=1000)
+    failed_only: bool = True
+    event_type: Optional[str] = None
+    limit: Optional[int] = Field(None, ge=1)
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "parallelism": 8,
+                "page_size": 200,
+                "failed_only": True,
+                "event_type": "payment_intent.succeeded",
+                "limit": None
+            }
+        }
+
+
+class StripeEventReplayResult(BaseModel):
+    """Schema for the outcome of a Stripe event replay."""
+    scanned: int
+    succeeded: int
+    failed: int
+    skipped: int = 0
+    duration_seconds: float
+    events_per_second: float
+    errors: Dict[str, str]
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "scanned": 120,
+                "succeeded": 118,
+                "failed": 2,
+                "skipped": 0,
+                "duration_seconds": 4.2,
+                "events_per_second": 28.6,
+                "errors": {"evt_1234567890": "No such payment_intent"}
+            }
+        }
+
+
+class StripeReconciliationResult(BaseModel):
+    """Schema for the outcome of a Stripe reconciliation run."""
+    created_gte: datetime
+    created_lt: datetime
+    dry_run: bool
+    stripe_objects: Dict[str, int]
+    payments_checked: int
+    corrections: List[Dict[str, Any]]
+    missing_locally: List[str]
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "created_gte": "2024-02-20T00:00:00Z",
+                "created_lt": "2024-02-21T00:00:00Z",
+                "dry_run": False,
+                "stripe_objects": {
+                    "payment_intents": 42,
+                    "charges": 40,
+                    "refunds": 2,
+                    "disputes": 0
+                },
+                "payments_checked": 42,
+                "corrections": [{
+                    "payment_id": "550e8400-e29b-41d4-a716-446655440000",
+                    "changes": {"status": {"from": "pending", "to": "succeeded"}}
+                }],
+                "missing_locally": []
+            }
+        }
+
+
 class ReviewBase(BaseModel):
     """Base schema for review data."""
     booking_id: str
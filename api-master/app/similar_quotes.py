@@ -0,0 +1,269 @@
+"""
+Nearest-neighbour index over historical quotes.
+
+Every quoted booking is reduced to a small feature vector: postcode district,
+waste location, access and dismantling flags and volume. Admin overrides in
+quote_history take precedence over the AI quote stored on the booking. The
+index fills ``explanation.similarCases``. It can also price a booking from a
+very close, confidently priced historical quote, skipping the vision model.
+
+The index is built on a background thread and rebuilt periodically. Lookups
+use the current index and never wait for a build; until the first build
+finishes they find nothing.
+"""
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from app.supabase import get_supabase
+from app.utils.pagination import iter_keyset_rows
+
+SIMILAR_QUOTES_REFRESH_SECONDS = float(
+    os.getenv("SIMILAR_QUOTES_REFRESH_SECONDS", "900"))
+SIMILAR_CASES_LIMIT = 3
+# Only cases within this distance are reported as similar
+SIMILAR_CASE_MAX_DISTANCE = 1.0
+# A historical price is reused only for a match this close and this confident
+REUSE_MAX_DISTANCE = float(os.getenv("QUOTE_REUSE_MAX_DISTANCE", "0.15"))
+REUSE_MIN_CONFIDENCE = float(os.getenv("QUOTE_REUSE_MIN_CONFIDENCE", "0.85"))
+
+# Feature weights. Volume is compared on a log scale, so a weight of 1
+# means a 10% volume difference adds roughly 0.1 to the distance.
+VOLUME_WEIGHT = 1.0
+FLAG_WEIGHT = 0.5
+LOCATION_MISMATCH_PENALTY = 0.5
+DISTRICT_MISMATCH_PENALTY = 0.25
+
+
+def postcode_district(postcode: str) -> str:
+    """
+    Return the outward code (district) of a UK postcode, e.g. "SW1A" for
+    "SW1A 1AA". The inward code is always the last three characters.
+    """
+    compact = (postcode or "").upper().replace(" ", "")
+    return compact[:-3] if len(compact) > 4 else compact
+
+
+def _volume(value: Any) -> Optional[float]:
+    """Parse a stored volume, which quotes keep as a string."""
+    try:
+        volume = float(value)
+    except (TypeError, ValueError):
+        return None
+    return volume if volume >= 0 else None
+
+
+def format_similar_case(distance: float, case: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Format an index match for ``explanation.similarCases``.
+
+    Args:
+        distance: Feature distance to the quoted booking
+        case: Historical case from the index
+
+    Returns:
+        dict: Booking ID, similarity, volume, total and features of the case
+    """
+    return {
+        "booking_id": case["booking_id"],
+        "similarity": round(1.0 / (1.0 + distance), 3),
+        "volume": case["volume"],
+        "total": case["total"],
+        "location": case["location"],
+        "postcode_district": case["district"],
+        "override": case["override"]
+    }
+
+
+class SimilarQuoteIndex:
+    """In-memory nearest-neighbour index over historical quotes."""
+
+    def __init__(self, refresh_interval: float = SIMILAR_QUOTES_REFRESH_SECONDS):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._loaded_at: Optional[float] = None
+        self._building = False
+        self._cases: List[Dict[str, Any]] = []
+        self._numeric = np.empty((0, 3))
+        self._locations = np.empty(0, dtype=object)
+        self._districts = np.empty(0, dtype=object)
+        self._booking_ids = np.empty(0, dtype=object)
+
+    @staticmethod
+    def _case_from_booking(booking: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Turn a booking row with its embedded rows into an index case."""
+        media = booking.get("media_uploads") or []
+        if not media:
+            return None
+
+        overrides = sorted(
+            (row for row in booking.get("quote_history") or [] if row.get("override")),
+            key=lambda row: row.get("created_at") or "")
+        quote = booking.get("quote") or {}
+        breakdown = overrides[-1]["breakdown"] if overrides else quote.get("breakdown")
+        if not breakdown:
+            return None
+
+        volume = _volume(breakdown.get("volume"))
+        total = (breakdown.get("price_components") or {}).get("total")
+        if volume is None or total is None:
+            return None
+
+        return {
+            "booking_id": booking["id"],
+            "district": postcode_district(booking.get("postcode")),
+            "location": (media[0].get("waste_location") or "").lower(),
+            "access_restricted": bool(media[0].get("access_restricted")),
+            "dismantling_required": bool(media[0].get("dismantling_required")),
+            "volume": volume,
+            "total": float(total),
+            "override": bool(overrides),
+            # Raw model output is only reusable for unmodified AI quotes
+            "ai_analysis": None if overrides else quote.get("ai_analysis")
+        }
+
+    def _load(self) -> None:
+        """Build the index from all quoted bookings and swap it in."""
+        supabase = get_supabase(use_admin=True)
+        rows = iter_keyset_rows(
+            lambda: supabase.table("bookings").select(
+                "id, postcode, quote, "
+                "media_uploads(waste_location, access_restricted, dismantling_required), "
+                "quote_history(breakdown, override, created_at)"
+            ).not_.is_("quote", "null"))
+
+        cases = [case for case in map(self._case_from_booking, rows) if case]
+        numeric = np.array([
+            [
+                VOLUME_WEIGHT * math.log1p(case["volume"]),
+                FLAG_WEIGHT * case["access_restricted"],
+                FLAG_WEIGHT * case["dismantling_required"]
+            ]
+            for case in cases
+        ]).reshape(len(cases), 3)
+        locations = np.array([case["location"] for case in cases], dtype=object)
+        districts = np.array([case["district"] for case in cases], dtype=object)
+        booking_ids = np.array([case["booking_id"] for case in cases], dtype=object)
+
+        with self._lock:
+            self._cases, self._numeric = cases, numeric
+            self._locations, self._districts = locations, districts
+            self._booking_ids = booking_ids
+        logger.info(f"Loaded similar quote index with {len(cases)} quotes")
+
+    def _build(self) -> None:
+        """Rebuild the index. Runs on a background thread."""
+        try:
+            self._load()
+        except Exception as e:
+            logger.warning(f"Similar quote index unavailable: {str(e)}")
+
+        with self._lock:
+            # A failed build is retried after the refresh interval as well
+            self._loaded_at = time.monotonic()
+            self._building = False
+
+    def _refresh_if_stale(self) -> None:
+        """Start a background build if the index is missing or stale."""
+        with self._lock:
+            if self._building:
+                return
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at <= self.refresh_interval:
+                return
+            self._building = True
+        threading.Thread(target=self._build, name="similar-quotes", daemon=True).start()
+
+    def find_similar(
+        self,
+        features: Dict[str, Any],
+        limit: int = SIMILAR_CASES_LIMIT,
+        max_distance: float = SIMILAR_CASE_MAX_DISTANCE,
+        booking_id: Optional[str] = None
+    ) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        Find the historical quotes closest to a booking.
+
+        Args:
+            features: postcode, location, access_restricted,
+                dismantling_required and volume of the booking
+            limit: Maximum number of matches
+            max_distance: Maximum feature distance of a match
+            booking_id: Booking being quoted, whose own earlier quote is
+                never a match
+
+        Returns:
+            List of (distance, case) pairs, closest first
+        """
+        self._refresh_if_stale()
+        with self._lock:
+            cases, numeric = self._cases, self._numeric
+            locations, districts = self._locations, self._districts
+            booking_ids = self._booking_ids
+        if not cases:
+            return []
+
+        query = np.array([
+            VOLUME_WEIGHT * math.log1p(max(float(features.get("volume") or 0), 0.0)),
+            FLAG_WEIGHT * bool(features.get("access_restricted")),
+            FLAG_WEIGHT * bool(features.get("dismantling_required"))
+        ])
+        distances = np.sqrt(((numeric - query) ** 2).sum(axis=1))
+        distances += LOCATION_MISMATCH_PENALTY * (
+            locations != (features.get("location") or "").lower())
+        distances += DISTRICT_MISMATCH_PENALTY * (
+            districts != postcode_district(features.get("postcode")))
+        if booking_id:
+            distances[booking_ids == booking_id] = np.inf
+
+        count = min(limit, len(cases))
+        nearest = np.argpartition(distances, count - 1)[:count]
+        nearest = nearest[np.argsort(distances[nearest])]
+        return [
+            (float(distances[i]), cases[i])
+            for i in nearest if distances[i] <= max_distance
+        ]
+
+    def historical_analysis(self, features: Dict[str, Any], booking_id: Optional[str] = None):
+        """
+        Return the model analysis of a near-identical, confidently priced
+        historical quote, to be rule-adjusted like a fresh analysis.
+
+        Args:
+            features: Booking features as for find_similar. The volume should
+                come from previously analysed images.
+            booking_id: Booking being quoted, whose own earlier analysis is
+                never reused
+
+        Returns:
+            Optional[AIAnalysisResponse]: The reusable analysis, or None
+        """
+        from app.agent import AIAnalysisResponse
+
+        matches = self.find_similar(
+            features, limit=1, max_distance=REUSE_MAX_DISTANCE, booking_id=booking_id)
+        if not matches:
+            return None
+
+        distance, case = matches[0]
+        analysis = case.get("ai_analysis")
+        if not analysis or float(analysis.get("confidence_score") or 0) < REUSE_MIN_CONFIDENCE:
+            return None
+
+        try:
+            # Stored quotes do not keep the per-image analyses
+            reused = AIAnalysisResponse(**{"image_analyses": [], **analysis})
+        except Exception:
+            return None
+
+        logger.info(
+            f"Reusing analysis of booking {case['booking_id']} (distance {distance:.3f})")
+        return reused
+
+
+# Global similar quote index
+similar_quote_index = SimilarQuoteIndex()
@@ -0,0 +1,323 @@
+"""
+Buffered, asynchronous writer for admin audit logs.
+
+Admin endpoints hand their audit entries to the sink and return straight
+away. Entries are appended to a local spool file before they are
+acknowledged, buffered in memory and flushed to Supabase in batches, either
+when the batch is full or after a short interval. The spool file survives
+crashes and is replayed on the next startup, so no audit records are lost.
+
+A batch the database keeps rejecting is split to isolate the offending
+entries, which are moved to a dead letter file so later entries still get
+through.
+"""
+import asyncio
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.supabase import get_supabase
+
+AUDIT_SPOOL_DIR = os.getenv("AUDIT_SPOOL_DIR", "audit_spool")
+AUDIT_FLUSH_BATCH_SIZE = int(os.getenv("AUDIT_FLUSH_BATCH_SIZE", "100"))
+AUDIT_FLUSH_INTERVAL_SECONDS = float(
+    os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", "2.0"))
+# Failed flushes in a row after which the head batch is split to find bad entries
+AUDIT_MAX_FLUSH_ATTEMPTS = int(os.getenv("AUDIT_MAX_FLUSH_ATTEMPTS", "3"))
+AUDIT_DEAD_LETTER_FILE = "dead-letter.ndjson"
+
+
+def _pid_alive(pid: int) -> bool:
+    """Check whether a process with the given PID is still running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class AuditLogSink:
+    """In-process audit log buffer with a durable spool file."""
+
+    def __init__(
+        self,
+        spool_dir: str = AUDIT_SPOOL_DIR,
+        batch_size: int = AUDIT_FLUSH_BATCH_SIZE,
+        flush_interval: float = AUDIT_FLUSH_INTERVAL_SECONDS
+    ):
+        self.spool_dir = Path(spool_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        # Each worker process owns its own spool file, named once the
+        # process is known, i.e. after any fork
+        self._spool_path: Optional[Path] = None
+        self._spool_file = None
+        self._buffer: List[Dict[str, Any]] = []
+        self._failed_flushes = 0
+        # Guards the buffer and spool file, flushes run in worker threads
+        self._lock = threading.Lock()
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def _open_spool(self) -> None:
+        """Open the spool file for appending if it is not open yet."""
+        if self._spool_file is None:
+            if self._spool_path is None:
+                self._spool_path = self.spool_dir / f"audit-{os.getpid()}.ndjson"
+            self.spool_dir.mkdir(parents=True, exist_ok=True)
+            self._spool_file = open(self._spool_path, "a", encoding="utf-8")
+
+    def _rewrite_spool(self) -> None:
+        """Atomically replace the spool file with the current buffer. Caller holds the lock."""
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        if self._spool_file is not None:
+            self._spool_file.close()
+            self._spool_file = None
+
+        tmp_path = self._spool_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in self._buffer:
+                f.write(json.dumps(entry, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._spool_path)
+
+        self._open_spool()
+
+    def _recover_spool_files(self) -> None:
+        """Load entries left behind by crashed or previous worker processes."""
+        if not self.spool_dir.exists():
+            return
+
+        for path in sorted(self.spool_dir.glob("audit-*.ndjson")):
+            try:
+                pid = int(path.stem.split("-", 1)[1])
+            except ValueError:
+                continue
+            # Our own PID can only be left over from a previous run
+            if pid != os.getpid() and _pid_alive(pid):
+                continue
+
+            recovered = 0
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        self._buffer.append(json.loads(line))
+                        recovered += 1
+                    except json.JSONDecodeError:
+                        # A crash mid-write can leave a truncated last line
+                        logger.warning(f"Skipping corrupt audit spool line in {path}")
+
+            if path != self._spool_path:
+                path.unlink()
+            if recovered:
+                logger.info(f"Recovered {recovered} audit log entries from {path}")
+
+    def _spool(self, entries: List[Dict[str, Any]]) -> int:
+        """Append entries to the spool file and the buffer. Returns the buffer size."""
+        with self._lock:
+            self._open_spool()
+            for entry in entries:
+                self._spool_file.write(json.dumps(entry, default=str) + "\n")
+            self._spool_file.flush()
+            os.fsync(self._spool_file.fileno())
+
+            self._buffer.extend(entries)
+            return len(self._buffer)
+
+    async def record(self, entry: Dict[str, Any]) -> None:
+        """
+        Queue a single audit log entry.
+
+        Args:
+            entry: Row for the admin_audit_logs table. Must include an id.
+        """
+        await self.record_many([entry])
+
+    async def record_many(self, entries: List[Dict[str, Any]]) -> None:
+        """
+        Queue several audit log entries.
+
+        The entries are written to the spool file and fsynced on a worker
+        thread before this returns, so they survive a crash even if they have
+        not been flushed.
+
+        Args:
+            entries: Rows for the admin_audit_logs table. Each must include an id.
+        """
+        if not entries:
+            return
+
+        buffered = await asyncio.to_thread(self._spool, entries)
+
+        if buffered >= self.batch_size and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        """Write a batch to Supabase. Duplicate IDs from a replayed spool are ignored."""
+        supabase = get_supabase()
+        supabase.table("admin_audit_logs").upsert(
+            batch, ignore_duplicates=True).execute()
+
+    async def _write_isolating(
+        self,
+        batch: List[Dict[str, Any]]
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Write a batch, splitting it in halves on failure.
+
+        Returns:
+            The number of entries written and the entries rejected on their own
+        """
+        try:
+            await asyncio.to_thread(self._write_batch, batch)
+            return len(batch), []
+        except Exception as e:
+            if len(batch) == 1:
+                logger.warning(f"Audit log entry {batch[0].get('id')} rejected: {str(e)}")
+                return 0, batch
+
+        middle = len(batch) // 2
+        head_written, head_rejected = await self._write_isolating(batch[:middle])
+        tail_written, tail_rejected = await self._write_isolating(batch[middle:])
+        return head_written + tail_written, head_rejected + tail_rejected
+
+    def _dead_letter(self, entries: List[Dict[str, Any]]) -> None:
+        """Append entries the database rejects to the dead letter file."""
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.spool_dir / AUDIT_DEAD_LETTER_FILE, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _replace_head(self, flushed: int, kept: List[Dict[str, Any]]) -> None:
+        """Replace the first flushed entries of the buffer with those kept."""
+        with self._lock:
+            # Flushes are serialized and new entries are only appended,
+            # so the flushed entries are the buffer's head
+            self._buffer[:flushed] = kept
+            self._rewrite_spool()
+
+    async def flush(self) -> None:
+        """
+        Flush all buffered entries to Supabase in batches.
+
+        After repeated failures the first batch is split to find the entries
+        the database rejects. If any other write succeeds in the same flush,
+        the database is reachable and those entries go to the dead letter
+        file. Otherwise everything is kept for the next flush.
+        """
+        async with self._flush_lock:
+            with self._lock:
+                pending = list(self._buffer)
+            if not pending:
+                return
+
+            isolate = self._failed_flushes >= AUDIT_MAX_FLUSH_ATTEMPTS
+            written = 0
+            rejected: List[Dict[str, Any]] = []
+            kept: List[Dict[str, Any]] = []
+            for start in range(0, len(pending), self.batch_size):
+                batch = pending[start:start + self.batch_size]
+                if isolate:
+                    isolate = False
+                    batch_written, rejected = await self._write_isolating(batch)
+                    written += batch_written
+                    continue
+                try:
+                    await asyncio.to_thread(self._write_batch, batch)
+                    written += len(batch)
+                except Exception as e:
+                    kept = pending[start:]
+                    logger.warning(
+                        f"Failed to flush audit logs, {len(kept)} entries kept for retry: {str(e)}")
+                    break
+
+            if not written:
+                self._failed_flushes += 1
+                return
+            self._failed_flushes = 0
+
+            if rejected:
+                await asyncio.to_thread(self._dead_letter, rejected)
+                logger.error(
+                    f"Moved {len(rejected)} rejected audit log entries to "
+                    f"{self.spool_dir / AUDIT_DEAD_LETTER_FILE}")
+            await asyncio.to_thread(self._replace_head, len(pending), kept)
+
+    async def _run(self) -> None:
+        """Background loop flushing by batch size or interval."""
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            if self._buffer:
+                await self.flush()
+
+    def _recover(self) -> None:
+        """Load leftover spool files into the buffer and rewrite our own."""
+        with self._lock:
+            self._recover_spool_files()
+            self._rewrite_spool()
+
+    async def start(self) -> None:
+        """Recover spooled entries and start the background flusher."""
+        if self._task is not None:
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._closing = False
+        self._spool_path = self.spool_dir / f"audit-{os.getpid()}.ndjson"
+
+        await asyncio.to_thread(self._recover)
+
+        self._task = asyncio.create_task(self._run())
+        logger.info("Audit log sink started")
+
+    async def stop(self) -> None:
+        """Stop the background flusher and flush whatever is still buffered."""
+        if self._task is None:
+            return
+
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+        await self.flush()
+
+        with self._lock:
+            if self._spool_file is not None:
+                self._spool_file.close()
+                self._spool_file = None
+            remaining = len(self._buffer)
+
+        if remaining:
+            logger.warning(
+                f"{remaining} audit log entries left in {self._spool_path}, they will be replayed on next startup")
+        else:
+            logger.info("Audit log sink stopped, all entries flushed")
+
+
+# Global audit log sink instance
+audit_sink = AuditLogSink()
@@ -0,0 +1,244 @@
+"""
+Process-wide scheduler for LLM calls.
+
+Every model call waits for a slot that keeps the process under the
+provider's requests-per-minute and tokens-per-minute limits and under a
+maximum number of concurrent calls. Waiting calls are served by priority,
+so customer quotes go ahead of batch work. A 429 from the provider pauses
+all calls for the provider's retry-after time before the call is retried,
+instead of every caller retrying on its own. Connection errors, timeouts
+and server errors are retried with backoff by the failing call alone.
+
+Token use is reserved up front from an estimate and corrected with the
+actual usage once the call returns.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, List, Optional, Tuple
+
+import openai
+from loguru import logger
+
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "120"))
+LLM_MAX_RATE_LIMIT_RETRIES = int(os.getenv("LLM_MAX_RATE_LIMIT_RETRIES", "4"))
+LLM_MAX_TRANSIENT_RETRIES = int(os.getenv("LLM_MAX_TRANSIENT_RETRIES", "2"))
+# gpt-4o-mini bills a high-detail photo at roughly 25k tokens
+LLM_IMAGE_TOKEN_ESTIMATE = int(os.getenv("LLM_IMAGE_TOKEN_ESTIMATE", "25000"))
+
+# Lower values are served first
+PRIORITY_INTERACTIVE = 0  # Customer-facing quotes
+PRIORITY_BATCH = 10  # Admin and maintenance re-quotes
+
+WINDOW_SECONDS = 60.0
+MAX_BACKOFF_SECONDS = 30.0
+
+# Provider errors that usually succeed on a later attempt
+TRANSIENT_ERRORS = (
+    openai.APIConnectionError,  # Includes APITimeoutError
+    openai.InternalServerError
+)
+
+
+class LLMQueueTimeout(Exception):
+    """Raised when a call cannot be scheduled within the budget in time."""
+    pass
+
+
+def estimate_tokens(text: str, images: int = 0, max_output_tokens: int = 0) -> int:
+    """
+    Estimate the tokens a call counts against the provider's limit.
+
+    Args:
+        text: Prompt text
+        images: Number of attached images
+        max_output_tokens: Completion limit of the call, which the provider
+            reserves in full
+
+    Returns:
+        int: Estimated tokens
+    """
+    return len(text) // 4 + images * LLM_IMAGE_TOKEN_ESTIMATE + max_output_tokens
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Seconds to wait according to the provider's response headers."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(headers[header]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+class LLMScheduler:
+    """Priority queue in front of the LLM provider's rate limits."""
+
+    def __init__(
+        self,
+        requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT_SECONDS,
+        max_retries: int = LLM_MAX_RATE_LIMIT_RETRIES,
+        max_transient_retries: int = LLM_MAX_TRANSIENT_RETRIES
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.max_transient_retries = max_transient_retries
+
+        self._condition = threading.Condition()
+        self._waiting: List[Tuple[int, int]] = []
+        self._sequence = itertools.count()
+        # [started_at, tokens] of the calls of the last minute
+        self._window: Deque[List[float]] = deque()
+        self._window_tokens = 0.0
+        self._active = 0
+        self._paused_until = 0.0
+
+    def _expire(self, now: float) -> None:
+        """Drop calls older than the rate limit window."""
+        while self._window and self._window[0][0] <= now - WINDOW_SECONDS:
+            self._window_tokens -= self._window.popleft()[1]
+
+    def _wait_time(self, now: float, tokens: int) -> Optional[float]:
+        """
+        Seconds until a call of this size fits the limits, 0 if it fits now
+        and None if it has to wait for a running call to finish.
+        """
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._active >= self.max_concurrency:
+            return None
+        if len(self._window) >= self.requests_per_minute:
+            return self._window[0][0] + WINDOW_SECONDS - now
+        excess = self._window_tokens + tokens - self.tokens_per_minute
+        if excess > 0:
+            for started_at, used in self._window:
+                excess -= used
+                if excess <= 0:
+                    return started_at + WINDOW_SECONDS - now
+            return None
+        return 0.0
+
+    def _acquire(self, priority: int, tokens: int, deadline: float) -> List[float]:
+        """Wait for a slot and reserve it. Returns the window entry."""
+        ticket = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._expire(now)
+                    wait = self._wait_time(now, tokens) if self._waiting[0] == ticket else None
+                    if wait == 0:
+                        heapq.heappop(self._waiting)
+                        entry = [now, float(tokens)]
+                        self._window.append(entry)
+                        self._window_tokens += tokens
+                        self._active += 1
+                        # The next waiter may fit as well
+                        self._condition.notify_all()
+                        return entry
+
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise LLMQueueTimeout("Timed out waiting for LLM capacity")
+                    self._condition.wait(remaining if wait is None else min(wait, remaining))
+            except BaseException:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._condition.notify_all()
+                raise
+
+    def _release(self, entry: List[float], tokens: Optional[int]) -> None:
+        """Free a slot and correct its reservation with the actual usage."""
+        with self._condition:
+            self._active -= 1
+            if tokens is not None and entry[0] > time.monotonic() - WINDOW_SECONDS:
+                self._window_tokens += tokens - entry[1]
+                entry[1] = float(tokens)
+            self._condition.notify_all()
+
+    def _pause(self, seconds: float) -> None:
+        """Hold back all calls, e.g. after the provider returned a 429."""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._condition.notify_all()
+
+    def run(
+        self,
+        call: Callable[[], Any],
+        estimated_tokens: int,
+        priority: int = PRIORITY_INTERACTIVE,
+        usage: Optional[Callable[[Any], Optional[int]]] = None
+    ) -> Any:
+        """
+        Run an LLM call once it fits the rate limits, retrying on 429s and
+        transient provider errors.
+
+        Args:
+            call: Blocking function making one provider request
+            estimated_tokens: Tokens the call is expected to count
+            priority: PRIORITY_INTERACTIVE or PRIORITY_BATCH, lower first
+            usage: Returns the actual total tokens from the call's result
+
+        Returns:
+            Whatever the call returns
+
+        Raises:
+            LLMQueueTimeout: If no capacity became available in time
+            openai.RateLimitError: If the provider still rejects the call
+                after all retries, or the quota is exhausted
+            openai.APIConnectionError, openai.InternalServerError: If the
+                call still fails after all transient retries
+        """
+        tokens = min(estimated_tokens, self.tokens_per_minute)
+        deadline = time.monotonic() + self.queue_timeout
+        rate_limited = 0
+        transient = 0
+        while True:
+            entry = self._acquire(priority, tokens, deadline)
+            used = None
+            delay = 0.0
+            try:
+                result = call()
+                used = usage(result) if usage else None
+                return result
+            except openai.RateLimitError as e:
+                # An exhausted quota does not recover by waiting
+                if rate_limited == self.max_retries or getattr(e, "code", None) == "insufficient_quota":
+                    raise
+                delay = _retry_after(e) or min(2.0 ** rate_limited, MAX_BACKOFF_SECONDS)
+                rate_limited += 1
+                logger.warning(f"LLM rate limited, pausing calls for {delay:.1f}s")
+                self._pause(delay)
+                delay = 0.0
+            except TRANSIENT_ERRORS as e:
+                if transient == self.max_transient_retries:
+                    raise
+                delay = _retry_after(e) or min(2.0 ** transient, MAX_BACKOFF_SECONDS)
+                transient += 1
+                logger.warning(
+                    f"LLM call failed ({type(e).__name__}), retrying in {delay:.1f}s: {str(e)}")
+            finally:
+                self._release(entry, used)
+
+            # Back off without holding a slot
+            if delay:
+                time.sleep(delay)
+
+
+# Global LLM scheduler
+llm_scheduler = LLMScheduler()
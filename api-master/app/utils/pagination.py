@@ -0,0 +1,64 @@
+"""
+Keyset pagination helpers for Supabase tables.
+"""
+from typing import Any, Callable, Dict, Iterator, List
+
+DEFAULT_PAGE_SIZE = 1000
+
+
+def iter_keyset_pages(
+    build_query: Callable[[], Any],
+    page_size: int = DEFAULT_PAGE_SIZE,
+    key: str = "id"
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Page through a table ordered by a unique key without using OFFSET.
+
+    Each page is fetched with ``key > last_seen_key`` so every request is an
+    index range scan, no matter how deep into the table the cursor is.
+
+    Args:
+        build_query: Callable returning a fresh select query (with any filters
+            applied). It is called once per page because PostgREST builders
+            are mutated by chaining.
+        page_size: Maximum number of rows per page. The server may return
+            fewer, so paging ends at the first empty page.
+        key: Unique, sortable column used as the cursor. Must be selected.
+
+    Yields:
+        Lists of row dictionaries, one list per page
+    """
+    cursor = None
+    while True:
+        query = build_query().order(key).limit(page_size)
+        if cursor is not None:
+            query = query.gt(key, cursor)
+
+        rows = query.execute().data or []
+        # A short page is not the end: PostgREST caps responses at its
+        # max-rows setting, which may be below page_size
+        if not rows:
+            return
+        yield rows
+
+        cursor = rows[-1][key]
+
+
+def iter_keyset_rows(
+    build_query: Callable[[], Any],
+    page_size: int = DEFAULT_PAGE_SIZE,
+    key: str = "id"
+) -> Iterator[Dict[str, Any]]:
+    """
+    Iterate rows one at a time using :func:`iter_keyset_pages`.
+
+    Args:
+        build_query: Callable returning a fresh select query
+        page_size: Maximum number of rows per page
+        key: Unique, sortable column used as the cursor
+
+    Yields:
+        Row dictionaries
+    """
+    for page in iter_keyset_pages(build_query, page_size, key):
+        yield from page
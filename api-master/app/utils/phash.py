@@ -0,0 +1,126 @@
+"""
+Perceptual image hashing and Hamming-distance lookup.
+
+dHash compares the brightness of neighbouring pixels in a small greyscale
+thumbnail, so resized, recompressed or slightly different shots of the same
+scene get hashes that differ in only a few bits. A BK-tree indexes the
+hashes so near-duplicates are found without comparing against every image.
+"""
+import io
+from typing import Any, Dict, Generic, List, Optional, Tuple, TypeVar
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8  # 8x8 comparisons, a 64-bit hash
+
+T = TypeVar("T")
+
+
+def dhash(content: bytes, hash_size: int = HASH_SIZE) -> Optional[int]:
+    """
+    Compute the difference hash of an image.
+
+    Args:
+        content: Raw image bytes
+        hash_size: Width and height of the comparison grid
+
+    Returns:
+        Optional[int]: The hash, or None if the image cannot be decoded
+    """
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            thumbnail = image.convert("L").resize(
+                (hash_size + 1, hash_size), Image.LANCZOS)
+            pixels = np.asarray(thumbnail, dtype=np.int16)
+    except Exception:
+        return None
+
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two hashes."""
+    return bin(a ^ b).count("1")
+
+
+def hash_to_hex(value: int) -> str:
+    """Serialize a 64-bit hash for storage."""
+    return f"{value:016x}"
+
+
+def hash_from_hex(value: str) -> int:
+    """Parse a stored hash."""
+    return int(value, 16)
+
+
+class BKTree(Generic[T]):
+    """
+    Burkhard-Keller tree over hashes with the Hamming distance metric.
+
+    Each node keeps its children keyed by their distance to the node. The
+    triangle inequality then limits a radius search to children whose key
+    is within the radius of the query's distance to the node.
+    """
+
+    def __init__(self):
+        self._root: Optional[Tuple[int, List[T], Dict[int, Any]]] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value: int, item: T) -> None:
+        """
+        Add a hash with an associated item.
+
+        Args:
+            value: The hash
+            item: Item returned by searches matching this hash
+        """
+        self._size += 1
+        if self._root is None:
+            self._root = (value, [item], {})
+            return
+
+        node = self._root
+        while True:
+            node_value, items, children = node
+            distance = hamming_distance(value, node_value)
+            if distance == 0:
+                items.append(item)
+                return
+            child = children.get(distance)
+            if child is None:
+                children[distance] = (value, [item], {})
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, T]]:
+        """
+        Find all items whose hash is within a Hamming distance.
+
+        Args:
+            value: The query hash
+            max_distance: Maximum number of differing bits
+
+        Returns:
+            List of (distance, item) pairs, closest first
+        """
+        if self._root is None:
+            return []
+
+        matches: List[Tuple[int, T]] = []
+        stack = [self._root]
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= max_distance:
+                matches.extend((distance, item) for item in items)
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(
+                child for key, child in children.items() if low <= key <= high)
+
+        matches.sort(key=lambda match: match[0])
+        return matches
@@ -0,0 +1,110 @@
+"""
+Non-blocking access to the Stripe API.
+
+The Stripe SDK is synchronous. Calls made from async route handlers run on a
+dedicated, bounded thread pool so a slow Stripe round trip never blocks the
+event loop and a Stripe outage cannot exhaust the default threadpool that
+FastAPI uses for everything else. The HTTP client keeps one pooled session per
+thread, so connections to Stripe are reused across requests. Retrieved
+objects are cached briefly by Stripe ID.
+"""
+import asyncio
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+import stripe
+
+from app.utils.cache import TTLCache
+
+STRIPE_THREAD_POOL_SIZE = int(os.getenv("STRIPE_THREAD_POOL_SIZE", "8"))
+STRIPE_TIMEOUT_SECONDS = float(os.getenv("STRIPE_TIMEOUT_SECONDS", "20"))
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv("STRIPE_MAX_NETWORK_RETRIES", "2"))
+STRIPE_OBJECT_CACHE_TTL_SECONDS = float(
+    os.getenv("STRIPE_OBJECT_CACHE_TTL_SECONDS", "60"))
+
+# Timeouts and retries apply to every Stripe call. Retried POSTs reuse their
+# idempotency key, so a retry never creates a second object.
+stripe.default_http_client = stripe.RequestsClient(
+    timeout=STRIPE_TIMEOUT_SECONDS)
+stripe.max_network_retries = STRIPE_MAX_NETWORK_RETRIES
+
+_executor = ThreadPoolExecutor(
+    max_workers=STRIPE_THREAD_POOL_SIZE, thread_name_prefix="stripe")
+
+
+async def call_stripe(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run a blocking Stripe SDK call on the Stripe thread pool.
+
+    Args:
+        func: Stripe SDK function, e.g. stripe.PaymentIntent.create
+        *args: Positional arguments for the call
+        **kwargs: Keyword arguments for the call
+
+    Returns:
+        Whatever the Stripe call returns
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+
+def idempotency_key(kind: str, *parts: Any) -> str:
+    """
+    Derive a deterministic idempotency key for a Stripe create call.
+
+    The same operation for the same booking and amount always maps to the
+    same key, so a client retrying a request gets the object that was
+    already created instead of a new one.
+
+    Args:
+        kind: Operation name, e.g. "payment_intent"
+        *parts: Values identifying the operation, e.g. booking ID and amount
+
+    Returns:
+        str: Key to pass as ``idempotency_key``
+    """
+    digest = hashlib.sha256(
+        "|".join(str(part) for part in (kind, *parts)).encode()).hexdigest()
+    return f"{kind}-{digest}"
+
+
+# Short-lived cache of retrieved Stripe objects keyed by Stripe ID.
+# Webhook events and reconciliation invalidate the objects they touch.
+stripe_object_cache = TTLCache(ttl=STRIPE_OBJECT_CACHE_TTL_SECONDS)
+
+
+async def retrieve_stripe_object(resource: Any, object_id: Optional[str]) -> Optional[Any]:
+    """
+    Retrieve a Stripe object through the object cache.
+
+    The blocking Stripe call runs on the Stripe thread pool.
+
+    Args:
+        resource: Stripe resource class, e.g. stripe.PaymentIntent
+        object_id: Stripe ID of the object
+
+    Returns:
+        The Stripe object, or None if no ID was given
+    """
+    if not object_id:
+        return None
+
+    cached = stripe_object_cache.get(object_id)
+    if cached is not None:
+        return cached
+
+    obj = await call_stripe(resource.retrieve, object_id)
+    stripe_object_cache.set(object_id, obj)
+    return obj
+
+
+def invalidate_stripe_objects(obj: Any) -> None:
+    """Drop a webhook event's object and the objects it references from the cache."""
+    keys = [obj.get("id")]
+    for field in ("payment_intent", "charge", "latest_charge"):
+        value = obj.get(field)
+        keys.append(value.get("id") if isinstance(value, dict) else value)
+    stripe_object_cache.invalidate(*[key for key in keys if key])
@@ -0,0 +1,361 @@
+"""
+Background processing of stored Stripe webhook events.
+
+The webhook endpoint only verifies, persists and acknowledges events. This
+worker drains unprocessed rows from the stripe_events table with bounded
+concurrency and retries failed events with exponential backoff. The table
+is the durable queue: anything not yet processed when the process stops is
+picked up again on the next start.
+
+Before an event is processed its row is claimed with a conditional update
+of processing_started_at, so the worker, a replay and other processes never
+handle the same event at once. A claim older than the lease timeout is
+considered abandoned. Handlers make blocking Supabase calls and run on a
+dedicated, bounded thread pool instead of the event loop.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+import stripe
+from loguru import logger
+
+from app.supabase import get_supabase
+from app.utils.pagination import iter_keyset_pages
+
+STRIPE_EVENT_CONCURRENCY = int(os.getenv("STRIPE_EVENT_CONCURRENCY", "4"))
+STRIPE_EVENT_MAX_ATTEMPTS = int(os.getenv("STRIPE_EVENT_MAX_ATTEMPTS", "5"))
+STRIPE_EVENT_POLL_INTERVAL_SECONDS = float(
+    os.getenv("STRIPE_EVENT_POLL_INTERVAL_SECONDS", "30"))
+STRIPE_EVENT_BATCH_SIZE = 50
+MAX_RETRY_DELAY_SECONDS = 300
+MAX_REPLAY_ERRORS_REPORTED = 100
+# Seconds after which a claimed but unfinished event may be claimed again
+STRIPE_EVENT_LEASE_SECONDS = float(os.getenv("STRIPE_EVENT_LEASE_SECONDS", "300"))
+STRIPE_EVENT_THREAD_POOL_SIZE = int(
+    os.getenv("STRIPE_EVENT_THREAD_POOL_SIZE", str(STRIPE_EVENT_CONCURRENCY)))
+
+ProcessEvent = Callable[[stripe.Event, Any], Awaitable[None]]
+
+_executor = ThreadPoolExecutor(
+    max_workers=STRIPE_EVENT_THREAD_POOL_SIZE, thread_name_prefix="stripe-events")
+
+
+def event_from_row(row: Dict[str, Any]) -> stripe.Event:
+    """
+    Rebuild a Stripe event object from a stripe_events row.
+
+    Args:
+        row: Row with stripe_event_id, event_type and payload (the event's data)
+
+    Returns:
+        stripe.Event: Event with attribute access to its data object
+    """
+    return stripe.Event.construct_from({
+        "id": row["stripe_event_id"],
+        "object": "event",
+        "type": row["event_type"],
+        "data": row["payload"]
+    }, stripe.api_key)
+
+
+def _lease_filter() -> str:
+    """PostgREST or-filter matching rows that are not claimed by anyone."""
+    expired = (datetime.utcnow() - timedelta(seconds=STRIPE_EVENT_LEASE_SECONDS)).isoformat()
+    return f'processing_started_at.is.null,processing_started_at.lt."{expired}"'
+
+
+def claim_event(event_id: str) -> bool:
+    """
+    Claim an unprocessed event for processing.
+
+    Args:
+        event_id: Stripe event ID
+
+    Returns:
+        bool: True if this caller holds the claim, False if the event is
+            processed already or claimed by someone else
+    """
+    result = get_supabase().table("stripe_events").update({
+        "processing_started_at": datetime.utcnow().isoformat()
+    }).eq("stripe_event_id", event_id).eq(
+        "processed", False).or_(_lease_filter()).execute()
+    return bool(result.data)
+
+
+def _claim_and_process(process_event: ProcessEvent, event: stripe.Event) -> bool:
+    """Claim an event and run its handler. Runs on the event thread pool."""
+    if not claim_event(event.id):
+        return False
+    asyncio.run(process_event(event, get_supabase()))
+    return True
+
+
+async def run_event(process_event: ProcessEvent, event: stripe.Event) -> bool:
+    """
+    Claim an event and process it on the event thread pool.
+
+    Args:
+        process_event: Coroutine handling one event, e.g. process_stripe_event
+        event: Event to process
+
+    Returns:
+        bool: False if the event was skipped because it is processed already
+            or being processed elsewhere
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _claim_and_process, process_event, event)
+
+
+def record_event_error(event_id: str, error: Exception) -> None:
+    """Store the last processing error on a stripe_events row and release its claim."""
+    try:
+        get_supabase().table("stripe_events").update({
+            "error": str(error),
+            "processed": False,
+            "processing_started_at": None
+        }).eq("stripe_event_id", event_id).execute()
+    except Exception as update_error:
+        logger.error(
+            f"Failed to record error for webhook event {event_id}: {str(update_error)}")
+
+
+class StripeEventWorker:
+    """Drains unprocessed stripe_events rows in the background."""
+
+    def __init__(
+        self,
+        process_event: ProcessEvent,
+        concurrency: int = STRIPE_EVENT_CONCURRENCY,
+        max_attempts: int = STRIPE_EVENT_MAX_ATTEMPTS,
+        poll_interval: float = STRIPE_EVENT_POLL_INTERVAL_SECONDS,
+        batch_size: int = STRIPE_EVENT_BATCH_SIZE
+    ):
+        self.process_event = process_event
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+
+        self._in_flight: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def notify(self) -> None:
+        """Wake the worker up, e.g. right after a new event was stored."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def in_flight_ids(self) -> Set[str]:
+        """Return the IDs of events the worker is currently processing."""
+        return set(self._in_flight)
+
+    def _fetch_pending(self, limit: int, exclude_ids: list) -> list:
+        """Fetch unclaimed, unprocessed events that have not failed yet, oldest first."""
+        supabase = get_supabase()
+        query = supabase.table("stripe_events").select(
+            "stripe_event_id,event_type,payload").eq(
+            "processed", False).is_("error", "null").or_(_lease_filter())
+        if exclude_ids:
+            query = query.not_.in_("stripe_event_id", exclude_ids)
+        result = query.order("created_at").limit(limit).execute()
+        return result.data or []
+
+    async def _process_with_retries(self, row: Dict[str, Any]) -> None:
+        """Process one event, retrying with exponential backoff on failure."""
+        event_id = row["stripe_event_id"]
+        try:
+            event = event_from_row(row)
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    async with self._semaphore:
+                        if not await run_event(self.process_event, event):
+                            logger.info(
+                                f"Webhook event {event_id} is processed or claimed elsewhere, skipping")
+                    return
+                except Exception as e:
+                    logger.error(
+                        f"Error processing webhook event {event_id} (attempt {attempt}/{self.max_attempts}): {str(e)}")
+                    await asyncio.to_thread(record_event_error, event_id, e)
+
+                    if attempt == self.max_attempts or self._closing:
+                        logger.warning(
+                            f"Giving up on webhook event {event_id}, it is left for replay")
+                        return
+                    await asyncio.sleep(min(2 ** attempt, MAX_RETRY_DELAY_SECONDS))
+        finally:
+            self._in_flight.discard(event_id)
+
+    async def drain(self) -> int:
+        """
+        Schedule processing for pending events, up to the in-flight limit.
+
+        Returns:
+            int: Number of events scheduled
+        """
+        limit = self.batch_size - len(self._in_flight)
+        if limit <= 0:
+            return 0
+
+        try:
+            rows = await asyncio.to_thread(
+                self._fetch_pending, limit, list(self._in_flight))
+        except Exception as e:
+            logger.error(f"Failed to fetch pending webhook events: {str(e)}")
+            return 0
+
+        for row in rows:
+            self._in_flight.add(row["stripe_event_id"])
+            task = asyncio.create_task(self._process_with_retries(row))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        return len(rows)
+
+    async def _run(self) -> None:
+        """Background loop draining on notification or poll interval."""
+        while not self._closing:
+            # At most one batch of events is in flight at a time
+            if len(self._in_flight) >= self.batch_size and self._tasks:
+                await asyncio.wait(set(self._tasks), return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            limit = self.batch_size - len(self._in_flight)
+            scheduled = await self.drain()
+
+            # A full page means there is probably more waiting
+            if scheduled and scheduled >= limit:
+                continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def start(self) -> None:
+        """Start the background worker."""
+        if self._task is not None:
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Stripe event worker started with concurrency {self.concurrency}")
+
+    async def stop(self) -> None:
+        """
+        Stop the worker.
+
+        In-flight events are cancelled. They are still unprocessed in the
+        stripe_events table and are picked up again on the next start.
+        """
+        if self._task is None:
+            return
+
+        self._closing = True
+        self._wakeup.set()
+        self._task.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(self._task, *self._tasks, return_exceptions=True)
+        self._task = None
+        logger.info("Stripe event worker stopped")
+
+
+async def replay_unprocessed_events(
+    process_event: ProcessEvent,
+    parallelism: int = STRIPE_EVENT_CONCURRENCY,
+    page_size: int = 200,
+    failed_only: bool = True,
+    event_type: Optional[str] = None,
+    limit: Optional[int] = None,
+    skip_ids: Iterable[str] = ()
+) -> Dict[str, Any]:
+    """
+    Re-dispatch unprocessed stripe_events rows through the event handler.
+
+    Rows are scanned in keyset pages and each page is processed with up to
+    ``parallelism`` events in flight. Each event is tried once; failures are
+    recorded on the row and reported, so the replay can simply be run again.
+
+    Args:
+        process_event: Coroutine handling one event, e.g. process_stripe_event
+        parallelism: Maximum number of events processed concurrently
+        page_size: Number of rows fetched per database round trip
+        failed_only: Only replay events that have a recorded error. Otherwise
+            every unprocessed event is replayed.
+        event_type: Only replay events of this type
+        limit: Stop after this many events
+        skip_ids: Event IDs to leave alone, e.g. those the worker is processing
+
+    Returns:
+        dict: scanned, succeeded, failed, skipped (claimed elsewhere),
+            duration_seconds, events_per_second and errors (event ID to
+            error message, capped)
+    """
+    supabase = get_supabase()
+    skip = set(skip_ids)
+    semaphore = asyncio.Semaphore(parallelism)
+    stats: Dict[str, Any] = {
+        "scanned": 0, "succeeded": 0, "failed": 0, "skipped": 0, "errors": {}}
+
+    def build_query():
+        query = supabase.table("stripe_events").select(
+            "id,stripe_event_id,event_type,payload").eq("processed", False)
+        if failed_only:
+            query = query.not_.is_("error", "null")
+        if event_type:
+            query = query.eq("event_type", event_type)
+        return query
+
+    async def replay_one(row: Dict[str, Any]) -> None:
+        event_id = row["stripe_event_id"]
+        async with semaphore:
+            try:
+                if await run_event(process_event, event_from_row(row)):
+                    stats["succeeded"] += 1
+                else:
+                    stats["skipped"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                if len(stats["errors"]) < MAX_REPLAY_ERRORS_REPORTED:
+                    stats["errors"][event_id] = str(e)
+                await asyncio.to_thread(record_event_error, event_id, e)
+
+    started = time.monotonic()
+    pages = iter_keyset_pages(build_query, page_size=page_size)
+
+    while limit is None or stats["scanned"] < limit:
+        # Fetch the next page off the event loop
+        rows = await asyncio.to_thread(next, pages, None)
+        if rows is None:
+            break
+
+        rows = [row for row in rows if row["stripe_event_id"] not in skip]
+        if limit is not None:
+            rows = rows[:limit - stats["scanned"]]
+        stats["scanned"] += len(rows)
+
+        await asyncio.gather(*(replay_one(row) for row in rows))
+
+    duration = time.monotonic() - started
+    stats["duration_seconds"] = round(duration, 3)
+    stats["events_per_second"] = round(
+        stats["scanned"] / duration, 2) if duration > 0 else 0.0
+
+    logger.info(
+        f"Replayed {stats['scanned']} webhook events in {duration:.1f}s: "
+        f"{stats['succeeded']} succeeded, {stats['failed']} failed, "
+        f"{stats['skipped']} skipped")
+    return stats
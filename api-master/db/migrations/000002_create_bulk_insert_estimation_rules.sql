@@ -0,0 +1,21 @@
+-- Create function to insert estimation rules and their audit logs in one transaction
+CREATE OR REPLACE FUNCTION public.bulk_insert_estimation_rules(
+    rules JSONB,
+    audit_logs JSONB
+)
+RETURNS SETOF public.estimation_rules
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- Insert all audit entries in a single statement
+    INSERT INTO public.admin_audit_logs
+    SELECT * FROM jsonb_populate_recordset(NULL::public.admin_audit_logs, audit_logs);
+
+    -- Insert all rules in a single statement and return the created rows.
+    -- Any failure rolls back both inserts.
+    RETURN QUERY
+    INSERT INTO public.estimation_rules
+    SELECT * FROM jsonb_populate_recordset(NULL::public.estimation_rules, rules)
+    RETURNING *;
+END;
+$$;
@@ -0,0 +1,34 @@
+-- Create function to delete bookings, their dependent records and write audit logs in one transaction
+CREATE OR REPLACE FUNCTION public.delete_bookings_cascade(
+    p_booking_ids UUID[],
+    p_admin_user_id UUID,
+    p_action TEXT DEFAULT 'BOOKING_DELETE',
+    p_reason TEXT DEFAULT 'Admin deleted booking'
+)
+RETURNS SETOF UUID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- Remove dependent records first to satisfy foreign keys
+    DELETE FROM public.vision_analysis_results WHERE booking_id = ANY(p_booking_ids);
+    DELETE FROM public.quote_history WHERE booking_id = ANY(p_booking_ids);
+    DELETE FROM public.stripe_payments WHERE booking_id = ANY(p_booking_ids);
+    DELETE FROM public.media_uploads WHERE booking_id = ANY(p_booking_ids);
+    DELETE FROM public.customer_details WHERE booking_id = ANY(p_booking_ids);
+
+    -- Delete the bookings, record one audit entry per deleted booking and
+    -- return the deleted IDs. Any failure rolls back the whole cascade.
+    RETURN QUERY
+    WITH deleted AS (
+        DELETE FROM public.bookings
+        WHERE id = ANY(p_booking_ids)
+        RETURNING *
+    ), audit AS (
+        INSERT INTO public.admin_audit_logs
+            (id, admin_user_id, action, previous_value, new_value, reason, created_at)
+        SELECT gen_random_uuid(), p_admin_user_id, p_action, to_jsonb(deleted), NULL, p_reason, now()
+        FROM deleted
+    )
+    SELECT deleted.id FROM deleted;
+END;
+$$;
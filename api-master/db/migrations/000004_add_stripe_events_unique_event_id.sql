@@ -0,0 +1,10 @@
+-- Make stripe_event_id unique so webhook ingestion can dedupe with ON CONFLICT DO NOTHING
+
+-- Remove duplicates left by concurrent deliveries, keeping the earliest row
+DELETE FROM public.stripe_events a
+USING public.stripe_events b
+WHERE a.stripe_event_id = b.stripe_event_id
+  AND (a.created_at, a.id::text) > (b.created_at, b.id::text);
+
+CREATE UNIQUE INDEX IF NOT EXISTS stripe_events_stripe_event_id_key
+    ON public.stripe_events (stripe_event_id);
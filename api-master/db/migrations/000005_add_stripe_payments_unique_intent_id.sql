@@ -0,0 +1,11 @@
+-- Make stripe_payment_intent_id unique so retried payment creation maps onto one record
+
+-- Remove duplicate records for the same payment intent, keeping the earliest
+DELETE FROM public.stripe_payments a
+USING public.stripe_payments b
+WHERE a.stripe_payment_intent_id = b.stripe_payment_intent_id
+  AND (a.created_at, a.id::text) > (b.created_at, b.id::text);
+
+-- NULL intent IDs (checkout sessions not yet paid) are not considered equal
+CREATE UNIQUE INDEX IF NOT EXISTS stripe_payments_stripe_payment_intent_id_key
+    ON public.stripe_payments (stripe_payment_intent_id);
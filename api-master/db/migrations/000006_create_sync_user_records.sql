@@ -0,0 +1,44 @@
+-- Create function to sync a user's users and profiles rows in one round trip.
+-- Rows are only written when one of the synced fields actually changed.
+CREATE OR REPLACE FUNCTION public.sync_user_records(
+    p_id UUID,
+    p_email TEXT,
+    p_name TEXT,
+    p_phone TEXT,
+    p_role TEXT
+)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    users_written INTEGER;
+    profiles_written INTEGER;
+BEGIN
+    INSERT INTO public.users AS u (id, email, name, phone, role, created_at, updated_at)
+    VALUES (p_id, p_email, p_name, p_phone, p_role, now(), now())
+    ON CONFLICT (id) DO UPDATE
+        SET email = EXCLUDED.email,
+            name = EXCLUDED.name,
+            phone = EXCLUDED.phone,
+            role = EXCLUDED.role,
+            updated_at = now()
+        WHERE (u.email, u.name, u.phone, u.role)
+            IS DISTINCT FROM (EXCLUDED.email, EXCLUDED.name, EXCLUDED.phone, EXCLUDED.role);
+    GET DIAGNOSTICS users_written = ROW_COUNT;
+
+    INSERT INTO public.profiles AS p (id, email, name, phone, role, updated_at)
+    VALUES (p_id, p_email, p_name, p_phone, p_role, now())
+    ON CONFLICT (id) DO UPDATE
+        SET email = EXCLUDED.email,
+            name = EXCLUDED.name,
+            phone = EXCLUDED.phone,
+            role = EXCLUDED.role,
+            updated_at = now()
+        WHERE (p.email, p.name, p.phone, p.role)
+            IS DISTINCT FROM (EXCLUDED.email, EXCLUDED.name, EXCLUDED.phone, EXCLUDED.role);
+    GET DIAGNOSTICS profiles_written = ROW_COUNT;
+
+    -- True if either row was created or changed
+    RETURN users_written + profiles_written > 0;
+END;
+$$;
@@ -0,0 +1,12 @@
+-- Store per-image vision analysis under a content hash of the image so it can be reused
+ALTER TABLE public.vision_analysis_results
+    ADD COLUMN IF NOT EXISTS image_hash TEXT,
+    ADD COLUMN IF NOT EXISTS image_url TEXT;
+
+-- Lookup of prior analyses by image content
+CREATE INDEX IF NOT EXISTS vision_analysis_results_image_hash_idx
+    ON public.vision_analysis_results (image_hash);
+
+-- One analysis row per image per booking
+CREATE UNIQUE INDEX IF NOT EXISTS vision_analysis_results_booking_image_key
+    ON public.vision_analysis_results (booking_id, image_hash);
@@ -0,0 +1,3 @@
+-- Store a perceptual hash (64-bit dHash as hex) of each analysed image for near-duplicate lookup
+ALTER TABLE public.vision_analysis_results
+    ADD COLUMN IF NOT EXISTS phash TEXT;
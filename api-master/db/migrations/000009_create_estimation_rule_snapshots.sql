@@ -0,0 +1,12 @@
+-- Immutable, versioned snapshots of the active estimation rule set.
+-- Each distinct rule set (by content hash) is stored once and gets the next version.
+CREATE TABLE IF NOT EXISTS public.estimation_rule_snapshots (
+    version BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    rules JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Workers compiling the same rule set concurrently share one version
+CREATE UNIQUE INDEX IF NOT EXISTS estimation_rule_snapshots_content_hash_key
+    ON public.estimation_rule_snapshots (content_hash);
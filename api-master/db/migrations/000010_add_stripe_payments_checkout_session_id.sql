@@ -0,0 +1,7 @@
+-- Record the checkout session of a payment so retried checkout creation maps onto one record
+ALTER TABLE public.stripe_payments
+    ADD COLUMN IF NOT EXISTS stripe_checkout_session_id TEXT;
+
+-- NULL session IDs (payments created without checkout) are not considered equal
+CREATE UNIQUE INDEX IF NOT EXISTS stripe_payments_stripe_checkout_session_id_key
+    ON public.stripe_payments (stripe_checkout_session_id);
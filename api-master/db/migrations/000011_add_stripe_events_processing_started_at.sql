@@ -0,0 +1,4 @@
+-- Lease on a stripe_events row so only one worker or replay processes an event at a time.
+-- A lease older than the lease timeout belongs to a crashed process and may be taken over.
+ALTER TABLE public.stripe_events
+    ADD COLUMN IF NOT EXISTS processing_started_at TIMESTAMPTZ;
@@ -0,0 +1,68 @@
+-- Set-based bulk booking operations. Bookings are selected by ID list and/or
+-- filters inside the statement that changes them, so rows that start
+-- matching between a select and a write are not left out.
+
+-- Update the status of the matching bookings and return each updated
+-- booking with the status it had before the update
+CREATE OR REPLACE FUNCTION public.update_bookings_status(
+    p_status TEXT,
+    p_booking_ids UUID[] DEFAULT NULL,
+    p_status_filter TEXT DEFAULT NULL,
+    p_created_after TIMESTAMPTZ DEFAULT NULL,
+    p_created_before TIMESTAMPTZ DEFAULT NULL
+)
+RETURNS TABLE (id UUID, previous_status TEXT)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    WITH matching AS (
+        SELECT b.id, b.status
+        FROM public.bookings b
+        WHERE (p_booking_ids IS NULL OR b.id = ANY(p_booking_ids))
+          AND (p_status_filter IS NULL OR b.status = p_status_filter)
+          AND (p_created_after IS NULL OR b.created_at >= p_created_after)
+          AND (p_created_before IS NULL OR b.created_at < p_created_before)
+        FOR UPDATE
+    )
+    UPDATE public.bookings b
+    SET status = p_status
+    FROM matching
+    WHERE b.id = matching.id
+    RETURNING b.id, matching.status;
+END;
+$$;
+
+-- Delete the matching bookings with their dependent records and audit
+-- entries through delete_bookings_cascade, in one transaction
+CREATE OR REPLACE FUNCTION public.delete_matching_bookings(
+    p_admin_user_id UUID,
+    p_booking_ids UUID[] DEFAULT NULL,
+    p_status_filter TEXT DEFAULT NULL,
+    p_created_after TIMESTAMPTZ DEFAULT NULL,
+    p_created_before TIMESTAMPTZ DEFAULT NULL,
+    p_action TEXT DEFAULT 'BOOKING_BULK_DELETE',
+    p_reason TEXT DEFAULT 'Admin bulk deleted bookings'
+)
+RETURNS SETOF UUID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_booking_ids UUID[];
+BEGIN
+    SELECT COALESCE(array_agg(b.id), '{}')
+    INTO v_booking_ids
+    FROM (
+        SELECT id
+        FROM public.bookings
+        WHERE (p_booking_ids IS NULL OR id = ANY(p_booking_ids))
+          AND (p_status_filter IS NULL OR status = p_status_filter)
+          AND (p_created_after IS NULL OR created_at >= p_created_after)
+          AND (p_created_before IS NULL OR created_at < p_created_before)
+        FOR UPDATE
+    ) b;
+
+    RETURN QUERY
+    SELECT * FROM public.delete_bookings_cascade(v_booking_ids, p_admin_user_id, p_action, p_reason);
+END;
+$$;
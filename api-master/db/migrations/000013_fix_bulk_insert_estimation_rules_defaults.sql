@@ -0,0 +1,54 @@
+-- Insert into explicit column lists so keys missing from the payload fall
+-- back to the column defaults instead of being written as NULL
+CREATE OR REPLACE FUNCTION public.bulk_insert_estimation_rules(
+    rules JSONB,
+    audit_logs JSONB
+)
+RETURNS SETOF public.estimation_rules
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- Insert all audit entries in a single statement
+    INSERT INTO public.admin_audit_logs (
+        id, admin_user_id, action, previous_value, new_value, reason, created_at
+    )
+    SELECT
+        COALESCE(a.id, gen_random_uuid()),
+        a.admin_user_id,
+        a.action,
+        a.previous_value,
+        a.new_value,
+        a.reason,
+        COALESCE(a.created_at, now())
+    FROM jsonb_populate_recordset(NULL::public.admin_audit_logs, audit_logs) AS a;
+
+    -- Insert all rules in a single statement and return the created rows.
+    -- Any failure rolls back both inserts.
+    RETURN QUERY
+    INSERT INTO public.estimation_rules (
+        id, rule_name, rule_description, rule_type, min_value, max_value,
+        multiplier, active, currency, zipcode, postcode_prefix, base_rate,
+        hazard_surcharge, access_fee, dismantling_fee, created_at, updated_at
+    )
+    SELECT
+        COALESCE(r.id, gen_random_uuid()),
+        r.rule_name,
+        r.rule_description,
+        r.rule_type,
+        r.min_value,
+        r.max_value,
+        r.multiplier,
+        COALESCE(r.active, true),
+        COALESCE(r.currency, 'GBP'),
+        r.zipcode,
+        r.postcode_prefix,
+        r.base_rate,
+        r.hazard_surcharge,
+        r.access_fee,
+        r.dismantling_fee,
+        COALESCE(r.created_at, now()),
+        COALESCE(r.updated_at, now())
+    FROM jsonb_populate_recordset(NULL::public.estimation_rules, rules) AS r
+    RETURNING *;
+END;
+$$;
@@ -0,0 +1,11 @@
+"""Shared test configuration."""
+import os
+
+# The app reads its settings from the environment at import time
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_123")
+os.environ.setdefault("STRIPE_WEBHOOK_SECRET", "whsec_test_123")
+os.environ.setdefault("STRIPE_PUBLISHABLE_KEY", "pk_test_123")
+os.environ.setdefault("FRONTEND_URL", "http://localhost:3000")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "test-anon-key")
@@ -0,0 +1,116 @@
+"""Tests for minting and verifying anonymous booking tokens."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from jose import ExpiredSignatureError, jwt
+
+from app.routes import auth
+
+
+class FakeCustomerDetailsQuery:
+    """customer_details select supporting the eq and in_ filters used by the token check."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.rows = [row for row in self.rows if row[column] == value]
+        return self
+
+    def in_(self, column, values):
+        self.rows = [row for row in self.rows if row[column] in values]
+        return self
+
+    def execute(self):
+        return SimpleNamespace(data=self.rows)
+
+
+@pytest.fixture(autouse=True)
+def customer_details(monkeypatch):
+    rows = [
+        {"booking_id": "booking-1", "email": "jo@example.com"},
+        {"booking_id": "booking-2", "email": "jo@example.com"},
+        {"booking_id": "booking-3", "email": "sam@example.com"},
+    ]
+    monkeypatch.setattr(auth, "get_supabase", lambda: SimpleNamespace(
+        table=lambda name: FakeCustomerDetailsQuery(list(rows))))
+    return rows
+
+
+def _create(email, booking_ids):
+    return asyncio.run(auth.create_anonymous_token(email, booking_ids))
+
+
+def _encode(**claims):
+    now = datetime.now(timezone.utc)
+    claims = {"iat": now, "exp": now + timedelta(minutes=5), **claims}
+    return jwt.encode(claims, auth.auth_settings.SECRET_KEY,
+                      algorithm=auth.auth_settings.ALGORITHM)
+
+
+def test_token_round_trip_is_scoped_to_bookings():
+    token, expires_in = _create(None, ["booking-2", "booking-1", "booking-2"])
+
+    assert expires_in == auth.ANONYMOUS_TOKEN_EXPIRE_MINUTES * 60
+    assert auth.decode_anonymous_token(token) == {
+        "email": None,
+        "booking_ids": ["booking-1", "booking-2"],
+        "is_anonymous": True
+    }
+
+
+def test_token_with_matching_email():
+    token, _ = _create("jo@example.com", ["booking-1", "booking-2"])
+
+    claims = auth.decode_anonymous_token(token)
+    assert claims["email"] == "jo@example.com"
+    assert claims["booking_ids"] == ["booking-1", "booking-2"]
+
+
+def test_token_refused_for_bookings_of_another_email():
+    with pytest.raises(HTTPException) as error:
+        _create("jo@example.com", ["booking-1", "booking-3"])
+
+    assert error.value.status_code == 403
+    assert error.value.detail["booking_ids"] == ["booking-3"]
+
+
+def test_token_requires_a_booking():
+    with pytest.raises(ValueError):
+        _create(None, [])
+
+
+def test_expired_token_raises():
+    token = _encode(
+        type=auth.ANONYMOUS_TOKEN_TYPE,
+        booking_ids=["booking-1"],
+        exp=datetime.now(timezone.utc) - timedelta(seconds=1))
+
+    with pytest.raises(ExpiredSignatureError):
+        auth.decode_anonymous_token(token)
+
+
+def test_token_signed_with_another_key_is_rejected():
+    token = jwt.encode(
+        {"type": auth.ANONYMOUS_TOKEN_TYPE, "booking_ids": ["booking-1"]},
+        "another-secret", algorithm=auth.auth_settings.ALGORITHM)
+
+    assert auth.decode_anonymous_token(token) is None
+
+
+def test_non_anonymous_token_is_rejected():
+    assert auth.decode_anonymous_token(
+        _encode(type="access", booking_ids=["booking-1"])) is None
+
+
+def test_unscoped_anonymous_token_is_rejected():
+    assert auth.decode_anonymous_token(
+        _encode(type=auth.ANONYMOUS_TOKEN_TYPE, booking_ids=[])) is None
+    assert auth.decode_anonymous_token(
+        _encode(type=auth.ANONYMOUS_TOKEN_TYPE)) is None
@@ -0,0 +1,80 @@
+"""Tests for the streaming NDJSON and CSV export serializers."""
+import csv
+import io
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from app.routes.admin import EXPORT_RESOURCES, _export_csv, _export_ndjson
+
+COLUMNS = ("id", "status", "quote", "created_at")
+
+
+def _read_csv(chunks):
+    return list(csv.reader(io.StringIO("".join(chunks))))
+
+
+def test_csv_export_of_empty_table_has_header():
+    chunks = list(_export_csv(iter([]), COLUMNS))
+
+    assert _read_csv(chunks) == [list(COLUMNS)]
+
+
+def test_csv_export_writes_one_chunk_per_page():
+    pages = [
+        [{"id": "1", "status": "pending", "quote": None, "created_at": "2024-01-01"}],
+        [{"id": "2", "status": "confirmed", "quote": None, "created_at": "2024-01-02"}],
+    ]
+
+    chunks = list(_export_csv(iter(pages), COLUMNS))
+
+    assert len(chunks) == 3
+    assert _read_csv(chunks) == [
+        list(COLUMNS),
+        ["1", "pending", "", "2024-01-01"],
+        ["2", "confirmed", "", "2024-01-02"],
+    ]
+
+
+def test_csv_export_uses_known_columns():
+    # Missing columns are left blank and unknown ones dropped
+    pages = [[{"id": "1", "status": "pending", "internal": "x"}]]
+
+    rows = _read_csv(_export_csv(iter(pages), COLUMNS))
+
+    assert rows == [list(COLUMNS), ["1", "pending", "", ""]]
+
+
+def test_csv_export_writes_nested_values_as_json():
+    quote = {"breakdown": {"volume": 2.5}, "items": [1, 2]}
+    pages = [[{"id": "1", "status": "pending", "quote": quote, "created_at": None}]]
+
+    rows = _read_csv(_export_csv(iter(pages), COLUMNS))
+
+    assert json.loads(rows[1][2]) == quote
+
+
+def test_ndjson_export_writes_one_line_per_row():
+    pages = [
+        [{"id": "1", "amount": Decimal("19.99")}, {"id": "2", "amount": Decimal("5")}],
+        [{"id": "3", "created_at": datetime(2024, 1, 1, 12, 30)}],
+    ]
+
+    chunks = list(_export_ndjson(iter(pages)))
+
+    assert len(chunks) == 2
+    lines = "".join(chunks).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"id": "1", "amount": "19.99"},
+        {"id": "2", "amount": "5"},
+        {"id": "3", "created_at": "2024-01-01T12:30:00"},
+    ]
+
+
+def test_ndjson_export_of_empty_table_is_empty():
+    assert "".join(_export_ndjson(iter([]))) == ""
+
+
+def test_export_resources_include_their_cursor_column():
+    for table, columns in EXPORT_RESOURCES.values():
+        assert "id" in columns, table
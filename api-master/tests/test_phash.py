@@ -0,0 +1,56 @@
+"""Tests for the Hamming-distance BK-tree."""
+import random
+
+from app.utils.phash import BKTree, hamming_distance, hash_from_hex, hash_to_hex
+
+
+def test_search_empty_tree():
+    assert BKTree().search(0, 64) == []
+
+
+def test_search_returns_matches_within_distance_closest_first():
+    tree = BKTree()
+    tree.add(0b0000, "a")
+    tree.add(0b0001, "b")
+    tree.add(0b0111, "c")
+    tree.add(0b1111, "d")
+
+    assert tree.search(0b0000, 0) == [(0, "a")]
+    assert tree.search(0b0000, 1) == [(0, "a"), (1, "b")]
+    assert tree.search(0b0000, 3) == [(0, "a"), (1, "b"), (3, "c")]
+    assert tree.search(0b1110, 1) == [(1, "d")]
+
+
+def test_identical_hashes_keep_every_item():
+    tree = BKTree()
+    tree.add(42, "first")
+    tree.add(42, "second")
+
+    assert len(tree) == 2
+    assert sorted(tree.search(42, 0)) == [(0, "first"), (0, "second")]
+
+
+def test_search_matches_linear_scan():
+    rng = random.Random(7)
+    hashes = [rng.getrandbits(64) for _ in range(500)]
+    # Near-duplicates of some of the hashes
+    hashes += [value ^ (1 << rng.randrange(64)) for value in hashes[:50]]
+
+    tree = BKTree()
+    for index, value in enumerate(hashes):
+        tree.add(value, index)
+
+    for query in hashes[:20] + [rng.getrandbits(64) for _ in range(20)]:
+        for max_distance in (0, 2, 10, 24):
+            expected = sorted(
+                (hamming_distance(query, value), index)
+                for index, value in enumerate(hashes)
+                if hamming_distance(query, value) <= max_distance)
+            assert sorted(tree.search(query, max_distance)) == expected
+
+
+def test_hash_hex_round_trip():
+    value = 0x00ff00ff00ff00ff
+
+    assert hash_to_hex(value) == "00ff00ff00ff00ff"
+    assert hash_from_hex(hash_to_hex(value)) == value
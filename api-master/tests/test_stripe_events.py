@@ -0,0 +1,107 @@
+"""Tests for claiming stored Stripe events before processing."""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app.utils import stripe_events
+
+
+class FakeUpdate:
+    """Conditional update supporting the filters used by claim_event."""
+
+    def __init__(self, rows, values):
+        self.rows = rows
+        self.values = values
+        self.filters = []
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def or_(self, expression):
+        # Only the "col.is.null" and 'col.lt."value"' forms are needed here
+        conditions = []
+        for part in expression.split(","):
+            column, operator, value = part.split(".", 2)
+            if operator == "is" and value == "null":
+                conditions.append(lambda row, c=column: row.get(c) is None)
+            elif operator == "lt":
+                conditions.append(
+                    lambda row, c=column, v=value.strip('"'):
+                        row.get(c) is not None and row[c] < v)
+            else:
+                raise NotImplementedError(part)
+        self.filters.append(lambda row: any(check(row) for check in conditions))
+        return self
+
+    def execute(self):
+        matched = [row for row in self.rows if all(check(row) for check in self.filters)]
+        for row in matched:
+            row.update(self.values)
+        return SimpleNamespace(data=[dict(row) for row in matched])
+
+
+class FakeSupabase:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def table(self, name):
+        assert name == "stripe_events"
+        return SimpleNamespace(update=lambda values: FakeUpdate(self.rows, values))
+
+
+@pytest.fixture
+def event_row(monkeypatch):
+    row = {"stripe_event_id": "evt_1", "processed": False, "processing_started_at": None}
+    monkeypatch.setattr(stripe_events, "get_supabase", lambda: FakeSupabase([row]))
+    return row
+
+
+def _started(seconds_ago):
+    return (datetime.utcnow() - timedelta(seconds=seconds_ago)).isoformat()
+
+
+def test_claim_event_claims_unclaimed_event(event_row):
+    assert stripe_events.claim_event("evt_1")
+    assert event_row["processing_started_at"] is not None
+
+
+def test_claim_event_rejects_event_claimed_elsewhere(event_row):
+    assert stripe_events.claim_event("evt_1")
+    assert not stripe_events.claim_event("evt_1")
+
+
+def test_claim_event_rejects_claim_within_lease(event_row):
+    event_row["processing_started_at"] = _started(
+        stripe_events.STRIPE_EVENT_LEASE_SECONDS - 60)
+
+    assert not stripe_events.claim_event("evt_1")
+
+
+def test_claim_event_takes_over_expired_lease(event_row):
+    abandoned = _started(stripe_events.STRIPE_EVENT_LEASE_SECONDS + 60)
+    event_row["processing_started_at"] = abandoned
+
+    assert stripe_events.claim_event("evt_1")
+    assert event_row["processing_started_at"] > abandoned
+
+
+def test_claim_event_rejects_processed_event(event_row):
+    event_row["processed"] = True
+
+    assert not stripe_events.claim_event("evt_1")
+
+
+def test_claim_event_rejects_unknown_event(event_row):
+    assert not stripe_events.claim_event("evt_2")
+
+
+def test_recorded_error_releases_claim(event_row):
+    assert stripe_events.claim_event("evt_1")
+
+    stripe_events.record_event_error("evt_1", RuntimeError("boom"))
+
+    assert event_row["error"] == "boom"
+    assert event_row["processing_started_at"] is None
+    assert stripe_events.claim_event("evt_1")